@@ -0,0 +1,67 @@
+'''
+Compares a directory of timeline files with the same timelines converted to archives (see timeline_archive.py):
+disk usage, a sequential scan of every tweet, and random access to single users.
+
+Usage: python benchmark_archive.py json_files_dir [random_reads]
+'''
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+from timeline_archive import ArchiveWriter, TimelineArchive, zstandard
+from timeline_reader import list_timeline_files, TimelineFile
+import time
+
+RANDOM_READS = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+def get_disk_usage(paths):
+	return sum(os.path.getsize(path) for path in paths)
+
+def time_reads(name, size, get_timelines):
+	''' Reads every tweet of every timeline get_timelines yields '''
+	start = time.time()
+	timeline_count = 0
+	tweet_count = 0
+	for timeline in get_timelines():
+		timeline_count = timeline_count + 1
+		for tweet in timeline.tweets():
+			tweet_count = tweet_count + 1
+	elapsed = time.time() - start
+	print("{name:<28} {size_mb:8.1f} MB {elapsed:7.3f}s {timelines:>8.0f} timelines/s {tweets:>10.0f} tweets/s".format(
+		name=name,
+		size_mb=size / float(1 << 20),
+		elapsed=elapsed,
+		timelines=timeline_count / elapsed if elapsed else 0,
+		tweets=tweet_count / elapsed if elapsed else 0))
+
+input_json_dir = sys.argv[1]
+paths = list_timeline_files(input_json_dir)
+uid_paths = dict((os.path.basename(path).split(".")[0], path) for path in paths)
+rng = random.Random(0)
+sample = [rng.choice(sorted(uid_paths)) for i in range(RANDOM_READS)]
+
+print("{files} timeline files, {reads} random reads".format(files=len(paths), reads=RANDOM_READS))
+size = get_disk_usage(paths)
+time_reads("files, sequential", size, lambda: (TimelineFile(path) for path in paths))
+time_reads("files, random", size, lambda: (TimelineFile(uid_paths[uid]) for uid in sample))
+
+archive_root = tempfile.mkdtemp()
+try:
+	for compression in (["gz", "zst"] if zstandard is not None else ["gz"]):
+		archive_dir = os.path.join(archive_root, compression)
+		start = time.time()
+		with ArchiveWriter(archive_dir, compression) as archive:
+			for uid, path in uid_paths.items():
+				timeline = TimelineFile(path)
+				archive.add_timeline(uid, timeline.utc_timestamp, timeline.tweets())
+		print("converted to {compression} in {elapsed:.1f}s".format(compression=compression, elapsed=time.time() - start))
+
+		archive = TimelineArchive(archive_dir)
+		size = get_disk_usage([os.path.join(archive_dir, f) for f in os.listdir(archive_dir)])
+		time_reads("archive.{compression}, sequential".format(compression=compression), size, archive.timelines)
+		time_reads("archive.{compression}, random".format(compression=compression), size, lambda: (archive.get(uid) for uid in sample))
+		archive.close()
+finally:
+	shutil.rmtree(archive_root)
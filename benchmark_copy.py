@@ -0,0 +1,74 @@
+'''
+Compares Table.copy_rows (COPY FROM STDIN) against the old execute_batch INSERT path on a scratch table.
+
+Usage: python benchmark_copy.py db_config.txt [num_rows]
+'''
+
+import datetime
+import json
+import psycopg2
+from psycopg2 import extras as ext
+from sql_utils import Field, Table
+import sys
+import time
+
+NUM_ROWS = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+benchmark_fields = [
+	Field("tweetId", "BIGINT", is_primary_key=True),
+	Field("text", "TEXT"),
+	Field("truncated", "BOOLEAN"),
+	Field("favoriteCount", "BIGINT"),
+	Field("coordinates_x", "NUMERIC(16,8)"),
+	Field("lang", "VARCHAR(10)"),
+	Field("entities", "JSON"),
+	Field("createdAt", "TIMESTAMP")
+]
+benchmark_table = Table("Benchmark_Copy", benchmark_fields)
+
+def make_rows(num_rows):
+	created_at = datetime.datetime(2017, 8, 25, 12, 0, 0)
+	rows = []
+	for i in range(num_rows):
+		text = "Tweet number " + str(i) + " with \"quotes\", commas,\nnewlines and a stray \x00 byte"
+		entities = {"hashtags": [{"text": "harvey", "indices": [0, 7]}], "urls": [], "user_mentions": []}
+		coordinates_x = -95.3698 + i * 1e-6 if i % 10 == 0 else None
+		rows.append((i, text, i % 2 == 0, i % 100, coordinates_x, "en", json.dumps(entities), created_at))
+	return rows
+
+def time_load(db, cursor, load):
+	cursor.execute(benchmark_table.get_drop_statement(if_exists=True))
+	cursor.execute(benchmark_table.get_create_statement())
+	db.commit()
+
+	start = time.time()
+	load()
+	db.commit()
+	elapsed = time.time() - start
+
+	cursor.execute("SELECT COUNT(*) FROM " + benchmark_table.name)
+	assert cursor.fetchone()[0] == NUM_ROWS, "Row count mismatch after load"
+	return elapsed
+
+## Connecting to the database
+config = {}
+for line in open(sys.argv[1]).readlines():
+	key, value = line.strip().split("=")
+	config[key] = value
+db = psycopg2.connect(**config)
+cursor = db.cursor()
+
+rows = make_rows(NUM_ROWS)
+## execute_batch can't send a NUL byte at all, so give it the cleaned text like the uploaders do
+clean_rows = [(row[0], row[1].replace("\x00", "")) + row[2:] for row in rows]
+
+batch_seconds = time_load(db, cursor, lambda: ext.execute_batch(cursor, benchmark_table.get_insert_statement(), clean_rows))
+copy_seconds = time_load(db, cursor, lambda: benchmark_table.copy_rows(cursor, rows))
+
+cursor.execute(benchmark_table.get_drop_statement(if_exists=True))
+db.commit()
+
+print(str(NUM_ROWS) + " rows")
+print("execute_batch: {:.2f}s ({:.0f} rows/s)".format(batch_seconds, NUM_ROWS / batch_seconds))
+print("copy_rows:     {:.2f}s ({:.0f} rows/s)".format(copy_seconds, NUM_ROWS / copy_seconds))
+print("speedup:       {:.1f}x".format(batch_seconds / copy_seconds))
@@ -0,0 +1,65 @@
+'''
+Compares building Timelines rows with the compiled Table.extract_row against the old approach of one
+get_nested_value call per column, over the tweets in a directory of timeline JSON files.
+
+Usage: python benchmark_extraction.py json_files_dir [max_tweets]
+'''
+
+import sys
+from timeline_reader import list_timeline_files, TimelineFile
+import time
+from upload_flat_tweet_table import tweet_table
+
+MAX_TWEETS = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+
+def get_nested_value(_dict, path, default=None):
+	""" the path walker upload_flat_tweet_table.py used before fields declared paths (with its int/str digit check
+	fixed, since under Python 3 that check raised TypeError and every nested path came back as the default) """
+	parts = path.split(".")
+	num_parts = len(parts)
+	cur_dict = _dict
+	try:
+		for i in range(0, num_parts - 1):
+			part = parts[i]
+			if part[0] >= '0' and part[0] <= '9':
+				try:
+					part = int(part)
+				except ValueError:
+					pass
+			cur_dict = cur_dict[part]
+		return cur_dict[parts[num_parts - 1]]
+	except (KeyError, TypeError):
+		pass
+	return default
+
+def old_extract_row(tweet, context):
+	row = []
+	for field in tweet_table.fields:
+		if field.context_key:
+			value = context[field.context_key]
+		else:
+			value = get_nested_value(tweet, field.path)
+		if field.transform is not None and value is not None:
+			value = field.transform(value)
+		row.append(value)
+	return tuple(row)
+
+def time_extraction(name, extract, tweets, context):
+	start = time.time()
+	for tweet in tweets:
+		extract(tweet, context)
+	elapsed = time.time() - start
+	print("{name:<28} {elapsed:6.3f}s {rate:>10.0f} tweets/s".format(name=name, elapsed=elapsed, rate=len(tweets) / elapsed))
+
+input_json_dir = sys.argv[1]
+tweets = []
+for path in list_timeline_files(input_json_dir):
+	if len(tweets) >= MAX_TWEETS:
+		break
+	tweets.extend(TimelineFile(path).tweets())
+tweets = tweets[:MAX_TWEETS]
+context = {"collected_at": "2017-09-01 00:00:00", "collected_ts": None}
+
+print(str(len(tweets)) + " tweets, " + str(len(tweet_table.fields)) + " columns")
+time_extraction("get_nested_value per column", old_extract_row, tweets, context)
+time_extraction("Table.extract_row", tweet_table.extract_row, tweets, context)
@@ -0,0 +1,158 @@
+'''
+Times geo_query's bbox + time range queries on a synthetic corpus, with each kind of spatial index and with none
+(the scan baseline), checking that every mode finds exactly the same tweets.
+
+The corpus's timelines (see synthetic_tweets.py, with --coordinates of the original tweets geotagged somewhere in
+its Texas places) are loaded into a scratch table of their own, BENCHMARK_TABLE_NAME, with postgres_db's Tweet
+fields and its BRIN index on createdAt. The queries are random boxes of QUERY_DEGREES around points in those
+places, over random windows of QUERY_DAYS. postgis is only run when the extension is installed.
+
+Usage: python benchmark_geo.py db_config.txt [--users N] [--tweets N] [--coordinates F] [--queries N] [--seed N] [--keep-table] [--results FILE]
+'''
+
+import argparse
+import datetime
+from geo_query import get_index_mode, POSTGIS, SCAN, TILES, TweetGeoIndex
+import json
+import parallel_loader
+import postgres_db
+import random
+from sql_utils import Index, Table
+from synthetic_tweets import PLACES, SyntheticCorpus, TWEETS_PER_USER, UTC_TIMESTAMP
+import time
+from timestamp_utils import convert_timestring_to_timestamp
+
+BENCHMARK_TABLE_NAME = "Benchmark_GeoTweet"
+QUERY_DEGREES = [0.05, 0.2, 1.0] ## Bbox widths and heights
+QUERY_DAYS = [1, 7, 30] ## Time window lengths
+
+def get_plan(cursor, query, params):
+	''' The node types of a query's plan, outermost first, e.g. "Bitmap Heap Scan > BitmapOr > Bitmap Index Scan" '''
+	cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+	plan = cursor.fetchone()[0]
+	plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+	node_types = []
+	while plan:
+		node_types.append(plan["Node Type"])
+		plan = plan.get("Plans", [None])[0]
+	return " > ".join(node_types)
+
+def load_corpus(db, cursor, table, corpus, uids):
+	collectedAt = convert_timestring_to_timestamp(UTC_TIMESTAMP)
+	tweet_count = 0
+	for uid in uids:
+		tweet_count = tweet_count + table.copy_rows(cursor, (postgres_db.get_tweet_tuple(tweet, collectedAt) for tweet in corpus.get_timeline(uid)))
+	db.commit()
+	return tweet_count
+
+def make_queries(rng, first_time, last_time, count):
+	''' (bbox, time range) pairs, each box around a random point of a random place '''
+	queries = []
+	for i in range(count):
+		place_id, name, full_name, west, south, east, north = rng.choice(PLACES)
+		x, y = rng.uniform(west, east), rng.uniform(south, north)
+		half_size = rng.choice(QUERY_DEGREES) / 2
+		days = rng.choice(QUERY_DAYS)
+		start = first_time + datetime.timedelta(seconds=rng.uniform(0, max((last_time - first_time).total_seconds() - days * 86400, 0)))
+		queries.append(((x - half_size, y - half_size, x + half_size, y + half_size), (start, start + datetime.timedelta(days=days))))
+	return queries
+
+def run_queries(geo, queries):
+	''' Runs every query, returning the seconds each took and the sorted tweet ids each found '''
+	seconds = []
+	results = []
+	for bbox, time_range in queries:
+		start = time.perf_counter()
+		rows = geo.tweets_in_bbox(bbox, time_range, fields=["tweetId"])
+		seconds.append(time.perf_counter() - start)
+		results.append(sorted(row[0] for row in rows))
+	return seconds, results
+
+def get_percentile(values, fraction):
+	values = sorted(values)
+	return values[min(int(len(values) * fraction), len(values) - 1)]
+
+if __name__ == "__main__":
+	arg_parser = argparse.ArgumentParser()
+	arg_parser.add_argument("db_config")
+	arg_parser.add_argument("--users", type=int, default=200, help="users in the synthetic corpus")
+	arg_parser.add_argument("--tweets", type=float, default=TWEETS_PER_USER, help="mean tweets per synthetic timeline")
+	arg_parser.add_argument("--coordinates", type=float, default=0.2, help="fraction of original tweets with coordinates")
+	arg_parser.add_argument("--queries", type=int, default=200)
+	arg_parser.add_argument("--seed", type=int, default=0)
+	arg_parser.add_argument("--keep-table", action="store_true", help="leave the benchmark table in the database afterwards")
+	arg_parser.add_argument("--results", default=None, help="append a JSON line with the results to this file")
+	args = arg_parser.parse_args()
+
+	db = parallel_loader.connect(args.db_config)
+	cursor = db.cursor()
+	table = Table(BENCHMARK_TABLE_NAME, postgres_db.tweet_table_fields, indexes=[Index(["createdAt"], method="brin")])
+	cursor.execute(table.get_drop_statement(if_exists=True))
+	cursor.execute(table.get_create_statement())
+	for statement in table.get_index_statements():
+		cursor.execute(statement)
+	db.commit()
+
+	start = time.time()
+	corpus = SyntheticCorpus(args.seed, tweets_per_user=args.tweets, coordinates_fraction=args.coordinates)
+	tweet_count = load_corpus(db, cursor, table, corpus, range(1000, 1000 + args.users))
+	cursor.execute("SELECT COUNT(*), MIN({created_at}), MAX({created_at}) FROM {table_name} WHERE {x} IS NOT NULL".format(
+		created_at=table.get_field("createdAt").name, table_name=table.name, x=table.get_field("coordinates_x").name))
+	geotagged_count, first_time, last_time = cursor.fetchone()
+	print("{tweets} tweets ({geotagged} with coordinates) from {users} synthetic timelines loaded in {elapsed:.1f}s".format(
+		tweets=tweet_count, geotagged=geotagged_count, users=args.users, elapsed=time.time() - start))
+
+	queries = make_queries(random.Random(args.seed), first_time, last_time, args.queries)
+	modes = [SCAN, TILES] + ([POSTGIS] if get_index_mode(cursor) == POSTGIS else [])
+	results = {}
+	expected = None
+	for mode in modes:
+		geo = TweetGeoIndex(cursor, table, mode)
+		start = time.time()
+		geo.create_index()
+		cursor.execute("ANALYZE " + table.name)
+		db.commit()
+		index_seconds = time.time() - start
+		index_mb = 0.0
+		if mode != SCAN:
+			cursor.execute("SELECT pg_relation_size(%s::regclass)", [geo.get_index_name()])
+			index_mb = cursor.fetchone()[0] / float(1 << 20)
+
+		plan = get_plan(cursor, *geo.get_bbox_query(*queries[0], fields=["tweetId"]))
+		seconds, found = run_queries(geo, queries)
+		db.rollback()
+		if expected is None:
+			expected = found
+		assert found == expected, mode + " found different tweets from " + modes[0]
+		for statement in geo.get_drop_statements():
+			cursor.execute(statement)
+		db.commit()
+
+		results[mode] = {
+			"index_seconds": round(index_seconds, 3),
+			"index_mb": round(index_mb, 2),
+			"total_seconds": round(sum(seconds), 4),
+			"mean_ms": round(1000 * sum(seconds) / len(seconds), 3),
+			"median_ms": round(1000 * get_percentile(seconds, 0.5), 3),
+			"p95_ms": round(1000 * get_percentile(seconds, 0.95), 3),
+			"plan": plan
+		}
+		print("{mode:<8} index {index_seconds:6.2f}s {index_mb:7.2f} MB   {queries} queries {total:7.3f}s   mean {mean:8.3f} ms   median {median:8.3f} ms   p95 {p95:8.3f} ms   {plan}".format(
+			mode=mode, index_seconds=index_seconds, index_mb=index_mb, queries=len(queries), total=sum(seconds),
+			mean=results[mode]["mean_ms"], median=results[mode]["median_ms"], p95=results[mode]["p95_ms"], plan=plan))
+	print("{found} tweets found in all, the same in every mode".format(found=sum(len(ids) for ids in expected)))
+
+	if not args.keep_table:
+		cursor.execute(table.get_drop_statement(if_exists=True))
+		db.commit()
+	db.close()
+
+	if args.results:
+		with open(args.results, "a") as f:
+			f.write(json.dumps({
+				"run_at": str(datetime.datetime.utcnow()),
+				"settings": {"users": args.users, "tweets": args.tweets, "coordinates": args.coordinates, "queries": args.queries, "seed": args.seed},
+				"tweets": tweet_count,
+				"geotagged": geotagged_count,
+				"modes": results
+			}) + "\n")
@@ -0,0 +1,205 @@
+'''
+Times each stage of the ingestion pipeline separately over a corpus of timeline files, reporting seconds,
+tweets/s and peak RSS per stage, so throughput can be tracked from one change to the next:
+
+	decode      reading and json-decoding the files (TimelineFile.tweets)
+	tuples      postgres_db's get_tweet_tuple / get_tweetuser_tuple
+	flat rows   upload_flat_tweet_table's tweet_table.extract_row
+	load        the Tweet / TweetUser tuples, COPYed into Postgres with --db-config (use a scratch database:
+	            rows go into postgres_db's tables), written as Parquet or Arrow files with --sink parquet|arrow
+	            (see table_sinks.py), or else formatted as COPY input; into --sink-dir, or discarded
+
+Without json_files_dir a synthetic corpus (see synthetic_tweets.py) is generated into a temporary directory
+first, from the same --seed each time. With --results, a JSON line with the settings, the git commit and every
+stage's numbers is appended to a file for comparing runs.
+
+Usage: python benchmark_pipeline.py [json_files_dir] [--users N] [--tweets N] [--retweets F] [--quotes F] [--seed N] [--db-config db_config.txt] [--sink copy|parquet|arrow] [--sink-dir DIR] [--results FILE]
+'''
+
+import argparse
+import datetime
+import json
+import os
+import parallel_loader
+import postgres_db
+import resource
+import shutil
+import subprocess
+import sys
+from sql_utils import get_copy_line
+from synthetic_tweets import QUOTE_FRACTION, RETWEET_FRACTION, SyntheticCorpus, TWEETS_PER_USER
+from table_sinks import PostgresSink, SINK_CLASSES
+import tempfile
+from timeline_reader import list_timeline_files, TimelineFile
+import time
+from timestamp_utils import cached_convert_timestring_to_timestamp
+import upload_flat_tweet_table
+
+STAGES = ["decode", "tuples", "flat rows", "load"]
+LOAD_TABLES = [postgres_db.tweet_table, postgres_db.tweetuser_table]
+
+def get_peak_rss_mb():
+	## ru_maxrss is in kilobytes on Linux and bytes on macOS
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak / float(1 << 20) if sys.platform == "darwin" else peak / 1024.0
+
+def get_commit():
+	try:
+		return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+class FileSink():
+	''' Formats rows exactly as Table.copy_rows would send them, into one <table>.csv per table (or nowhere) '''
+
+	def __init__(self, sink_dir=None):
+		self.files = {}
+		for table in LOAD_TABLES:
+			path = os.path.join(sink_dir, table.name.strip("\"") + ".csv") if sink_dir else os.devnull
+			self.files[table.name] = open(path, "w", encoding="utf-8")
+
+	def load(self, table_tuples):
+		for table, tuples in table_tuples:
+			json_flags = [field.is_json() for field in table.fields]
+			write = self.files[table.name].write
+			for row in tuples:
+				write(get_copy_line(row, json_flags))
+
+	def close(self):
+		for f in self.files.values():
+			f.close()
+
+class ColumnarSink():
+	''' Writes rows to one Parquet or Arrow file per table, into sink_dir or a temporary directory '''
+
+	def __init__(self, sink_format, sink_dir=None):
+		self.tmp_dir = None if sink_dir else tempfile.mkdtemp()
+		self.sink = SINK_CLASSES[sink_format](sink_dir or self.tmp_dir, LOAD_TABLES)
+
+	def load(self, table_tuples):
+		for table, tuples in table_tuples:
+			self.sink.write_rows(table, tuples)
+
+	def close(self):
+		self.sink.close()
+		if self.tmp_dir:
+			shutil.rmtree(self.tmp_dir)
+
+class DatabaseSink():
+	''' Loads rows the way postgres_db does, committing once per file '''
+
+	def __init__(self, db_config):
+		self.db = parallel_loader.connect(db_config)
+		cursor = self.db.cursor()
+		for table in LOAD_TABLES:
+			cursor.execute(table.get_create_statement(if_not_exists=True, deferrable_foreign_keys=True))
+		self.db.commit()
+
+	def load(self, table_tuples):
+		cursor = self.db.cursor()
+		postgres_db.insert_tuples(PostgresSink(cursor, on_conflict=postgres_db.ON_CONFLICT, use_copy=postgres_db.USE_COPY), table_tuples, {})
+		self.db.commit()
+		cursor.close()
+
+	def close(self):
+		self.db.close()
+
+def run_benchmark(paths, sink):
+	''' Runs every stage over one file at a time, returning ({stage: (seconds, peak RSS growth in MB)}, tweet count) '''
+	stage_seconds = dict((stage, 0.0) for stage in STAGES)
+	stage_rss = dict((stage, 0.0) for stage in STAGES)
+	tweet_count = 0
+
+	def finish_stage(stage, start, rss_before):
+		stage_seconds[stage] = stage_seconds[stage] + time.time() - start
+		stage_rss[stage] = stage_rss[stage] + get_peak_rss_mb() - rss_before
+		return time.time(), get_peak_rss_mb()
+
+	try:
+		for path in paths:
+			start, rss = time.time(), get_peak_rss_mb()
+			timeline = TimelineFile(path)
+			tweets = list(timeline.tweets())
+			tweet_count = tweet_count + len(tweets)
+			start, rss = finish_stage("decode", start, rss)
+
+			collectedAt = cached_convert_timestring_to_timestamp(timeline.utc_timestamp)
+			tweet_tuples = [postgres_db.get_tweet_tuple(tweet, collectedAt) for tweet in tweets]
+			tweetuser_tuples = [postgres_db.get_tweetuser_tuple(tweet, collectedAt) for tweet in tweets]
+			start, rss = finish_stage("tuples", start, rss)
+
+			context = {"collected_at": timeline.utc_timestamp, "collected_ts": collectedAt}
+			for tweet in tweets:
+				upload_flat_tweet_table.tweet_table.extract_row(tweet, context)
+			start, rss = finish_stage("flat rows", start, rss)
+
+			sink.load([(postgres_db.tweet_table, tweet_tuples), (postgres_db.tweetuser_table, tweetuser_tuples)])
+			finish_stage("load", start, rss)
+	finally:
+		## Columnar sinks write their last row groups on close, so that's part of the load
+		start, rss = time.time(), get_peak_rss_mb()
+		sink.close()
+		finish_stage("load", start, rss)
+
+	return dict((stage, (stage_seconds[stage], stage_rss[stage])) for stage in STAGES), tweet_count
+
+if __name__ == "__main__":
+	arg_parser = argparse.ArgumentParser()
+	arg_parser.add_argument("json_files_dir", nargs="?", default=None)
+	arg_parser.add_argument("--users", type=int, default=50, help="users in the synthetic corpus")
+	arg_parser.add_argument("--tweets", type=float, default=TWEETS_PER_USER, help="mean tweets per synthetic timeline")
+	arg_parser.add_argument("--retweets", type=float, default=RETWEET_FRACTION, help="fraction of synthetic tweets that are retweets")
+	arg_parser.add_argument("--quotes", type=float, default=QUOTE_FRACTION, help="fraction of synthetic tweets that quote another")
+	arg_parser.add_argument("--seed", type=int, default=0)
+	arg_parser.add_argument("--db-config", default=None, help="load into this (scratch) database instead of a file sink")
+	arg_parser.add_argument("--sink", choices=["copy"] + sorted(SINK_CLASSES), default="copy", help="the file sink's format: COPY input, Parquet or Arrow")
+	arg_parser.add_argument("--sink-dir", default=None, help="write the file sink's files here instead of discarding them")
+	arg_parser.add_argument("--results", default=None, help="append a JSON line with the results to this file")
+	args = arg_parser.parse_args()
+
+	corpus_dir = args.json_files_dir
+	settings = {"json_files_dir": corpus_dir}
+	if corpus_dir is None:
+		corpus_dir = tempfile.mkdtemp()
+		settings = {"users": args.users, "tweets": args.tweets, "retweets": args.retweets, "quotes": args.quotes, "seed": args.seed}
+		start = time.time()
+		corpus = SyntheticCorpus(args.seed, tweets_per_user=args.tweets, retweet_fraction=args.retweets, quote_fraction=args.quotes)
+		corpus.write(corpus_dir, range(1000, 1000 + args.users))
+		print("generated {users} synthetic timelines in {elapsed:.1f}s".format(users=args.users, elapsed=time.time() - start))
+
+	if args.db_config:
+		sink, sink_name = DatabaseSink(args.db_config), "database"
+	elif args.sink == "copy":
+		sink, sink_name = FileSink(args.sink_dir), "file"
+	else:
+		sink, sink_name = ColumnarSink(args.sink, args.sink_dir), args.sink
+	try:
+		paths = list_timeline_files(corpus_dir)
+		corpus_mb = sum(os.path.getsize(path) for path in paths) / float(1 << 20)
+		stages, tweet_count = run_benchmark(paths, sink)
+	finally:
+		if args.json_files_dir is None:
+			shutil.rmtree(corpus_dir)
+
+	print("{tweets} tweets in {files} files ({corpus_mb:.1f} MB), load into a {sink} sink".format(
+		tweets=tweet_count, files=len(paths), corpus_mb=corpus_mb, sink=sink_name))
+	for stage in STAGES:
+		seconds, rss_growth = stages[stage]
+		print("{stage:<12} {seconds:8.3f}s {rate:>10.0f} tweets/s   peak RSS +{rss_growth:.1f} MB".format(
+			stage=stage, seconds=seconds, rate=tweet_count / seconds if seconds else 0, rss_growth=rss_growth))
+	total_seconds = sum(seconds for seconds, rss_growth in stages.values())
+	print("{stage:<12} {seconds:8.3f}s {rate:>10.0f} tweets/s   peak RSS {peak:.1f} MB".format(
+		stage="total", seconds=total_seconds, rate=tweet_count / total_seconds if total_seconds else 0, peak=get_peak_rss_mb()))
+
+	if args.results:
+		with open(args.results, "a") as f:
+			f.write(json.dumps({
+				"run_at": str(datetime.datetime.utcnow()),
+				"commit": get_commit(),
+				"settings": settings,
+				"sink": sink_name,
+				"tweets": tweet_count,
+				"peak_rss_mb": round(get_peak_rss_mb(), 1),
+				"stages": dict((stage, {"seconds": round(seconds, 4), "tweets_per_second": round(tweet_count / seconds if seconds else 0), "peak_rss_growth_mb": round(rss_growth, 1)})
+					for stage, (seconds, rss_growth) in stages.items())
+			}) + "\n")
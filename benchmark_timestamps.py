@@ -0,0 +1,49 @@
+'''
+Micro-benchmark of timestamp parsing: the old dateutil parse + strftime against timestamp_utils, with and
+without the LRU cache, on a mix of unique tweet created_at values and repeated user created_at values.
+
+Usage: python benchmark_timestamps.py [num_values]
+'''
+
+import datetime
+from dateutil import parser
+import random
+import sys
+import time
+import timestamp_utils
+
+NUM_VALUES = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+def old_convert_timestring_to_timestamp(datetimestr):
+	datetime = parser.parse(datetimestr)
+	return datetime.strftime('%Y-%m-%d %H:%M:%S')
+
+def make_values(num_values):
+	random.seed(0)
+	start = datetime.datetime(2017, 8, 18)
+	twitter_format = "%a %b %d %H:%M:%S +0000 %Y"
+
+	## Every tweet has its own created_at, but a timeline repeats one user's created_at for every tweet
+	tweet_values = [(start + datetime.timedelta(seconds=random.randint(0, 30 * 86400))).strftime(twitter_format) for i in range(num_values)]
+	user_values = [(start - datetime.timedelta(days=(i // 200))).strftime(twitter_format) for i in range(num_values)]
+	return tweet_values, user_values
+
+def time_parser(name, convert, values):
+	start = time.time()
+	for value in values:
+		convert(value)
+	elapsed = time.time() - start
+	print("{name:<40} {elapsed:6.3f}s {rate:>12.0f} values/s".format(name=name, elapsed=elapsed, rate=len(values) / elapsed))
+	return elapsed
+
+tweet_values, user_values = make_values(NUM_VALUES)
+
+for label, values in [("unique tweet created_at", tweet_values), ("repeated user created_at", user_values)]:
+	print(label + " (" + str(len(values)) + " values)")
+	timestamp_utils.cached_convert_timestring_to_timestamp.cache_clear()
+	time_parser("  dateutil parse + strftime", old_convert_timestring_to_timestamp, values)
+	time_parser("  convert_timestring_to_timestamp", timestamp_utils.convert_timestring_to_timestamp, values)
+	time_parser("  cached_convert_timestring_to_timestamp", timestamp_utils.cached_convert_timestring_to_timestamp, values)
+
+	for value in values[:1000]:
+		assert timestamp_utils.convert_timestring_to_timestamp(value).strftime('%Y-%m-%d %H:%M:%S') == old_convert_timestring_to_timestamp(value)
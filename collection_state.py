@@ -0,0 +1,66 @@
+'''
+Per-user collection progress for the timeline collectors, kept in a small SQLite file next to the output so a
+run can pick up where the last one stopped instead of inferring "done" from which <uid>.json files exist.
+
+For each uid it records the status, the newest tweet id in the user's output file (the since_id for the next
+refresh), and for a fetch in progress the oldest id reached so far (so it resumes from max_id = oldest_id - 1)
+and the since_id it's fetching back to.
+
+Example:
+
+state = CollectionState("json_data/collection_state.sqlite3")
+state.start("12345")                          # or start("12345", since_id=newest_id) for a refresh
+state.record_progress("12345", oldest_id)     # after each batch of pages is safely on disk
+state.finish("12345", newest_id)
+print(state.get("12345")["status"])           # "done"
+
+'''
+
+import datetime
+import sqlite3
+
+COLLECTING = "collecting" ## a fetch is in progress (or was interrupted)
+DONE = "done"
+UNAVAILABLE = "unavailable" ## protected, suspended or deleted (401/404)
+FAILED = "failed" ## some other error; retried, from where it stopped, on the next run
+
+class CollectionState():
+
+	def __init__(self, path):
+		self.db = sqlite3.connect(path)
+		self.db.row_factory = sqlite3.Row
+		self.db.execute("CREATE TABLE IF NOT EXISTS user_state (uid TEXT PRIMARY KEY, status TEXT, newest_id INTEGER, oldest_id INTEGER, "
+			"since_id INTEGER, updated_at TEXT)")
+		self.db.commit()
+
+	def get(self, uid):
+		return self.db.execute("SELECT * FROM user_state WHERE uid = ?", (str(uid),)).fetchone()
+
+	def get_all(self):
+		return dict((row["uid"], row) for row in self.db.execute("SELECT * FROM user_state"))
+
+	def update(self, uid, **values):
+		values["updated_at"] = str(datetime.datetime.utcnow())
+		columns = sorted(values)
+		self.db.execute("INSERT INTO user_state (uid, {columns}) VALUES (?, {flags}) ON CONFLICT (uid) DO UPDATE SET {updates}".format(
+			columns=", ".join(columns),
+			flags=", ".join("?" for column in columns),
+			updates=", ".join("{column} = excluded.{column}".format(column=column) for column in columns)),
+			[str(uid)] + [values[column] for column in columns])
+		## Every change is committed straight away: it's what a crashed run resumes from
+		self.db.commit()
+
+	def start(self, uid, since_id=None):
+		self.update(uid, status=COLLECTING, oldest_id=None, since_id=since_id)
+
+	def record_progress(self, uid, oldest_id):
+		self.update(uid, oldest_id=oldest_id)
+
+	def finish(self, uid, newest_id):
+		self.update(uid, status=DONE, newest_id=newest_id, oldest_id=None, since_id=None)
+
+	def set_status(self, uid, status):
+		self.update(uid, status=status)
+
+	def close(self):
+		self.db.close()
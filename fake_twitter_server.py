@@ -0,0 +1,140 @@
+'''
+A local stand-in for the Twitter 1.1 REST API, for trying the collectors without real credentials or quota.
+Every user has a deterministic synthetic timeline (see synthetic_tweets.py) and account status, and every access
+token (the oauth_token in the Authorization header) gets its own rate-limit window with the usual x-rate-limit-*
+headers and 429s.
+
+Serves statuses/user_timeline, users/lookup and users/show. A user's status comes from the last digit of their
+id: 0 is suspended, 1 doesn't exist, 2 is protected and the rest are active.
+
+Usage: python fake_twitter_server.py [--port 8000] [--limit 900] [--window 900]
+
+Then point a TwitterClient at it:
+
+client = TwitterClient(pool, api_url="http://127.0.0.1:8000/1.1")
+
+'''
+
+import argparse
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+from synthetic_tweets import SyntheticCorpus
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+MAX_TIMELINE_TWEETS = 3200 ## the API never pages back further than this
+OAUTH_TOKEN = re.compile(r'oauth_token="([^"]*)"')
+
+## Some timelines run past what the API will page back through
+corpus = SyntheticCorpus(tweets_per_user=MAX_TIMELINE_TWEETS // 2, max_tweets=MAX_TIMELINE_TWEETS + 200)
+
+@functools.lru_cache(maxsize=1024)
+def get_timeline_ids(uid):
+	''' Tweet ids for a user, newest first (cached, since every page of a timeline needs them) '''
+	return corpus.get_timeline_ids(str(uid))
+
+def get_user_status(uid):
+	return {"0": "suspended", "1": "not found", "2": "protected"}.get(str(uid)[-1], "active")
+
+def make_user(uid):
+	user = corpus.make_user(uid)
+	user["protected"] = get_user_status(uid) == "protected"
+	return user
+
+def make_tweet(uid, tweet_id):
+	tweet = corpus.make_tweet(uid, tweet_id)
+	tweet["user"] = make_user(uid)
+	return tweet
+
+class RateLimits():
+
+	def __init__(self, limit, window):
+		self.limit = limit
+		self.window = window
+		self.windows = {} ## (token, endpoint) -> [remaining, reset]
+		self.lock = threading.Lock()
+
+	def take(self, token, endpoint):
+		''' Returns (allowed, remaining, reset) for one request '''
+		with self.lock:
+			now = time.time()
+			window = self.windows.get((token, endpoint))
+			if window is None or window[1] <= now:
+				window = [self.limit, int(now) + self.window]
+				self.windows[(token, endpoint)] = window
+			if window[0] <= 0:
+				return False, 0, window[1]
+			window[0] -= 1
+			return True, window[0], window[1]
+
+class FakeTwitterHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		params = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+		endpoint = url.path.split("/1.1/", 1)[-1].rsplit(".json", 1)[0]
+
+		match = OAUTH_TOKEN.search(self.headers.get("Authorization", ""))
+		allowed, remaining, reset = self.server.rate_limits.take(match.group(1) if match else "anonymous", endpoint)
+		headers = {"x-rate-limit-limit": self.server.rate_limits.limit, "x-rate-limit-remaining": remaining, "x-rate-limit-reset": reset}
+		if not allowed:
+			return self.send_json(429, {"errors": [{"code": 88, "message": "Rate limit exceeded"}]}, headers)
+
+		if endpoint == "statuses/user_timeline":
+			status = get_user_status(params["user_id"])
+			if status == "protected":
+				return self.send_json(401, {"errors": [{"code": 179, "message": "Sorry, you are not authorized to see this status."}]}, headers)
+			if status != "active":
+				return self.send_json(404, {"errors": [{"code": 34, "message": "Sorry, that page does not exist."}]}, headers)
+			return self.send_json(200, self.get_user_timeline(params), headers)
+		if endpoint == "users/lookup":
+			users = [make_user(uid) for uid in params["user_id"].split(",")[:100] if get_user_status(uid) in ("active", "protected")]
+			if not users:
+				return self.send_json(404, {"errors": [{"code": 17, "message": "No user matches for specified terms."}]}, headers)
+			return self.send_json(200, users, headers)
+		if endpoint == "users/show":
+			status = get_user_status(params["user_id"])
+			if status == "suspended":
+				return self.send_json(403, {"errors": [{"code": 63, "message": "User has been suspended."}]}, headers)
+			if status == "not found":
+				return self.send_json(404, {"errors": [{"code": 50, "message": "User not found."}]}, headers)
+			return self.send_json(200, make_user(params["user_id"]), headers)
+		return self.send_json(404, {"errors": [{"code": 34, "message": "Sorry, that page does not exist."}]}, headers)
+
+	def get_user_timeline(self, params):
+		uid = params["user_id"]
+		count = min(int(params.get("count", 20)), 200)
+		max_id = int(params["max_id"]) if "max_id" in params else None
+		since_id = int(params["since_id"]) if "since_id" in params else None
+
+		ids = [tweet_id for tweet_id in get_timeline_ids(uid)[:MAX_TIMELINE_TWEETS]
+			if (max_id is None or tweet_id <= max_id) and (since_id is None or tweet_id > since_id)]
+		return [make_tweet(uid, tweet_id) for tweet_id in ids[:count]]
+
+	def send_json(self, status, body, headers):
+		data = json.dumps(body).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		for key, value in headers.items():
+			self.send_header(key, str(value))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, format, *args):
+		pass
+
+if __name__ == "__main__":
+	arg_parser = argparse.ArgumentParser()
+	arg_parser.add_argument("--port", type=int, default=8000)
+	arg_parser.add_argument("--limit", type=int, default=900, help="requests per token per window")
+	arg_parser.add_argument("--window", type=int, default=900, help="window length in seconds")
+	args = arg_parser.parse_args()
+
+	server = ThreadingHTTPServer(("127.0.0.1", args.port), FakeTwitterHandler)
+	server.rate_limits = RateLimits(args.limit, args.window)
+	print("Fake Twitter API on http://127.0.0.1:{port}/1.1".format(port=args.port))
+	server.serve_forever()
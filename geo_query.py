@@ -0,0 +1,194 @@
+'''
+Bounding box (and time range) queries over the tweets' coordinates, backed by a spatial index on postgres_db's
+Tweet table. coordinates_x / coordinates_y are NUMERIC(16,8), which a plain btree can only narrow down one axis at
+a time, so the index is one of:
+
+	postgis   with the PostGIS extension installed (CREATE EXTENSION postgis), a GiST index over the coordinates
+	          as a geometry point, matched with && against the bbox as an envelope
+	tiles     otherwise, a "geoTile" column that Postgres computes from the coordinates (the tweet's cell in a grid
+	          of 1/TILES_PER_DEGREE degree tiles, numbered row by row from the south-west corner) and a btree
+	          index on ("geoTile", "createdAt"). A bbox becomes one range of tile numbers per row of tiles it
+	          covers, and the time range is checked inside the index
+	scan      no spatial index: the coordinates of every tweet in the time range are compared (the baseline)
+
+The indexes only cover tweets with coordinates, and the coordinates themselves are always compared as well, so
+every mode gives exactly the tweets inside the box (edges included). Adding the geoTile column rewrites the table
+once, under an exclusive lock; from then on Postgres fills it in for every row the loaders write.
+
+Usage: python geo_query.py db_config.txt [--mode postgis|tiles|scan] [--create-index] [--bbox WEST SOUTH EAST NORTH [--start TIME] [--end TIME]]
+
+Example:
+
+geo = TweetGeoIndex(cursor)                  # postgis if the extension is installed, tiles if not
+geo.create_index()
+rows = geo.tweets_in_bbox((-95.79, 29.52, -95.01, 30.11), (datetime.datetime(2017, 8, 25), datetime.datetime(2017, 9, 1)))
+print(get_tile_ranges((-95.79, 29.52, -95.01, 30.11)))   # [(4302842, 4302849), (4306442, 4306449), ...]
+
+'''
+
+import argparse
+import math
+import parallel_loader
+import postgres_db
+from timestamp_utils import convert_timestring_to_timestamp
+
+POSTGIS = "postgis"
+TILES = "tiles"
+SCAN = "scan"
+MODES = [POSTGIS, TILES, SCAN]
+
+TILES_PER_DEGREE = 10 ## Tiles are 0.1 degrees on a side (about 11 km north-south)
+TILE_ROWS = 180 * TILES_PER_DEGREE
+TILE_COLUMNS = 360 * TILES_PER_DEGREE
+TILE_FIELD = "\"geoTile\""
+## A bbox covering more rows of tiles than this is looked up as a single range, from its first tile to its last
+MAX_TILE_RANGES = 200
+SRID = 4326 ## WGS 84 longitude / latitude, which the coordinates are in
+## What tweets_in_bbox returns for each tweet
+RESULT_FIELDS = ["tweetId", "userId", "createdAt", "coordinates_x", "coordinates_y", "text"]
+
+def get_index_mode(cursor):
+	cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'postgis'")
+	return POSTGIS if cursor.fetchone() else TILES
+
+def get_tile_row(latitude):
+	## The same float arithmetic as get_tile_expression, so Python and Postgres always agree on a point's tile
+	return min(max(int(math.floor((float(latitude) + 90) * TILES_PER_DEGREE)), 0), TILE_ROWS - 1)
+
+def get_tile_column(longitude):
+	return min(max(int(math.floor((float(longitude) + 180) * TILES_PER_DEGREE)), 0), TILE_COLUMNS - 1)
+
+def get_tile(longitude, latitude):
+	return get_tile_row(latitude) * TILE_COLUMNS + get_tile_column(longitude)
+
+def get_tile_expression(x_field, y_field):
+	## GREATEST and LEAST skip NULLs, so tweets without coordinates are kept out explicitly (and out of the index)
+	return "CASE WHEN {x} IS NOT NULL AND {y} IS NOT NULL THEN LEAST(GREATEST(FLOOR(({y}::float8 + 90) * {tiles_per_degree}), 0), {max_row})::bigint * {columns} + LEAST(GREATEST(FLOOR(({x}::float8 + 180) * {tiles_per_degree}), 0), {max_column})::bigint END".format(
+		x=x_field,
+		y=y_field,
+		tiles_per_degree=TILES_PER_DEGREE,
+		max_row=TILE_ROWS - 1,
+		columns=TILE_COLUMNS,
+		max_column=TILE_COLUMNS - 1)
+
+def get_tile_ranges(bbox):
+	''' The (first, last) tile numbers of each row of tiles a (west, south, east, north) bbox covers '''
+	west, south, east, north = bbox
+	first_row, last_row = get_tile_row(south), get_tile_row(north)
+	first_column, last_column = get_tile_column(west), get_tile_column(east)
+	if last_row - first_row + 1 > MAX_TILE_RANGES:
+		return [(first_row * TILE_COLUMNS + first_column, last_row * TILE_COLUMNS + last_column)]
+	return [(row * TILE_COLUMNS + first_column, row * TILE_COLUMNS + last_column) for row in range(first_row, last_row + 1)]
+
+class TweetGeoIndex():
+	''' Builds and queries the spatial index of one mode (see above) on a tweet table with postgres_db's fields '''
+
+	def __init__(self, cursor, table=postgres_db.tweet_table, mode=None):
+		assert mode in MODES + [None], "Unknown geo index mode " + str(mode)
+		self.cursor = cursor
+		self.table = table
+		self.mode = mode or get_index_mode(cursor)
+		self.x_field = table.get_field("coordinates_x").name
+		self.y_field = table.get_field("coordinates_y").name
+		self.created_at_field = table.get_field("createdAt").name
+		self.has_coordinates = "{x} IS NOT NULL AND {y} IS NOT NULL".format(x=self.x_field, y=self.y_field)
+
+	def get_point_expression(self):
+		return "ST_SetSRID(ST_MakePoint({x}::float8, {y}::float8), {srid})".format(x=self.x_field, y=self.y_field, srid=SRID)
+
+	def get_index_name(self):
+		return self.table.name + ("_geoPoint_idx" if self.mode == POSTGIS else "_geoTile_createdAt_idx")
+
+	def get_index_statements(self, concurrently=False):
+		''' The statements that add this mode's index (CONCURRENTLY needs an autocommit connection) '''
+		if self.mode == SCAN:
+			return []
+		create_index = "CREATE INDEX{concurrently} IF NOT EXISTS {name} ON {table_name} USING".format(
+			concurrently=" CONCURRENTLY" if concurrently else "",
+			name=self.get_index_name(),
+			table_name=self.table.name)
+		if self.mode == POSTGIS:
+			## The index predicate is repeated word for word in every query, so the planner can tell it applies
+			return [create_index + " GIST (({point})) WHERE {has_coordinates};".format(point=self.get_point_expression(), has_coordinates=self.has_coordinates)]
+		return [
+			"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {tile_field} BIGINT GENERATED ALWAYS AS ({expression}) STORED;".format(
+				table_name=self.table.name,
+				tile_field=TILE_FIELD,
+				expression=get_tile_expression(self.x_field, self.y_field)),
+			create_index + " BTREE ({tile_field}, {created_at}) WHERE {tile_field} IS NOT NULL;".format(tile_field=TILE_FIELD, created_at=self.created_at_field)
+		]
+
+	def get_drop_statements(self):
+		''' Drops the index (the geoTile column stays, and the loaders keep filling it in) '''
+		if self.mode == SCAN:
+			return []
+		return ["DROP INDEX IF EXISTS {name};".format(name=self.get_index_name())]
+
+	def create_index(self, concurrently=False):
+		for statement in self.get_index_statements(concurrently):
+			self.cursor.execute(statement)
+
+	def get_bbox_query(self, bbox, time_range=None, fields=RESULT_FIELDS):
+		''' The SELECT for tweets_in_bbox and its parameters, e.g. to EXPLAIN it '''
+		west, south, east, north = [float(value) for value in bbox]
+		assert west <= east and south <= north, "bbox must be (west, south, east, north); split one that crosses the antimeridian in two"
+		start, end = time_range or (None, None)
+
+		conditions = [self.has_coordinates]
+		params = []
+		if self.mode == POSTGIS:
+			conditions.append("{point} && ST_MakeEnvelope(%s, %s, %s, %s, {srid})".format(point=self.get_point_expression(), srid=SRID))
+			params.extend([west, south, east, north])
+		elif self.mode == TILES:
+			tile_ranges = get_tile_ranges((west, south, east, north))
+			conditions.append("(" + " OR ".join([TILE_FIELD + " BETWEEN %s AND %s"] * len(tile_ranges)) + ")")
+			params.extend(tile for tile_range in tile_ranges for tile in tile_range)
+		## Compared as float8, like the tiles, so a point on a tile's edge can't fall between the two
+		conditions.append("{x}::float8 BETWEEN %s AND %s AND {y}::float8 BETWEEN %s AND %s".format(x=self.x_field, y=self.y_field))
+		params.extend([west, east, south, north])
+		if start is not None:
+			conditions.append(self.created_at_field + " >= %s")
+			params.append(start)
+		if end is not None:
+			conditions.append(self.created_at_field + " < %s")
+			params.append(end)
+
+		query = "SELECT {fields} FROM {table_name} WHERE {conditions}".format(
+			fields=", ".join(self.table.get_field(name).name for name in fields),
+			table_name=self.table.name,
+			conditions=" AND ".join(conditions))
+		return query, params
+
+	def tweets_in_bbox(self, bbox, time_range=None, fields=RESULT_FIELDS):
+		''' The fields of every tweet whose coordinates are inside bbox = (west, south, east, north), in no particular order,
+		created within time_range = (start, end) if given: from start (inclusive) to end (exclusive), either one None for no bound '''
+		query, params = self.get_bbox_query(bbox, time_range, fields)
+		self.cursor.execute(query, params)
+		return self.cursor.fetchall()
+
+if __name__ == "__main__":
+	arg_parser = argparse.ArgumentParser()
+	arg_parser.add_argument("db_config")
+	arg_parser.add_argument("--mode", choices=MODES, default=None, help="the index to build or use (by default postgis if it's installed, else tiles)")
+	arg_parser.add_argument("--create-index", action="store_true", help="add the index (and the geoTile column) if they aren't there yet")
+	arg_parser.add_argument("--bbox", type=float, nargs=4, metavar=("WEST", "SOUTH", "EAST", "NORTH"), default=None)
+	arg_parser.add_argument("--start", type=convert_timestring_to_timestamp, default=None, help="only tweets created at or after this (UTC)")
+	arg_parser.add_argument("--end", type=convert_timestring_to_timestamp, default=None, help="only tweets created before this (UTC)")
+	args = arg_parser.parse_args()
+
+	db = parallel_loader.connect(args.db_config)
+	cursor = db.cursor()
+	geo = TweetGeoIndex(cursor, mode=args.mode)
+
+	if args.create_index and geo.mode != SCAN:
+		geo.create_index()
+		db.commit()
+		print("{mode} index {name} on {table_name}".format(mode=geo.mode, name=geo.get_index_name(), table_name=geo.table.name))
+
+	if args.bbox:
+		rows = geo.tweets_in_bbox(args.bbox, (args.start, args.end))
+		for row in rows:
+			print("\t".join("" if value is None else str(value) for value in row))
+		print("{count} tweets".format(count=len(rows)))
+
+	db.close()
@@ -1,22 +1,35 @@
+import argparse
 import csv
 import datetime
 import json
+import metrics
 import os
+import requests
 import sys
 import time
-
-import tweepy
-from tweepy.auth import OAuthHandler
+from twitter_client import API_URL, LOOKUP_BATCH_SIZE, Token, TokenPool, TwitterClient, TwitterError
 
 '''
-Usage: python get_active_accounts.py input_list.csv twitter_config.txt
+Writes status_nodetable.csv with each user's account status (active, protected, suspended or not found).
+
+Users are looked up 100 at a time with users/lookup, which only returns active and protected accounts. Each id
+missing from a response is then checked on its own with users/show to tell suspended from not found. A batch whose
+users/lookup fails (a 5xx, a dropped connection) is checked user by user instead. Users whose status can't be told
+(an unexpected error) are written with an empty status.
+
+Rows are written to status_nodetable.csv as each batch (or, with --per-user, each 100 users) is done, so an
+interrupted run keeps what it got.
+
+Usage: python get_active_accounts.py input_list.csv twitter_config.txt [more_twitter_configs.txt ...] [--per-user] [--api-url URL] [--metrics-dir DIR]
 '''
 
-def get_input_list():
+RESOLVE_MISSING = True ## Check ids missing from users/lookup one by one (set to False to record them as "suspended or not found")
+
+def get_input_list(input_list):
 	uids = []
-	with open(sys.argv[1]) as f:
+	with open(input_list) as f:
 		reader = csv.reader(f)
-		reader.next()
+		next(reader)
 
 		for row in reader:
 			uid = row[0]
@@ -24,29 +37,12 @@ def get_input_list():
 
 	return uids
 
-def authenticate():
-	## Pulling twitter login credentials from "config" file
-	## The file should have the consumer key, consumer secret, access token, and access token secret in that order, separated by newlines.
-	config = open(sys.argv[2]).read().split()
-	consumer_key = config[0]
-	consumer_secret = config[1]
-	access_token = config[2]
-	access_token_secret = config[3]
-
-	## Authenticating
-	auth = OAuthHandler(consumer_key, consumer_secret)
-	auth.set_access_token(access_token, access_token_secret)
-
-	## Returning the authenticated API object
-	api = tweepy.API(auth)
-	return api
-
-def get_user_status(uid):
+def get_user_status(client, uid):
 	try:
-		user_data = api.get_user(user_id=uid)
-		return "protected" if user_data.protected else "active"
+		user_data = client.show_user(uid)
+		return "protected" if user_data["protected"] else "active"
 
-	except tweepy.TweepError as e:
+	except TwitterError as e:
 		if(e.api_code==63):
 			return "suspended"
 		if(e.api_code==50):
@@ -54,41 +50,89 @@ def get_user_status(uid):
 		if(e.api_code==179):
 			return "protected"
 
-def get_user_statuses(api, uids):
+	except requests.RequestException as e:
+		print("{uid}: {error}".format(uid=uid, error=e))
+
+def get_user_statuses(client, uids, on_chunk=None):
+	''' One users/show request per user. on_chunk, if given, gets the {uid: status} of every 100 users as they're done '''
 	user_statuses = {}
-	
-	## Pull user data for each user id from the Twitter apis
-	for index in range(0, len(uids), 100):
-		## Define a chunk of 100 user ids from the list (because the API only allows 100 users per request)
-		chunk = uids[index : index+100]
 
-		for uid in chunk:
-			user_status = get_user_status(uid)
-			user_statuses[uid] = user_status
+	for index in range(0, len(uids), LOOKUP_BATCH_SIZE):
+		chunk_statuses = dict((uid, get_user_status(client, uid)) for uid in uids[index : index+LOOKUP_BATCH_SIZE])
+		user_statuses.update(chunk_statuses)
+		if on_chunk is not None:
+			on_chunk(chunk_statuses)
 		print(index)
-		time.sleep(300)
 
 	## Return the dictionary
 	return user_statuses
 
-## Get the list of user ids we want to look up
-uids = get_input_list()
-
-## Get an authenticated Twitter API object
-api = authenticate()
+def get_user_statuses_batched(client, uids, on_chunk=None):
+	''' One users/lookup request per 100 users, plus a users/show request for each one it doesn't return. on_chunk,
+	if given, gets the {uid: status} of each batch as it's done '''
+	user_statuses = {}
 
-## Pull the protected status of still-active accounts (users missing from this dictionary have been deleted)
-user_statuses = get_user_statuses(api, uids)
+	for index in range(0, len(uids), LOOKUP_BATCH_SIZE):
+		## Define a chunk of 100 user ids from the list (because the API only allows 100 users per request)
+		chunk = uids[index : index+LOOKUP_BATCH_SIZE]
+		chunk_statuses = {}
+
+		try:
+			for user_data in client.lookup_users(chunk):
+				chunk_statuses[user_data["id_str"]] = "protected" if user_data["protected"] else "active"
+		except (TwitterError, requests.RequestException) as e:
+			## Rather than lose the batch (or the run), look its users up one by one
+			print("users/lookup failed for {count} users from {index} ({error}), checking them one by one".format(count=len(chunk), index=index, error=e))
+			metrics.count("lookup_failures_total")
+			chunk_statuses = dict((uid, get_user_status(client, uid)) for uid in chunk)
+
+		## users/lookup leaves out suspended and deleted accounts alike
+		for uid in chunk:
+			if uid not in chunk_statuses:
+				chunk_statuses[uid] = get_user_status(client, uid) if RESOLVE_MISSING else "suspended or not found"
+		user_statuses.update(chunk_statuses)
+		if on_chunk is not None:
+			on_chunk(chunk_statuses)
+		print(index)
 
-## Write a csv with the account statuses
-with open("status_nodetable.csv", "w+") as f:
-	writer = csv.writer(f)
-	writer.writerow(["id", "status"])
+	## Return the dictionary
+	return user_statuses
 
+def write_statuses(f, writer, user_statuses):
 	for uid, status in user_statuses.items():
 		writer.writerow([uid, status])
-
-
-
-
-
+		metrics.count("users_total", status=status)
+	f.flush()
+
+if __name__ == "__main__":
+	arg_parser = argparse.ArgumentParser()
+	arg_parser.add_argument("input_list")
+	arg_parser.add_argument("config_files", nargs="+", help="one Twitter credentials file per token")
+	arg_parser.add_argument("--per-user", action="store_true", help="look every user up with users/show instead of users/lookup")
+	arg_parser.add_argument("--api-url", default=API_URL)
+	arg_parser.add_argument("--metrics-dir", default=None, help="write JSON logs and a Prometheus file of the run's metrics here")
+	args = arg_parser.parse_args()
+	if args.metrics_dir:
+		metrics.configure(args.metrics_dir, "get_active_accounts")
+
+	## Get the list of user ids we want to look up
+	uids = get_input_list(args.input_list)
+
+	## Get a Twitter API client spread over the given credentials
+	client = TwitterClient(TokenPool([Token.from_config(config_file) for config_file in args.config_files]), api_url=args.api_url)
+
+	## Pull the account status of every user (None for users that hit an unexpected error), writing a csv of them as they come
+	start = time.time()
+	with open("status_nodetable.csv", "w+") as f:
+		writer = csv.writer(f)
+		writer.writerow(["id", "status"])
+		write_chunk = lambda chunk_statuses: write_statuses(f, writer, chunk_statuses)
+
+		if args.per_user:
+			get_user_statuses(client, uids, write_chunk)
+		else:
+			get_user_statuses_batched(client, uids, write_chunk)
+	print("{count} users in {elapsed:.0f}s".format(count=len(uids), elapsed=time.time() - start))
+	for limiter_metrics in client.pool.get_metrics():
+		print(limiter_metrics)
+	metrics.close()
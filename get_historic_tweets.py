@@ -2,7 +2,9 @@ import csv
 import datetime
 import json
 import os
+from rate_limiter import RateLimiter, rate_limited_pages
 import sys
+from timeline_writer import TimelineWriter
 import time
 
 import tweepy
@@ -13,11 +15,15 @@ Collects the k most recent tweets given a list of users and stores the tweets as
 
 Before using, set the value of CAP to be k and make sure all_uids contains a list of user ids.
 
+Each user's file is written page by page as the tweets arrive and renamed into place once complete (see
+timeline_writer.py); set OUTPUT_FORMAT to e.g. "ndjson.gz" for compressed newline-delimited files.
+
 Usage: python get_historic_tweets.py
 '''
 
 
 CAP = 3200 ## How many tweets to get per user (set to None for no cap, although I think Twitter will cap it anyways eventually)
+OUTPUT_FORMAT = "json" ## "json", "ndjson", or either with ".gz"/".zst"
 
 def authenticate():
 	## Pulling twitter login credentials from "config" file
@@ -36,31 +42,21 @@ def authenticate():
 	api = tweepy.API(auth)
 	return api
 
-def get_historic_tweets_from_id(uid,api):
+## Paces user_timeline requests from the rate-limit headers instead of sleeping a fixed second per page
+limiter = RateLimiter(name="statuses/user_timeline")
+
+def get_historic_tweets_from_id(uid,api,writer):
 	## Printing out the user id (for debugging)
 	print(uid)
 
-	## List of tweets we've collected so far
-	tweets = []
-
 	## The timeline is returned as pages of tweets (each page has 20 tweets, starting with the 20 most recent)
-	## If a cap has been set and our list of tweets gets to be longer than the cap, we'll stop collecting
-	try:
-		for page in tweepy.Cursor(api.user_timeline, id=uid, count=200).pages():
-			tweets.extend(page)
-			if CAP and len(tweets) >= CAP:
-				return tweets
-			## We get 900 requests per 15-minute window, or 1 request/second, so wait 1 second between each request just to be safe
-			time.sleep(1)
-	
-	except tweepy.RateLimitError:
-		## We received a rate limiting error, so wait 15 minutes
-		time.sleep(15*60)
-
-		## Try again
-		tweets = get_historic_tweets_from_id(uid,api)
-
-	return tweets
+	## Each page goes straight to the writer (converting each Status object from Tweepy to JSON)
+	## If a cap has been set and the number of tweets we've written gets to be more than the cap, we'll stop collecting
+	## (a rate limiting error waits for the window's reset and retries the same page, so nothing is lost)
+	for page in rate_limited_pages(limiter, api, tweepy.Cursor(api.user_timeline, id=uid, count=200).pages()):
+		writer.write_tweets(tweet._json for tweet in page)
+		if CAP and writer.tweet_count >= CAP:
+			return
 
 
 
@@ -91,23 +87,16 @@ for uid in uids_remaining:
 	utc_now = str(datetime.datetime.utcnow()) ## Get the timestamp of when we collected the tweets and convert it to a string so it can be stored in JSON
 
 	try:
-		## Pull the tweets using Tweepy
-		historic_tweets = get_historic_tweets_from_id(uid,api)
-
-		## Convert each Status object from Tweepy to JSON
-		historic_tweets = [tweet._json for tweet in historic_tweets]
-
-		## Add the uid and the timestamp to the JSON
-		data = {"user_id":uid, "utc_timestamp":utc_now, "historic_tweets":historic_tweets}
-
-		## Dump the JSON into a file with the name <uid>.json
-		with open("json_data_2/" + str(uid) + ".json", "w+") as data_file:
-			json.dump(data, data_file)
+		## Pull the tweets using Tweepy into a file with the name <uid>.json (with the uid and the timestamp at the top)
+		with TimelineWriter("json_data_2", uid, utc_now, OUTPUT_FORMAT) as writer:
+			get_historic_tweets_from_id(uid,api,writer)
 
 		## Print out how many tweets we've collected per user id (for debugging)
-		print(str(uid) + ': ' + str(len(historic_tweets)) + ' tweets collected')
+		print(str(uid) + ': ' + str(writer.tweet_count) + ' tweets collected')
 
 	## If we get a Tweepy error, print the uid and error and keep running
 	except tweepy.error.TweepError as ex:
 		print(uid)
 		print(ex)
+
+print(limiter.get_metrics())
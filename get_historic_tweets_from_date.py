@@ -1,9 +1,16 @@
+import argparse
+from collection_state import CollectionState, COLLECTING, DONE, FAILED, UNAVAILABLE
 import csv
 import datetime
 import json
+import metrics
 import os
+from rate_limiter import RateLimiter, rate_limited_pages
 import sys
+from timeline_reader import get_collected_at, get_timeline_extension, TimelineFile, TIMELINE_EXTENSIONS, TWEET_TIMESTAMP_KEY
+from timeline_writer import TimelineWriter
 import time
+from timestamp_utils import convert_timestring_to_timestamp, get_snowflake_id
 
 import tweepy
 from tweepy.auth import OAuthHandler
@@ -13,24 +20,33 @@ Collects the tweets tweeted since the given date given a list of users and store
 
 Before using, set the value of FROM_DATE_STR and make sure all_uids contains a list of user ids.
 
-Usage: python get_historic_tweets_from_date.py input_list_of_ids.csv output_json_dir/ twitter_config.txt
+Progress is kept per user in output_json_dir/collection_state.sqlite3, and fetched tweets are appended to
+<uid>.partial.jsonl as they come in, so an interrupted run resumes each user from the oldest tweet it reached.
+With --refresh, users that are already done get only the tweets newer than their newest one (since_id), merged
+into their existing <uid>.json. The file's utc_timestamp becomes the refresh's, and each tweet carried over from the
+old file keeps the time it was collected at on itself (see timeline_reader.get_collected_at), so the loaders don't
+take it for a newer copy.
+
+Usage: python get_historic_tweets_from_date.py input_list_of_ids.csv output_json_dir/ twitter_config.txt [--refresh] [--metrics-dir DIR]
 '''
 
 
 FROM_DATE_STR = "Fri Aug 18 00:00:00 +0000 2017"
 
-input_list = sys.argv[1]
-output_dir = sys.argv[2]
-config_file = sys.argv[3]
-
-def convert_str_to_datetime(datetime_str):
-	date_format = "%a %b %d %H:%M:%S +0000 %Y"
-	return datetime.datetime.strptime(datetime_str, date_format)
+STATE_FILE_NAME = "collection_state.sqlite3"
+PARTIAL_SUFFIX = ".partial.jsonl"
+OUTPUT_FORMAT = "json" ## "json", "ndjson", or either with ".gz"/".zst" (see timeline_writer.py)
+PAGES_PER_CHECKPOINT = 1 ## Pages of up to 200 tweets fetched between saves of a user's progress
 
 def get_now():
 	return datetime.datetime.utcnow()
 
-from_date = convert_str_to_datetime(FROM_DATE_STR)
+## Tweet ids are Snowflake ids, which start with their creation time, so "tweeted on or after FROM_DATE_STR" is just
+## "id >= from_id" and no tweet's created_at needs parsing
+from_id = get_snowflake_id(convert_timestring_to_timestamp(FROM_DATE_STR))
+
+## Paces user_timeline requests from the rate-limit headers instead of sleeping a fixed second per page
+limiter = RateLimiter(name="statuses/user_timeline")
 
 def authenticate():
 	## Pulling twitter login credentials from "config" file
@@ -49,80 +65,182 @@ def authenticate():
 	api = tweepy.API(auth)
 	return api
 
-## Gets 3200 of the most recent tweets associated with the given uid before before_id
-## (or the 3200 most recent tweets if before_id is None)
-## Returns the minimum id of the list of tweets (i.e. the id corresponding to the earliest tweet)
-def get_historic_tweets_before_id(api, uid, max_id=None):
+def count_tweets_since(tweets, min_id):
+	''' How many of a page's tweets (newest first) have ids of at least min_id: they're always a prefix of the page '''
+	low, high = 0, len(tweets)
+	while low < high:
+		middle = (low + high) // 2
+		if tweets[middle]["id"] >= min_id:
+			low = middle + 1
+		else:
+			high = middle
+	return low
+
+## Gets 3200 of the most recent tweets associated with the given uid up to max_id
+## (or the 3200 most recent tweets if max_id is None), and newer than since_id if it's given
+## Returns the minimum id of the list of tweets (i.e. the id corresponding to the earliest tweet), whether we're finished,
+## the tweets, and the status to record if the user couldn't be collected
+def get_historic_tweets_before_id(api, uid, max_id=None, since_id=None, num_pages=16):
 	## Printing out the user id (for debugging)
 	#print(uid)
 
 	## List of tweets we've collected so far
 	tweets = []
 	finished = False
+	pages_fetched = 0
 
 	## The timeline is returned as pages of tweets (each page has 20 tweets, starting with the 20 most recent)
 	## If a cap has been set and our list of tweets gets to be longer than the cap, we'll stop collecting
 	cursor_args = {"id": uid, "count": 200}
 	if max_id:
 		cursor_args["max_id"] = max_id
+	if since_id:
+		cursor_args["since_id"] = since_id
 
 	try:
-		for page in tweepy.Cursor(api.user_timeline, **cursor_args).pages(16):
+		## A rate limiting error waits for the window's reset and retries the same page
+		for page in rate_limited_pages(limiter, api, tweepy.Cursor(api.user_timeline, **cursor_args).pages(num_pages)):
 			## Adding the tweets to the list
 
 			json_tweets = [tweet._json for tweet in page]
+			pages_fetched = pages_fetched + 1
 
-			if any(convert_str_to_datetime(tweet['created_at']) < from_date for tweet in json_tweets) or len(page)==1:
+			if json_tweets and json_tweets[-1]['id'] < from_id:
 				## We've already gone as far back as we need to, so quit looping through pages of tweets
 				finished = True
 				## Filter out any older tweets
-				json_tweets = [tweet for tweet in json_tweets if convert_str_to_datetime(tweet['created_at']) >= from_date]
-			else:
-				## We get 900 requests per 15-minute window, or 1 request/second, so wait 1 second between each request just to be safe
-				time.sleep(1)
+				json_tweets = json_tweets[:count_tweets_since(json_tweets, from_id)]
 
 			tweets.extend(json_tweets)
 
 			if finished:
 				break
+		else:
+			## The cursor stopped before num_pages: there's nothing older to ask for
+			finished = pages_fetched < num_pages
 	
 	except tweepy.error.TweepError as ex:
-		## We received a rate limiting error, so wait 15 minutes
-		if "429" in str(ex): # a hacky way to see if it's a rate limiting error
-			time.sleep(15*60)
-			print("rate limited :/")
-
-			## Try again
-			return get_historic_tweets_before_id(api, uid, max_id)
-		elif any(code in str(ex) for code in ["401", "404"]):
-			return (None, True, [])
+		if any(code in str(ex) for code in ["401", "404"]):
+			return (None, True, [], UNAVAILABLE)
 			
 		else:
 			print(uid)
 			print(ex)
-			return (None, True, [])
+			return (None, True, [], FAILED)
 
 	if tweets:
-		max_id = tweets[0]['id']
-		for tweet in tweets[1:]:
-			if tweet['id'] < max_id:
-				max_id = tweet['id']
-
-		return (max_id, finished, tweets)
+		## Pages come newest first, so the oldest tweet is the last one
+		return (tweets[-1]['id'], finished, tweets, None)
 	
 	else:
-		return (None, True, [])
-
-## Get a uid's tweets since FROM_DATE
-def get_historic_tweets(api, uid):
-	max_id, finished, tweets = None, False, []
+		return (None, True, [], None)
+
+def get_output_path(uid):
+	## The user's existing output file in whichever format it was written, or None
+	for extension in TIMELINE_EXTENSIONS:
+		path = os.path.join(output_dir, str(uid) + "." + extension)
+		if os.path.exists(path):
+			return path
+	return None
+
+def get_partial_path(uid):
+	return os.path.join(output_dir, str(uid) + PARTIAL_SUFFIX)
+
+def append_partial(uid, tweets):
+	## One tweet per line, flushed to disk before the state says we got this far
+	with open(get_partial_path(uid), "a") as partial_file:
+		for tweet in tweets:
+			partial_file.write(json.dumps(tweet) + "\n")
+		partial_file.flush()
+		os.fsync(partial_file.fileno())
+
+def read_partial(uid):
+	''' Yields the partial file's tweets one at a time: newest first, since each page was fetched below the one before '''
+	if not os.path.exists(get_partial_path(uid)):
+		return
+	with open(get_partial_path(uid)) as partial_file:
+		for line in partial_file:
+			## A line cut off by a crash mid-write was never recorded as progress, so it's fetched again anyway
+			if line.endswith("\n"):
+				yield json.loads(line)
+
+def remove_partial(uid):
+	if os.path.exists(get_partial_path(uid)):
+		os.remove(get_partial_path(uid))
+
+def get_newest_id(uid):
+	## For users collected before there was a state file
+	if not get_output_path(uid):
+		return None
+	return max([tweet["id"] for tweet in TimelineFile(get_output_path(uid)).tweets()] or [None])
+
+def get_carried_tweets(timeline, max_id):
+	''' The tweets in the user's existing file older than max_id, each stamped with when it was collected '''
+	for tweet in timeline.tweets():
+		if tweet["id"] < max_id:
+			tweet[TWEET_TIMESTAMP_KEY] = get_collected_at(timeline, tweet)
+			yield tweet
+
+def write_output(uid, tweets):
+	''' Streams the new tweets (newest first) into the user's file, followed by the older ones already there. Returns
+	(the newest id, how many new tweets), or (None, 0) with the file left as it was if there were none '''
+	## Get the timestamp of when we collected the tweets and convert it to a string so it can be stored in JSON
+	utc_now = str(get_now())
+
+	## The new file is written next to the old one and renamed over it, so a crash never leaves half of one
+	existing_path = get_output_path(uid)
+	writer = TimelineWriter(output_dir, uid, utc_now, OUTPUT_FORMAT)
+	newest_id, oldest_id = None, None
+	try:
+		for tweet in tweets:
+			if oldest_id is not None and tweet["id"] >= oldest_id:
+				## A page appended again after a crash kept its progress from being recorded
+				continue
+			newest_id = newest_id or tweet["id"]
+			oldest_id = tweet["id"]
+			writer.write_tweets((tweet,))
+		tweet_count = writer.tweet_count
+		if newest_id is not None and existing_path:
+			## Everything already there is older than what we just fetched back to
+			writer.write_tweets(get_carried_tweets(TimelineFile(existing_path), oldest_id))
+	except BaseException:
+		writer.abort()
+		raise
+	if newest_id is None:
+		writer.abort()
+		return (None, 0)
+
+	writer.close()
+	if existing_path and existing_path != writer.path:
+		os.remove(existing_path)
+	return (newest_id, tweet_count)
+
+## Get a uid's tweets since FROM_DATE (or since since_id), resuming below oldest_id if an earlier run got that far
+def collect_user(api, state, uid, since_id=None, oldest_id=None):
+	max_id = oldest_id - 1 if oldest_id else None
+	finished = False
 	while not finished:
-		max_id, finished, returned_tweets = get_historic_tweets_before_id(api, uid, max_id)
+		min_id, finished, returned_tweets, status = get_historic_tweets_before_id(api, uid, max_id, since_id, PAGES_PER_CHECKPOINT)
+		if status:
+			state.set_status(uid, status)
+			if status == UNAVAILABLE:
+				## Never resumed, so its tweets would sit there for good (a FAILED user picks up from them next run)
+				remove_partial(uid)
+			return
 
 		if returned_tweets:
-			tweets.extend(returned_tweets)
+			append_partial(uid, returned_tweets)
+			state.record_progress(uid, min_id)
+			max_id = min_id - 1
 
-	return tweets
+	## With no new tweets the output file (if any) is left as it is, still newest at since_id
+	newest_id, tweet_count = write_output(uid, read_partial(uid))
+	state.finish(uid, newest_id or since_id)
+	remove_partial(uid)
+	print(str(uid) + ': ' + str(tweet_count) + ' new tweets collected')
+	metrics.count("tweets_collected_total", tweet_count)
+	metrics.log_event("user", uid=uid, tweets=tweet_count)
+	metrics.flush()
 
 
 
@@ -130,36 +248,59 @@ def get_historic_tweets(api, uid):
 """"""
 """"""
 
-## Get an authenticated API object
-api = authenticate()
-
-## Load list of uids to collect
-all_uids = []
-with open(input_list) as f:
-	reader = csv.reader(f)
-	for row in reader:
-		all_uids.append(row[0])
-
-## Get a list of uids we've already collected by seeing which JSON files we have (so we don't collect on the same users twice)
-completed_uids = set([fname.split('.')[0] for fname in os.listdir(output_dir)])
-
-
-## Figure out which uids are left
-uids_remaining = set(all_uids) - completed_uids
-print(len(uids_remaining))
-
-## Loop through the list of remaining uids					
-for uid in uids_remaining:
-	utc_now = str(get_now()) ## Get the timestamp of when we collected the tweets and convert it to a string so it can be stored in JSON
-
-	## Pull the tweets using Tweepy
-	historic_tweets = get_historic_tweets(api, uid)
-
-	if historic_tweets:
-		## Add the uid and the timestamp to the JSON
-		data = {"user_id":uid, "utc_timestamp":utc_now, "historic_tweets":historic_tweets}
-
-		## Dump the JSON into a file with the name <uid>.json
-		with open(output_dir + "/" + str(uid) + ".json", "w+") as data_file:
-			json.dump(data, data_file)
+if __name__ == "__main__":
+	arg_parser = argparse.ArgumentParser()
+	arg_parser.add_argument("input_list")
+	arg_parser.add_argument("output_dir")
+	arg_parser.add_argument("config_file")
+	arg_parser.add_argument("--refresh", action="store_true", help="fetch tweets newer than the ones already collected for finished users")
+	arg_parser.add_argument("--metrics-dir", default=None, help="write JSON logs and a Prometheus file of the run's metrics here")
+	args = arg_parser.parse_args()
+	if args.metrics_dir:
+		metrics.configure(args.metrics_dir, "get_historic_tweets_from_date")
+
+	input_list = args.input_list
+	output_dir = args.output_dir
+	config_file = args.config_file
+
+	## Get an authenticated API object
+	api = authenticate()
+
+	## Load list of uids to collect
+	all_uids = []
+	with open(input_list) as f:
+		reader = csv.reader(f)
+		for row in reader:
+			all_uids.append(row[0])
+
+	state = CollectionState(os.path.join(output_dir, STATE_FILE_NAME))
+	user_states = state.get_all()
+
+	## Users collected before there was a state file count as done if their JSON file exists
+	for fname in os.listdir(output_dir):
+		uid = fname.split('.')[0]
+		if get_timeline_extension(fname) and uid not in user_states:
+			state.finish(uid, None)
+	user_states = state.get_all()
+
+	## Loop through the uids that are new, were interrupted, or (with --refresh) are due a refresh
+	uids_remaining = 0
+	for uid in all_uids:
+		user_state = user_states.get(uid)
+		if user_state is None:
+			state.start(uid)
+			collect_user(api, state, uid)
+		elif user_state["status"] in (COLLECTING, FAILED):
+			## Resume from the oldest tweet the last run reached, towards the same since_id
+			collect_user(api, state, uid, since_id=user_state["since_id"], oldest_id=user_state["oldest_id"])
+		elif args.refresh and user_state["status"] == DONE:
+			since_id = user_state["newest_id"] or get_newest_id(uid)
+			state.start(uid, since_id=since_id)
+			collect_user(api, state, uid, since_id=since_id)
+		else:
+			continue
+		uids_remaining = uids_remaining + 1
 
+	print(str(uids_remaining) + " users collected")
+	print(limiter.get_metrics())
+	metrics.close()
@@ -0,0 +1,51 @@
+'''
+JSON encoders for JSON/JSONB columns. encode_json uses orjson when it's installed and otherwise a stdlib
+encoder with compact separators and circular-reference checks turned off (tweets are plain trees). Both leave
+non-ASCII characters as they are rather than escaping them, so they give the same text for the same value.
+
+Example:
+
+encode_json({"hashtags": []})   # '{"hashtags":[]}'
+encode = get_encoder("stdlib")  # pick one explicitly
+
+'''
+
+import json
+import re
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+stdlib_encoder = json.JSONEncoder(separators=(",", ":"), check_circular=False, ensure_ascii=False)
+ascii_encoder = json.JSONEncoder(separators=(",", ":"), check_circular=False)
+LONE_SURROGATE = re.compile("[\ud800-\udfff]")
+
+def encode_json_stdlib(value):
+	text = stdlib_encoder.encode(value)
+	## A lone surrogate (half of an emoji, cut off by a truncated tweet) can't be written out as UTF-8, so a value
+	## holding one keeps its non-ASCII characters escaped, as \ud83d etc.
+	if not text.isascii() and LONE_SURROGATE.search(text):
+		return ascii_encoder.encode(value)
+	return text
+
+def encode_json_orjson(value):
+	try:
+		return orjson.dumps(value).decode("utf-8")
+	except TypeError:
+		## orjson refuses some things the stdlib accepts (ints over 64 bits, lone surrogates, non-str keys)
+		return encode_json_stdlib(value)
+
+ENCODERS = {"stdlib": encode_json_stdlib}
+if orjson is not None:
+	ENCODERS["orjson"] = encode_json_orjson
+
+DEFAULT_ENCODER = "orjson" if orjson is not None else "stdlib"
+
+def get_encoder(name=None):
+	name = name or DEFAULT_ENCODER
+	assert name in ENCODERS, "Unknown or unavailable JSON encoder: " + name
+	return ENCODERS[name]
+
+encode_json = get_encoder()
@@ -0,0 +1,89 @@
+'''
+Keeps track of which JSON files each uploader has already loaded, so a run can skip them with one indexed
+lookup instead of scanning the fact tables, resume after an interruption, and re-load files that changed.
+
+A file is identified by its name. Its size and mtime are checked first; only when those differ is the content
+hash compared, and only when the hash differs is the file re-loaded (after the loader's unload function has
+removed its old rows). The manifest row is written in the same transaction as the file's rows.
+
+Example:
+
+manifest = LoadManifest("upload_flat_tweet_table")
+cursor.execute(manifest.table.get_create_statement(if_not_exists=True))
+tasks = manifest.plan(cursor, json_paths)       # [(path, previous content hash or None), ...]
+...
+manifest.record(cursor, path, content_hash, {"Timelines": 3200})
+
+'''
+
+import hashlib
+from json_encoding import encode_json
+import os
+from sql_utils import Field, Table
+
+MANIFEST_TABLE_NAME = "LoadManifest"
+HASH_BLOCK_SIZE = 1 << 20
+
+manifest_fields = [
+	Field("loader", "VARCHAR(64)", is_primary_key=True),
+	Field("file_name", "VARCHAR(256)", is_primary_key=True),
+	Field("file_size", "BIGINT"),
+	Field("file_mtime", "DOUBLE PRECISION"),
+	Field("content_hash", "VARCHAR(64)"),
+	Field("rows_loaded", "JSON"),
+	Field("loaded_at", "TIMESTAMP")
+]
+
+def get_file_hash(path):
+	file_hash = hashlib.sha1()
+	with open(path, "rb") as f:
+		for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+			file_hash.update(block)
+	return file_hash.hexdigest()
+
+class LoadManifest():
+
+	def __init__(self, loader, prefix=""):
+		self.loader = loader
+		self.table = Table(MANIFEST_TABLE_NAME, manifest_fields, prefix=prefix)
+
+	def get_loaded(self, cursor):
+		''' Returns {file name: (size, mtime, content hash)} for every file this loader has recorded '''
+		cursor.execute("SELECT file_name, file_size, file_mtime, content_hash FROM " + self.table.name + " WHERE loader = %s", (self.loader,))
+		return dict((row[0], (row[1], row[2], row[3])) for row in cursor.fetchall())
+
+	def plan(self, cursor, paths):
+		''' Returns (path, previous content hash) for each path that is new or whose size/mtime changed '''
+		loaded = self.get_loaded(cursor)
+
+		tasks = []
+		for path in paths:
+			previous = loaded.get(os.path.basename(path))
+			if previous is None:
+				tasks.append((path, None))
+				continue
+
+			stat = os.stat(path)
+			size, mtime, content_hash = previous
+			if stat.st_size != size or stat.st_mtime != mtime:
+				tasks.append((path, content_hash))
+		return tasks
+
+	def record(self, cursor, path, content_hash, rows_loaded):
+		stat = os.stat(path)
+		cursor.execute(
+			"INSERT INTO " + self.table.name + " (loader, file_name, file_size, file_mtime, content_hash, rows_loaded, loaded_at) "
+			"VALUES (%s, %s, %s, %s, %s, %s, NOW() AT TIME ZONE 'UTC') "
+			"ON CONFLICT (loader, file_name) DO UPDATE SET file_size = EXCLUDED.file_size, file_mtime = EXCLUDED.file_mtime, "
+			"content_hash = EXCLUDED.content_hash, rows_loaded = EXCLUDED.rows_loaded, loaded_at = EXCLUDED.loaded_at",
+			(self.loader, os.path.basename(path), stat.st_size, stat.st_mtime, content_hash, encode_json(rows_loaded)))
+
+	def touch(self, cursor, path):
+		''' Updates the size/mtime of a file whose content turned out not to have changed '''
+		stat = os.stat(path)
+		cursor.execute(
+			"UPDATE " + self.table.name + " SET file_size = %s, file_mtime = %s WHERE loader = %s AND file_name = %s",
+			(stat.st_size, stat.st_mtime, self.loader, os.path.basename(path)))
+
+	def clear(self, cursor):
+		cursor.execute("DELETE FROM " + self.table.name + " WHERE loader = %s", (self.loader,))
@@ -0,0 +1,260 @@
+'''
+Run metrics for the uploaders and collectors: a timing histogram per stage (JSON decoding, row building, COPY,
+merge, commit, API requests, ...) and counters for rows per table, bytes read, API requests and rate-limit waits.
+They're written as structured JSON log lines (one per event, plus a summary at the end) and as a Prometheus text
+file, rewritten every FLUSH_SECONDS, that a local scraper (e.g. node_exporter's textfile collector) can read.
+
+Nothing is recorded until configure() is called (the scripts do it for --metrics-dir); until then timer() hands
+back a shared no-op and timed_iter() the iterable itself, so the calls can stay in the hot paths.
+
+Worker processes (see parallel_loader.py) record into their own copy with start_worker(), hand what they've
+recorded back with snapshot(), and the parent adds it in with merge(); only the parent writes files.
+
+Example:
+
+metrics.configure("metrics", "postgres_db")     # metrics/postgres_db.jsonl and metrics/postgres_db.prom
+with metrics.timer("commit"):
+	db.commit()
+for tweet in metrics.timed_iter(timeline.tweets(), "decode"):
+	...
+metrics.count("rows_total", 5000, table="Geo_Tweet")
+metrics.log_event("file", path=path, rows=5000)
+metrics.close()                                 # the summary line and the final .prom file
+
+'''
+
+import datetime
+import json
+import os
+import threading
+import time
+
+METRIC_PREFIX = "emcomp_"
+STAGE_METRIC = "stage_seconds"
+## Upper bounds (seconds) of the stage histograms' buckets, from one API request or COPY chunk up to a whole file
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+FLUSH_SECONDS = 10 ## How often flush() actually rewrites the Prometheus file
+
+def get_label_key(labels):
+	return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def format_labels(label_key, extra=()):
+	pairs = list(label_key) + list(extra)
+	if not pairs:
+		return ""
+	return "{" + ",".join('{key}="{value}"'.format(key=key, value=value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for key, value in pairs) + "}"
+
+class NullTimer():
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return False
+
+NULL_TIMER = NullTimer()
+
+class Timer():
+
+	def __init__(self, registry, stage, labels):
+		self.registry = registry
+		self.stage = stage
+		self.labels = labels
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.seconds = time.perf_counter() - self.start
+		self.registry.observe(self.stage, self.seconds, **self.labels)
+		return False
+
+class Metrics():
+
+	def __init__(self):
+		self.enabled = False
+		self.lock = threading.Lock()
+		self.counters = {} ## (name, label key) -> value
+		self.histograms = {} ## (stage, label key) -> [count per bucket..., count past the last bucket, sum]
+		self.json_log = None
+		self.prometheus_path = None
+		self.last_flush = 0
+		self.started = time.time()
+
+	def configure(self, metrics_dir, name):
+		if not os.path.isdir(metrics_dir):
+			os.makedirs(metrics_dir)
+		self.enabled = True
+		self.started = time.time()
+		self.json_log = open(os.path.join(metrics_dir, name + ".jsonl"), "a")
+		self.prometheus_path = os.path.join(metrics_dir, name + ".prom")
+
+	def start_worker(self, enabled):
+		''' In a worker process: record (if the parent does) but leave the writing to the parent '''
+		self.enabled = enabled
+		self.lock = threading.Lock()
+		self.counters = {}
+		self.histograms = {}
+		self.json_log = None
+		self.prometheus_path = None
+
+	def count(self, name, value=1, **labels):
+		if not self.enabled:
+			return
+		key = (name, get_label_key(labels))
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	def observe(self, stage, seconds, **labels):
+		if not self.enabled:
+			return
+		key = (stage, get_label_key(labels))
+		with self.lock:
+			histogram = self.histograms.get(key)
+			if histogram is None:
+				histogram = self.histograms[key] = [0] * (len(HISTOGRAM_BUCKETS) + 1) + [0.0]
+			for i, bound in enumerate(HISTOGRAM_BUCKETS):
+				if seconds <= bound:
+					break
+			else:
+				i = len(HISTOGRAM_BUCKETS)
+			histogram[i] = histogram[i] + 1
+			histogram[-1] = histogram[-1] + seconds
+
+	def timer(self, stage, **labels):
+		if not self.enabled:
+			return NULL_TIMER
+		return Timer(self, stage, labels)
+
+	def timed_iter(self, iterable, stage, **labels):
+		''' Yields from iterable, counting the time spent producing its items as one observation of stage '''
+		if not self.enabled:
+			return iterable
+		return self.walk_timed(iter(iterable), stage, labels)
+
+	def walk_timed(self, iterator, stage, labels):
+		seconds = 0.0
+		try:
+			while True:
+				start = time.perf_counter()
+				try:
+					item = next(iterator)
+				except StopIteration:
+					seconds = seconds + time.perf_counter() - start
+					return
+				seconds = seconds + time.perf_counter() - start
+				yield item
+		finally:
+			self.observe(stage, seconds, **labels)
+
+	def get_stage_seconds(self, stages):
+		''' Total seconds recorded so far for these stages, over all their labels '''
+		with self.lock:
+			return sum(histogram[-1] for (stage, label_key), histogram in self.histograms.items() if stage in stages)
+
+	def snapshot(self):
+		''' Hands over (and forgets) everything recorded since the last snapshot '''
+		with self.lock:
+			recorded = {"counters": list(self.counters.items()), "histograms": list(self.histograms.items())}
+			self.counters = {}
+			self.histograms = {}
+		return recorded
+
+	def merge(self, recorded):
+		if not recorded:
+			return
+		with self.lock:
+			for key, value in recorded["counters"]:
+				self.counters[key] = self.counters.get(key, 0) + value
+			for key, histogram in recorded["histograms"]:
+				existing = self.histograms.get(key)
+				self.histograms[key] = [a + b for a, b in zip(existing, histogram)] if existing else list(histogram)
+
+	def log_event(self, event, **fields):
+		if self.json_log is None:
+			return
+		fields["time"] = str(datetime.datetime.utcnow())
+		fields["event"] = event
+		with self.lock:
+			self.json_log.write(json.dumps(fields, default=str) + "\n")
+			self.json_log.flush()
+
+	def get_prometheus_text(self):
+		lines = []
+		with self.lock:
+			counters = sorted(self.counters.items())
+			histograms = sorted(self.histograms.items())
+
+		names_seen = set()
+		for (name, label_key), value in counters:
+			if name not in names_seen:
+				names_seen.add(name)
+				lines.append("# TYPE {prefix}{name} counter".format(prefix=METRIC_PREFIX, name=name))
+			lines.append("{prefix}{name}{labels} {value}".format(prefix=METRIC_PREFIX, name=name, labels=format_labels(label_key), value=value))
+
+		if histograms:
+			name = METRIC_PREFIX + STAGE_METRIC
+			lines.append("# HELP {name} Seconds spent per stage".format(name=name))
+			lines.append("# TYPE {name} histogram".format(name=name))
+		for (stage, label_key), histogram in histograms:
+			label_key = (("stage", stage),) + label_key
+			cumulative = 0
+			for bound, bucket_count in zip(HISTOGRAM_BUCKETS, histogram):
+				cumulative = cumulative + bucket_count
+				lines.append("{name}_bucket{labels} {count}".format(name=name, labels=format_labels(label_key, [("le", str(bound))]), count=cumulative))
+			count = cumulative + histogram[len(HISTOGRAM_BUCKETS)]
+			lines.append("{name}_bucket{labels} {count}".format(name=name, labels=format_labels(label_key, [("le", "+Inf")]), count=count))
+			lines.append("{name}_sum{labels} {seconds}".format(name=name, labels=format_labels(label_key), seconds=round(histogram[-1], 6)))
+			lines.append("{name}_count{labels} {count}".format(name=name, labels=format_labels(label_key), count=count))
+		return "\n".join(lines) + "\n"
+
+	def flush(self, force=False):
+		''' Rewrites the Prometheus file (at most every FLUSH_SECONDS unless forced), atomically so a scrape never sees half of it '''
+		if self.prometheus_path is None or (not force and time.time() - self.last_flush < FLUSH_SECONDS):
+			return
+		self.last_flush = time.time()
+		tmp_path = self.prometheus_path + ".tmp"
+		with open(tmp_path, "w") as f:
+			f.write(self.get_prometheus_text())
+		os.replace(tmp_path, self.prometheus_path)
+
+	def get_summary(self):
+		elapsed = time.time() - self.started
+		with self.lock:
+			stages = {}
+			for (stage, label_key), histogram in self.histograms.items():
+				name = stage + "".join("[" + value + "]" for key, value in label_key)
+				stages[name] = {"count": sum(histogram[:-1]), "seconds": round(histogram[-1], 3)}
+			counters = dict((name + "".join("[" + value + "]" for key, value in label_key), value) for (name, label_key), value in self.counters.items())
+			rows_per_second = dict((dict(label_key).get("table", ""), round(value / elapsed, 1)) for (name, label_key), value in self.counters.items() if name == "rows_total")
+		return {"elapsed_seconds": round(elapsed, 3), "stages": stages, "counters": counters, "rows_per_second": rows_per_second}
+
+	def close(self):
+		if not self.enabled:
+			return
+		self.log_event("summary", **self.get_summary())
+		self.flush(force=True)
+		if self.json_log is not None:
+			self.json_log.close()
+			self.json_log = None
+
+
+## One registry per process, used through the module functions below
+registry = Metrics()
+
+configure = registry.configure
+start_worker = registry.start_worker
+count = registry.count
+observe = registry.observe
+timer = registry.timer
+timed_iter = registry.timed_iter
+get_stage_seconds = registry.get_stage_seconds
+snapshot = registry.snapshot
+merge = registry.merge
+log_event = registry.log_event
+flush = registry.flush
+close = registry.close
+
+def is_enabled():
+	return registry.enabled
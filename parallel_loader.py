@@ -0,0 +1,226 @@
+'''
+Runs a per-file load function over a list of JSON files, either in-process or sharded over a pool of worker
+processes. Each worker holds its own database connection and commits (or rolls back) one file at a time, so a
+bad file never takes down the rest of the run.
+
+The load function is called as load_file(cursor, path) and returns {table name: rows loaded}. It has to be
+defined at module level so the worker processes can find it.
+
+With a LoadManifest, each task is (path, content hash recorded for it last time or None). A file whose content
+hash hasn't changed is only touched in the manifest; a file that did change is first passed to
+unload_file(cursor, path) to delete its old rows, then loaded and recorded in the same transaction.
+
+Whenever a file's transaction is rolled back (its load, its manifest record or its commit failed), rollback_file(path)
+is called, if given, so the load function can forget whatever it remembered about the file's rows.
+
+Commit time is reported separately: with DEFERRABLE INITIALLY DEFERRED foreign keys that's where their checks run.
+
+With metrics configured (see metrics.py) each file's unload, load, commit and row building time and its rows and
+bytes are recorded, in the worker that loaded it, and sent back with its result.
+
+Example:
+
+tasks = manifest.plan(cursor, paths)
+rows_loaded, failed_files = load_files("db_config.txt", tasks, load_file, workers=4, manifest=manifest, unload_file=unload_file, rollback_file=rollback_file)
+run_statements("db_config.txt", table.get_index_statements(deferred=True, concurrently=True), workers=4)
+
+'''
+
+from load_manifest import get_file_hash
+import metrics
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import psycopg2
+import re
+import sys
+import time
+
+def read_db_config(db_config):
+	## The config file has one key=value pair per line, passed straight through to psycopg2.connect
+	config = {}
+	for line in open(db_config).readlines():
+		key, value = line.strip().split("=")
+		config[key] = value
+	return config
+
+def connect(db_config):
+	return psycopg2.connect(**read_db_config(db_config))
+
+## Set in each worker by init_worker
+worker_db = None
+worker_load_file = None
+worker_manifest = None
+worker_unload_file = None
+worker_rollback_file = None
+
+## Stages that load_file's time is split into (recorded where they happen); the rest of it is row building
+LOAD_STAGES = ["decode", "copy", "merge", "insert"]
+
+## The table a CREATE INDEX or ALTER TABLE statement works on
+STATEMENT_TABLE = re.compile(r"\bON\s+(\S+)\s+USING\b|^ALTER TABLE\s+(\S+)", re.IGNORECASE)
+
+def init_worker(db_config, load_file, manifest=None, unload_file=None, metrics_enabled=None, rollback_file=None):
+	global worker_db, worker_load_file, worker_manifest, worker_unload_file, worker_rollback_file
+	if metrics_enabled is not None:
+		## A worker process of its own: record into its own copy for load_one to send back
+		metrics.start_worker(metrics_enabled)
+	worker_db = connect(db_config)
+	worker_load_file = load_file
+	worker_manifest = manifest
+	worker_unload_file = unload_file
+	worker_rollback_file = rollback_file
+
+def load_one(task):
+	path, previous_hash = task
+	start = time.time()
+	cursor = worker_db.cursor()
+	try:
+		if worker_manifest is not None:
+			content_hash = get_file_hash(path)
+			if content_hash == previous_hash:
+				worker_manifest.touch(cursor, path)
+				worker_db.commit()
+				metrics.count("files_total", result="unchanged")
+				return (path, None, time.time() - start, 0, None, metrics.snapshot())
+			if previous_hash is not None and worker_unload_file is not None:
+				with metrics.timer("unload"):
+					worker_unload_file(cursor, path)
+
+		inner_seconds = metrics.get_stage_seconds(LOAD_STAGES) if metrics.is_enabled() else 0
+		with metrics.timer("load_file") as load_timer:
+			rows_loaded = worker_load_file(cursor, path)
+		if metrics.is_enabled():
+			metrics.observe("build", load_timer.seconds - (metrics.get_stage_seconds(LOAD_STAGES) - inner_seconds))
+
+		if worker_manifest is not None:
+			worker_manifest.record(cursor, path, content_hash, rows_loaded)
+		commit_start = time.time()
+		with metrics.timer("commit"):
+			worker_db.commit()
+		metrics.count("files_total", result="loaded")
+		metrics.count("bytes_read_total", os.path.getsize(path))
+		for table_name, rows in rows_loaded.items():
+			metrics.count("rows_total", rows, table=table_name)
+		return (path, rows_loaded, time.time() - start, time.time() - commit_start, None, metrics.snapshot())
+	except Exception as ex:
+		worker_db.rollback()
+		if worker_rollback_file is not None:
+			worker_rollback_file(path)
+		metrics.count("files_total", result="failed")
+		return (path, None, time.time() - start, 0, repr(ex), metrics.snapshot())
+	finally:
+		cursor.close()
+
+def load_files(db_config, tasks, load_file, workers=1, manifest=None, unload_file=None, rollback_file=None):
+	''' Loads every (path, previous hash) task with load_file, printing progress as files finish. Returns (rows loaded, failed paths) '''
+	if workers > 1:
+		pool = multiprocessing.Pool(workers, init_worker, (db_config, load_file, manifest, unload_file, metrics.is_enabled(), rollback_file))
+		results = pool.imap_unordered(load_one, tasks, chunksize=1)
+	else:
+		pool = None
+		init_worker(db_config, load_file, manifest, unload_file, rollback_file=rollback_file)
+		results = (load_one(task) for task in tasks)
+
+	start = time.time()
+	total_rows = 0
+	done_count = 0
+	failed_paths = []
+	total_commit_seconds = 0
+	try:
+		for path, rows_loaded, seconds, commit_seconds, error, worker_metrics in results:
+			metrics.merge(worker_metrics)
+			metrics.log_event("file", path=path, rows=rows_loaded, seconds=round(seconds, 3), commit_seconds=round(commit_seconds, 3), error=error)
+			metrics.flush()
+			done_count = done_count + 1
+			rows = sum(rows_loaded.values()) if rows_loaded else 0
+			total_rows = total_rows + rows
+			total_commit_seconds = total_commit_seconds + commit_seconds
+			elapsed = time.time() - start
+
+			if error:
+				failed_paths.append(path)
+				print("{name}: FAILED after {seconds:.1f}s: {error}".format(name=os.path.basename(path), seconds=seconds, error=error))
+			elif rows_loaded is None:
+				print("{name}: unchanged since last load ({done}/{total} files)".format(name=os.path.basename(path), done=done_count, total=len(tasks)))
+			else:
+				print("{name}: {rows} rows in {seconds:.1f}s, {commit_seconds:.2f}s of it committing ({done}/{total} files, {total_rows} rows, {rate:.0f} rows/s)".format(
+					name=os.path.basename(path),
+					rows=rows,
+					seconds=seconds,
+					commit_seconds=commit_seconds,
+					done=done_count,
+					total=len(tasks),
+					total_rows=total_rows,
+					rate=total_rows / elapsed if elapsed else 0))
+			sys.stdout.flush() # so print statements get printed to logs more quickly
+	finally:
+		if pool:
+			pool.close()
+			pool.join()
+
+	print("{total_rows} rows from {files} files in {elapsed:.1f}s with {workers} worker(s), {failed} failed".format(
+		total_rows=total_rows,
+		files=done_count,
+		elapsed=time.time() - start,
+		workers=max(workers, 1),
+		failed=len(failed_paths)))
+	print("{commit_seconds:.1f}s spent in commits (including deferred foreign key checks), summed over workers".format(commit_seconds=total_commit_seconds))
+	for path in failed_paths:
+		print("failed: " + path)
+
+	return total_rows, failed_paths
+
+def get_statement_table(statement):
+	match = STATEMENT_TABLE.search(statement)
+	return (match.group(1) or match.group(2)).lower() if match else None
+
+def run_statement_group(task):
+	''' Runs one table's statements one after another, returning (statement, seconds, error) for each '''
+	db_config, statements = task
+	results = []
+	## CREATE INDEX CONCURRENTLY can't run inside a transaction block
+	db = connect(db_config)
+	db.autocommit = True
+	try:
+		for statement in statements:
+			start = time.time()
+			try:
+				db.cursor().execute(statement)
+				results.append((statement, time.time() - start, None))
+			except Exception as ex:
+				results.append((statement, time.time() - start, repr(ex)))
+	finally:
+		db.close()
+	return results
+
+def run_statements(db_config, statements, workers=1):
+	''' Runs statements (e.g. deferred CREATE INDEX) on autocommit connections, different tables' side by side '''
+	if not statements:
+		return []
+
+	## Two concurrent index builds on one table deadlock each other, so each table's statements go to one connection in turn
+	groups = {}
+	for statement in statements:
+		groups.setdefault(get_statement_table(statement) or statement, []).append(statement)
+
+	start = time.time()
+	failed_statements = []
+	pool = ThreadPool(max(workers, 1))
+	try:
+		for results in pool.imap_unordered(run_statement_group, [(db_config, group) for group in groups.values()]):
+			for statement, seconds, error in results:
+				metrics.observe("statement", seconds)
+				metrics.log_event("statement", statement=statement, seconds=round(seconds, 3), error=error)
+				if error:
+					failed_statements.append(statement)
+					print("FAILED after {seconds:.1f}s: {statement}: {error}".format(seconds=seconds, statement=statement, error=error))
+				else:
+					print("{seconds:.1f}s: {statement}".format(seconds=seconds, statement=statement))
+			sys.stdout.flush()
+	finally:
+		pool.close()
+		pool.join()
+
+	print("{count} statements in {elapsed:.1f}s, {failed} failed".format(count=len(statements), elapsed=time.time() - start, failed=len(failed_statements)))
+	return failed_statements
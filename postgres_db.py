@@ -1,28 +1,65 @@
 '''
-Usage python postres_db.py db_config.txt json_files_dir
+Usage python postres_db.py db_config.txt json_files_dir [--workers N] [--metrics-dir DIR]
+      python postres_db.py json_files_dir --export-dir DIR [--export-format parquet|arrow] [--metrics-dir DIR]
+
+json_files_dir can also be an archive directory (see timeline_archive.py), in which case each shard is loaded as one file.
+
+With --export-dir the rows go into one Geo_<table>.parquet (or .arrows) file per table there instead of the database
+(see table_sinks.py).
+
+Tweets link to their user by userId. Each version of a user's profile is one Geo_User row (see user_dimension.py); the
+per-tweet profile copies in Geo_TweetUser are only written with USER_COPIES_PER_TWEET.
+
+Retweets and quotes link to their parent tweet by retweetedStatusId / quotedStatusId. With INCLUDE_PARENT_TWEETS the
+parents themselves (and their users, entities and places) are loaded as tweets too, once per run per process: the ids
+already loaded are remembered, up to MAX_SEEN_TWEET_IDS of the most recently seen.
+
+A tweet's place is a Geo_TweetPlace link row to a Geo_Place row. Each place is written once per run per process,
+with its bounding box as JSON and as min/max longitude and latitude columns that can be indexed and compared directly.
 '''
 
+import argparse
+import collections
 import datetime
-from dateutil import parser
 import json
-import os
+from json_encoding import encode_json
+from load_manifest import get_file_hash, LoadManifest
+import metrics
+import parallel_loader
 import psycopg2
-from psycopg2 import extras as ext
-from sql_utils import Field, Table
+from sql_utils import DEFERRED_FOREIGN_KEYS, Field, IMMEDIATE_FOREIGN_KEYS, Index, KEEP_FIRST, KEEP_LATEST, Table, VALIDATE_FOREIGN_KEYS_AFTER
 import sys
+from table_sinks import export_files, PostgresSink, SINK_CLASSES
+from timeline_archive import get_replaced_uids, get_timeline_uids, list_timeline_sources, read_timelines
+from timeline_reader import get_collected_at
 import time
+from timestamp_utils import cached_convert_timestring_to_timestamp, convert_timestring_to_timestamp
+from user_dimension import get_user_table, UserVersions
 
 TABLE_PREFIX = "Geo_"
 DROP_EXISTING_TABLES = False
-INCLUDE_PARENT_TWEETS = False
+INCLUDE_PARENT_TWEETS = False ## Load the retweeted / quoted tweets embedded in tweets as tweets of their own
+MAX_SEEN_TWEET_IDS = 500000 ## Tweet ids remembered per process so a parent is only loaded once (about 80 MB)
+MAX_SEEN_PLACE_IDS = 100000 ## Place ids remembered per process so a place is only written once
+USE_COPY = True ## Bulk load with COPY FROM STDIN (set to False to fall back to execute_batch INSERTs)
+ON_CONFLICT = KEEP_LATEST ## For tweets already loaded from another file: KEEP_LATEST (by collection time), KEEP_FIRST, or None to fail the file
+DEFER_INDEXES = True ## Build secondary indexes after the load (concurrently, side by side) instead of maintaining them during it
+MAX_BUFFERED_TWEETS = 5000 ## Flush the tuples built so far once a timeline has this many tweets, to bound memory
+USER_COPIES_PER_TWEET = False ## Also copy the user's profile into TweetUser for every tweet (the layout before the User table)
+## How the child tables' foreign keys to Tweet are checked: IMMEDIATE_FOREIGN_KEYS (per row), DEFERRED_FOREIGN_KEYS (once per file, at commit)
+## or VALIDATE_FOREIGN_KEYS_AFTER (dropped for the load, then re-added NOT VALID and validated once at the end)
+FOREIGN_KEYS = DEFERRED_FOREIGN_KEYS
 
 # Create table objects
 tweet_table_fields = [
 	Field("tweetId", "BIGINT", is_primary_key=True),
-        Field("text", "TEXT"),
+	Field("userId", "BIGINT"),
+	Field("text", "TEXT"),
 	Field("truncated", "BOOLEAN"),
 	Field("isQuoteStatus", "BOOLEAN"),
 	Field("inReplyToStatusId", "BIGINT"),
+	Field("retweetedStatusId", "BIGINT"),
+	Field("quotedStatusId", "BIGINT"),
 	Field("favoriteCount", "BIGINT"),
 	Field("source", "TEXT"),
 	Field("coordinates_x", "NUMERIC(16,8)"),
@@ -34,7 +71,13 @@ tweet_table_fields = [
 	Field("createdAt", "TIMESTAMP"),
 	Field("collectedAt", "TIMESTAMP")
 ]
-tweet_table = Table("Tweet", tweet_table_fields, prefix=TABLE_PREFIX)
+## userId's index isn't deferred: unload_file looks a user's tweets up by it during the load
+tweet_table = Table("Tweet", tweet_table_fields, prefix=TABLE_PREFIX, version_field="collectedAt", indexes=[
+	Index(["createdAt"], method="brin"),
+	Index(["userId"], defer=False),
+	Index(["retweetedStatusId"]),
+	Index(["quotedStatusId"])
+])
 tweet_foreign_key = tweet_table.get_field("tweetId")
 
 tweetuser_table_fields = [
@@ -58,13 +101,21 @@ tweetuser_table_fields = [
 	Field("location", "VARCHAR(256)"),
 	Field("collectedAt", "TIMESTAMP")
 ]
-tweetuser_table = Table("TweetUser", tweetuser_table_fields, prefix=TABLE_PREFIX)
+tweetuser_table = Table("TweetUser", tweetuser_table_fields, prefix=TABLE_PREFIX, version_field="collectedAt", indexes=[
+	Index(["userId"])
+])
+
+user_table = get_user_table(prefix=TABLE_PREFIX)
 
 tweethashtag_table_fields = [
 	Field("tweetId", "BIGINT", foreign_key=tweet_foreign_key, foreign_key_table=tweet_table),
 	Field("hashtag", "TEXT")
 ]
-tweethashtag_table = Table("TweetHashtag", tweethashtag_table_fields, prefix=TABLE_PREFIX)
+## The child tables' tweetId indexes aren't deferred: merges and unload_file look rows up by tweetId during the load
+tweethashtag_table = Table("TweetHashtag", tweethashtag_table_fields, prefix=TABLE_PREFIX, indexes=[
+	Index(["tweetId"], defer=False),
+	Index(["hashtag"])
+])
 
 tweetmention_table_fields = [
 	Field("tweetId", "BIGINT", foreign_key=tweet_foreign_key, foreign_key_table=tweet_table),
@@ -73,7 +124,10 @@ tweetmention_table_fields = [
 	Field("mentionedScreenName", "VARCHAR(45)"),
 	Field("mentionedName", "VARCHAR(128)")
 ]
-tweetmention_table = Table("TweetMention", tweetmention_table_fields, prefix=TABLE_PREFIX)
+tweetmention_table = Table("TweetMention", tweetmention_table_fields, prefix=TABLE_PREFIX, indexes=[
+	Index(["tweetId"], defer=False),
+	Index(["mentionedId"])
+])
 
 tweeturl_table_fields = [
 	Field("tweetId", "BIGINT", foreign_key=tweet_foreign_key, foreign_key_table=tweet_table),
@@ -81,45 +135,107 @@ tweeturl_table_fields = [
 	Field("display_url", "TEXT"),
 	Field("expanded_url", "TEXT")
 ]
-tweeturl_table = Table("TweetUrl", tweeturl_table_fields, prefix=TABLE_PREFIX)
+tweeturl_table = Table("TweetUrl", tweeturl_table_fields, prefix=TABLE_PREFIX, indexes=[
+	Index(["tweetId"], defer=False)
+])
 
-tweetplace_table_fields = [
-	Field("tweetId", "BIGINT", foreign_key=tweet_foreign_key, foreign_key_table=tweet_table),
-	Field("boundingBoxJson", "TEXT"),
+place_table_fields = [
+	Field("placeId", "TEXT", is_primary_key=True),
+	Field("placeName", "VARCHAR(128)"),
+	Field("fullName", "TEXT"),
+	Field("placeType", "VARCHAR(32)"),
 	Field("country", "VARCHAR(128)"),
 	Field("countryCode", "VARCHAR(10)"),
-	Field("fullName", "TEXT"),
-	Field("placeId", "BIGINT"),
-	Field("placeName", "VARCHAR(128)"),
-	Field("placeUrl", "TEXT")
+	Field("placeUrl", "TEXT"),
+	Field("boundingBoxJson", "TEXT"),
+	Field("minLongitude", "DOUBLE PRECISION"),
+	Field("minLatitude", "DOUBLE PRECISION"),
+	Field("maxLongitude", "DOUBLE PRECISION"),
+	Field("maxLatitude", "DOUBLE PRECISION")
 ]
-tweetplace_table = Table("TweetPlace", tweetplace_table_fields, prefix=TABLE_PREFIX)
+## Places don't change, so one seen again keeps its first row
+place_table = Table("Place", place_table_fields, prefix=TABLE_PREFIX, on_conflict=KEEP_FIRST, indexes=[
+	Index(["minLongitude", "minLatitude", "maxLongitude", "maxLatitude"])
+])
 
-all_tables = [tweet_table, tweetuser_table, tweethashtag_table, tweetmention_table, tweeturl_table, tweetplace_table]
-
-def batch_insert(cursor, table, rows):
-	fields_required = len(table.fields)
-	for row in rows:
-	    assert len(row)==fields_required, "Row has incorrect number of fields: " + str(row)
+## Twitter place ids are hex strings. Tables created when placeId was a BIGINT (and the place's
+## attributes were columns here) are converted in __main__; the old columns stay, unused
+tweetplace_table_fields = [
+	Field("tweetId", "BIGINT", foreign_key=tweet_foreign_key, foreign_key_table=tweet_table),
+	Field("placeId", "TEXT", foreign_key=place_table.get_field("placeId"), foreign_key_table=place_table)
+]
+tweetplace_table = Table("TweetPlace", tweetplace_table_fields, prefix=TABLE_PREFIX, indexes=[
+	Index(["tweetId"], defer=False),
+	Index(["placeId"])
+])
+
+## Parents before the children whose foreign keys point at them
+all_tables = [tweet_table, tweetuser_table, user_table, tweethashtag_table, tweetmention_table, tweeturl_table, place_table, tweetplace_table]
+
+def insert_tuples(sink, table_tuples, rows_loaded, min_rows=0):
+	## table_tuples lists the parent tweet table first, so the child tables' foreign keys resolve when they're checked per row,
+	## and a child table's rows are only merged for parents already merged (see sql_utils get_merge_statements): so once any
+	## table's buffer is due, every table before it goes out with it
+	due = [index for index, (table, tuples) in enumerate(table_tuples) if tuples and len(tuples) >= min_rows]
+	for table, tuples in table_tuples[:due[-1] + 1 if due else 0]:
+		if tuples:
+			rows_loaded[table.name] = rows_loaded.get(table.name, 0) + sink.write_rows(table, tuples)
+			del tuples[:]
+
+def get_foreign_key_fields(cursor):
+	''' Returns ({table: fields whose foreign key exists}, {table: fields whose foreign key is missing}) '''
+	cursor.execute("SELECT conname FROM pg_constraint WHERE contype = 'f'")
+	existing = set("\"" + row[0] + "\"" for row in cursor.fetchall())
+	present_fields = {}
+	missing_fields = {}
+	for table in all_tables:
+		for field in table.get_foreign_key_fields():
+			fields = present_fields if table.get_foreign_key_name(field) in existing else missing_fields
+			fields.setdefault(table, []).append(field)
+	return present_fields, missing_fields
+
+def prepare_foreign_keys(cursor):
+	''' Puts the child tables' foreign keys into the state FOREIGN_KEYS asks for before a load '''
+	## Foreign keys left dropped (e.g. by an interrupted VALIDATE_FOREIGN_KEYS_AFTER run) or declared since the table
+	## was created get added in restore_foreign_keys
+	present_fields, missing_fields = get_foreign_key_fields(cursor)
+	for table, fields in present_fields.items():
+		if FOREIGN_KEYS == VALIDATE_FOREIGN_KEYS_AFTER:
+			statements = table.get_drop_foreign_key_statements()
+		else:
+			statements = table.get_alter_foreign_key_statements(deferrable=(FOREIGN_KEYS == DEFERRED_FOREIGN_KEYS), fields=fields)
+		for statement in statements:
+			cursor.execute(statement)
+
+def restore_foreign_keys(db, db_config, workers=1):
+	''' Re-adds missing foreign keys as NOT VALID (no scan), then validates them side by side, reporting how long the checks take '''
+	cursor = db.cursor()
+	present_fields, missing_fields = get_foreign_key_fields(cursor)
+	for table, fields in missing_fields.items():
+		for statement in table.get_add_foreign_key_statements(deferrable=(FOREIGN_KEYS == DEFERRED_FOREIGN_KEYS), not_valid=True, fields=fields):
+			cursor.execute(statement)
+	db.commit()
 
-        ext.execute_batch(cursor, table.get_insert_statement(), rows)
+	if missing_fields:
+		print("Validating foreign keys:")
+		validate_statements = [statement for table, fields in missing_fields.items() for statement in table.get_validate_foreign_key_statements(fields=fields)]
+		parallel_loader.run_statements(db_config, validate_statements, workers=workers)
 
 #####################################
 #####################################
 
 def clean(text):
-    return text.replace("\x00", "") if text else None
-
-def convert_timestring_to_timestamp(datetimestr):
-    datetime = parser.parse(datetimestr)
-    return datetime.strftime('%Y-%m-%d %H:%M:%S')
+	return text.replace("\x00", "") if text else None
 
 def get_tweet_tuple(tweet, collectedAt):
 	tweetId = tweet["id_str"]
-        text = clean(tweet["text"])
+	userId = tweet["user"]["id_str"]
+	text = clean(tweet["text"])
 	truncated = tweet["truncated"]
 	isQuoteStatus = tweet["is_quote_status"]
 	inReplyToStatusId = tweet["in_reply_to_status_id"]
+	retweetedStatusId = tweet["retweeted_status"]["id_str"] if tweet.get("retweeted_status") else None
+	quotedStatusId = tweet.get("quoted_status_id_str")
 	favoriteCount = tweet["favorite_count"]
 	source = tweet["source"]
 	coordinates_x, coordinates_y = None, None
@@ -132,7 +248,7 @@ def get_tweet_tuple(tweet, collectedAt):
 	tweet_lang = tweet["lang"]
 	tweet_createdAt = convert_timestring_to_timestamp(tweet["created_at"])
 
-	return (tweetId, text, truncated, isQuoteStatus, inReplyToStatusId, favoriteCount, source, coordinates_x, coordinates_y, inReplyToScreenName, retweetCount, inReplyToUserId, tweet_lang, tweet_createdAt, collectedAt)
+	return (tweetId, userId, text, truncated, isQuoteStatus, inReplyToStatusId, retweetedStatusId, quotedStatusId, favoriteCount, source, coordinates_x, coordinates_y, inReplyToScreenName, retweetCount, inReplyToUserId, tweet_lang, tweet_createdAt, collectedAt)
 
 def get_tweetuser_tuple(tweet, collectedAt):
 	tweetId = tweet["id_str"]
@@ -153,130 +269,320 @@ def get_tweetuser_tuple(tweet, collectedAt):
 	favoritesCount = tweetuser["favourites_count"]
 	screenName = clean(tweetuser["screen_name"])
 	url = tweetuser["url"]
-	user_createdAt = tweetuser["created_at"]
+	user_createdAt = cached_convert_timestring_to_timestamp(tweetuser["created_at"])
 	location = clean(tweetuser["location"])
 
 	return (tweetId, userId, timeZone, verified, geoEnabled, followersCount, protected, user_lang, utcOffset, statusesCount, description, friendsCount, name, favoritesCount, screenName, url, user_createdAt, location, collectedAt)
 
-def get_tweetplace_tuple(tweet, collectedAt):
-	tweetplace = tweet.get("place", None)
-
-	if tweetplace:
-		boundingBoxJson = tweetplace["bounding_box"]
-		country = tweetplace["country"]
-		countryCode = tweetplace["country_code"]
-		fullName = tweetplace["full_name"]
-		placeId = tweetplace["id"]
-		placeName = tweetplace["name"]
-		placeUrl = tweetplace["url"]
-
-		return (tweetId, boundingBoxJson, country, countryCode, fullName, placeId, placeName, placeUrl)
-
+def get_tweetplace_tuple(tweet):
+	tweetId = tweet["id_str"]
+	placeId = tweet["place"]["id"]
+
+	return (tweetId, placeId)
+
+def get_place_tuple(place):
+	placeId = place["id"]
+	placeName = clean(place.get("name"))
+	fullName = clean(place.get("full_name"))
+	placeType = place.get("place_type")
+	country = clean(place.get("country"))
+	countryCode = place.get("country_code")
+	placeUrl = place.get("url")
+
+	boundingBox = place.get("bounding_box")
+	boundingBoxJson = encode_json(boundingBox) if boundingBox else None
+	minLongitude, minLatitude, maxLongitude, maxLatitude = None, None, None, None
+	if boundingBox and boundingBox.get("coordinates"):
+		## A Polygon: a list of rings of [longitude, latitude] points
+		points = [point for ring in boundingBox["coordinates"] for point in ring]
+		minLongitude = min(point[0] for point in points)
+		minLatitude = min(point[1] for point in points)
+		maxLongitude = max(point[0] for point in points)
+		maxLatitude = max(point[1] for point in points)
+
+	return (placeId, placeName, fullName, placeType, country, countryCode, placeUrl, boundingBoxJson, minLongitude, minLatitude, maxLongitude, maxLatitude)
+
+
+class RecentIds():
+	''' A set of at most max_size ids that forgets the least recently seen ones first '''
+
+	def __init__(self, max_size):
+		self.max_size = max_size
+		self.ids = collections.OrderedDict()
+
+	def __contains__(self, id):
+		if id in self.ids:
+			self.ids.move_to_end(id)
+			return True
+		return False
+
+	def add(self, id):
+		self.ids[id] = None
+		self.ids.move_to_end(id)
+		if len(self.ids) > self.max_size:
+			self.ids.popitem(last=False)
+
+	def discard(self, id):
+		self.ids.pop(id, None)
+
+## The tweets loaded so far by this process, as timeline tweets or parents, and the places written
+seen_tweet_ids = RecentIds(MAX_SEEN_TWEET_IDS)
+seen_place_ids = RecentIds(MAX_SEEN_PLACE_IDS)
+
+class AddedIds():
+	''' The ids one file's load adds to seen_tweet_ids and seen_place_ids, to forget again if its rows are rolled back '''
+
+	def __init__(self):
+		self.added = []
+		## The tweets loaded as parents, so one that is also a timeline tweet of the file (e.g. a self-quote) is only loaded once
+		self.parent_ids = set()
+
+	def add(self, seen_ids, id):
+		seen_ids.add(id)
+		self.added.append((seen_ids, id))
+
+	def add_parent(self, id):
+		self.add(seen_tweet_ids, id)
+		self.parent_ids.add(id)
+
+	def discard_all(self):
+		for seen_ids, id in self.added:
+			seen_ids.discard(id)
+		del self.added[:]
 
 #####################################
 #####################################
 
-## Connecting to the database
-config = {}
-for line in open(sys.argv[1]).readlines():
-	key, value = line.strip().split("=")
-	config[key] = value
-db = psycopg2.connect(**config)
-time.sleep(5)
-cursor = db.cursor()
-
-## Creating tables in the database if they don't exist
-for table in reversed(all_tables):
-	if DROP_EXISTING_TABLES:
-		cursor.execute(table.get_drop_statement(if_exists=True))
-for table in all_tables:
-    cursor.execute(table.get_create_statement(if_not_exists=True))
-
-cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema='public'")
-print(cursor.fetchall())
-
-cursor.execute("SELECT DISTINCT userid::TEXT FROM " + tweetuser_table.name + ";")
-users_processed = set([row[0] for row in cursor.fetchall()])
-
-input_json_dir = sys.argv[2]
-json_files = [f for f in os.listdir(input_json_dir) if (len(f) > 5 and f[-5:]==".json")]
-for f in json_files:
-
-	userId = f.split(".")[0] # JSON files are named by user_id
-	if userId in users_processed:
-		continue
-
-	json_data = json.load(open(os.path.join(input_json_dir, f)))
-        print(f)
-	tweets = json_data["historic_tweets"]
-	collectedAt = convert_timestring_to_timestamp(json_data["utc_timestamp"])
-
-	tweet_tuples = []
-	tweetuser_tuples = []
-	tweetplace_tuples = []
-	tweethashtag_tuples = []
-	tweetmention_tuples = []
-	tweeturl_tuples = []
-        
+## The ids the file this process is loading has added to the seen sets, until its transaction commits: {path: AddedIds}
+uncommitted_ids = {}
+
+def load_timelines(sink, path, added_ids=None):
+	rows_loaded = {}
+	if added_ids is None:
+		added_ids = AddedIds()
+	try:
+		for timeline in read_timelines(path):
+			load_timeline(sink, timeline, rows_loaded, added_ids)
+	except Exception:
+		## The file's rows get rolled back, so its tweets and places mustn't stop a later file from loading them
+		added_ids.discard_all()
+		raise
+	return rows_loaded
+
+def load_file(cursor, path):
+	## An archive shard can hold a newer copy of a user loaded from an earlier shard
+	unload_users(cursor, get_replaced_uids(path))
+	## The file loaded before this one has been committed, or rolled back and forgotten
+	uncommitted_ids.clear()
+	uncommitted_ids[path] = AddedIds()
+	return load_timelines(PostgresSink(cursor, on_conflict=ON_CONFLICT, use_copy=USE_COPY), path, uncommitted_ids[path])
+
+def forget_file(path):
+	''' parallel_loader's rollback_file: the file's rows were rolled back, possibly only at commit (where the deferred foreign
+	keys are checked), so its tweets and places mustn't stop a later file from loading them '''
+	added_ids = uncommitted_ids.pop(path, None)
+	if added_ids is not None:
+		added_ids.discard_all()
+
+def load_timeline(sink, timeline, rows_loaded, added_ids):
+	tuples = dict((table, []) for table in all_tables)
+	user_versions = UserVersions()
+	tuples[user_table] = user_versions.rows
+	table_tuples = [(table, tuples[table]) for table in all_tables]
+
 	tweets_processed = set()
 
-	for tweet in tweets:
+	for tweet in metrics.timed_iter(timeline.tweets(), "decode"):
 		tweetId = tweet["id_str"]
 
-		if tweetId in tweets_processed:
+		if tweetId in tweets_processed or tweetId in added_ids.parent_ids:
 			continue
 
-		tweet_tuples.append(get_tweet_tuple(tweet, collectedAt))
-		tweetuser_tuples.append(get_tweetuser_tuple(tweet, collectedAt))
+		## Usually the file's utc_timestamp, but a refreshed file keeps its older tweets' own
+		collectedAt = cached_convert_timestring_to_timestamp(get_collected_at(timeline, tweet))
+		add_tweet_tuples(tweet, collectedAt, tuples, user_versions, added_ids)
+		tweets_processed.add(tweetId)
 
 		if INCLUDE_PARENT_TWEETS:
-			if "retweeted_status" in tweet and tweet["retweeted_status"] is not None:
-				retweet = tweet["retweeted_status"]
-				# do some processing here
-
-			if "quoted_status" in tweet and tweet["quoted_status"] is not None:
-				quoted_tweet = tweet["quoted_status"]
-				# do some processing here
-
-		tweetplace = get_tweetplace_tuple(tweet, collectedAt)
-
-		entities = tweet.get("entities", None)
-		if entities:
-			if "hashtags" in entities:
-				for hashtag in entities["hashtags"]:
-					tweethashtag_tuples.append((tweetId, clean(hashtag["text"])))
-
-			if "user_mentions" in entities:
-                                userId = tweet["user"]["id_str"]
-				for mention in entities["user_mentions"]:
-					mentionedId = mention["id_str"]
-					mentionedScreenName = clean(mention["screen_name"])
-					mentionedName = clean(mention["name"])
-
-					tweetmention_tuples.append((tweetId, userId, mentionedId, mentionedScreenName, mentionedName))
-
-			if "urls" in entities:
-				for url in entities["urls"]:
-					entity_url = url["url"]
-					display_url = url["display_url"]
-					expanded_url = url["expanded_url"]
-
-					tweeturl_tuples.append((tweetId, entity_url, display_url, expanded_url))
-                tweets_processed.add(tweetId)
-
-        print(str(len(tweet_tuples)) + " tweets to insert")
-	batch_insert(cursor, tweet_table, tweet_tuples)
-	batch_insert(cursor, tweetuser_table, tweetuser_tuples)
-	batch_insert(cursor, tweetplace_table, tweetplace_tuples)
-	batch_insert(cursor, tweethashtag_table, tweethashtag_tuples)
-	batch_insert(cursor, tweetmention_table, tweetmention_tuples)
-	batch_insert(cursor, tweeturl_table, tweeturl_tuples)
+			added_ids.add(seen_tweet_ids, tweetId)
+			add_parent_tweets(tweet, collectedAt, tuples, user_versions, added_ids)
 
-	db.commit()
+		if FOREIGN_KEYS == IMMEDIATE_FOREIGN_KEYS:
+			if len(tuples[tweet_table]) >= MAX_BUFFERED_TWEETS:
+				insert_tuples(sink, table_tuples, rows_loaded)
+		else:
+			## Without per-row checks the tables don't have to be flushed together: each goes out as soon as its own buffer fills
+			insert_tuples(sink, table_tuples, rows_loaded, min_rows=MAX_BUFFERED_TWEETS)
 
+	insert_tuples(sink, table_tuples, rows_loaded)
 
+def add_tweet_tuples(tweet, collectedAt, tuples, user_versions, added_ids):
+	''' Adds the tweet's rows to tuples ({table: [row, ...]}) and its user's profile to user_versions '''
+	tweetId = tweet["id_str"]
 
+	tuples[tweet_table].append(get_tweet_tuple(tweet, collectedAt))
+	user_versions.add(tweet["user"], collectedAt)
+	if USER_COPIES_PER_TWEET:
+		tuples[tweetuser_table].append(get_tweetuser_tuple(tweet, collectedAt))
+
+	place = tweet.get("place", None)
+	if place:
+		tuples[tweetplace_table].append(get_tweetplace_tuple(tweet))
+		if place["id"] not in seen_place_ids:
+			added_ids.add(seen_place_ids, place["id"])
+			tuples[place_table].append(get_place_tuple(place))
+
+	entities = tweet.get("entities", None)
+	if entities:
+		if "hashtags" in entities:
+			for hashtag in entities["hashtags"]:
+				tuples[tweethashtag_table].append((tweetId, clean(hashtag["text"])))
+
+		if "user_mentions" in entities:
+			userId = tweet["user"]["id_str"]
+			for mention in entities["user_mentions"]:
+				mentionedId = mention["id_str"]
+				mentionedScreenName = clean(mention["screen_name"])
+				mentionedName = clean(mention["name"])
+
+				tuples[tweetmention_table].append((tweetId, userId, mentionedId, mentionedScreenName, mentionedName))
+
+		if "urls" in entities:
+			for url in entities["urls"]:
+				entity_url = url["url"]
+				display_url = url["display_url"]
+				expanded_url = url["expanded_url"]
+
+				tuples[tweeturl_table].append((tweetId, entity_url, display_url, expanded_url))
+
+def add_parent_tweets(tweet, collectedAt, tuples, user_versions, added_ids):
+	''' Adds the retweeted and quoted tweets embedded in tweet (and theirs in turn) that this process hasn't loaded yet '''
+	for key in ("retweeted_status", "quoted_status"):
+		parent = tweet.get(key)
+		if not parent:
+			continue
+		parentId = parent["id_str"]
+		if parentId in seen_tweet_ids:
+			metrics.count("parent_tweets_total", result="seen")
+			continue
+
+		added_ids.add_parent(parentId)
+		## The parent as it was embedded when this timeline was collected
+		add_tweet_tuples(parent, collectedAt, tuples, user_versions, added_ids)
+		metrics.count("parent_tweets_total", result="loaded")
+		add_parent_tweets(parent, collectedAt, tuples, user_versions, added_ids)
+
+def get_referenced_tweet_ids(cursor, tweetIds):
+	''' The tweetIds that a tweet not among them retweets or quotes '''
+	cursor.execute("SELECT \"retweetedStatusId\" FROM " + tweet_table.name + " WHERE \"retweetedStatusId\" = ANY(%s) AND NOT (\"tweetId\" = ANY(%s))"
+		+ " UNION SELECT \"quotedStatusId\" FROM " + tweet_table.name + " WHERE \"quotedStatusId\" = ANY(%s) AND NOT (\"tweetId\" = ANY(%s))", (tweetIds, tweetIds, tweetIds, tweetIds))
+	return set(row[0] for row in cursor.fetchall())
+
+def unload_users(cursor, userIds):
+	''' Deletes the users' tweets and everything hanging off them; their Geo_User versions stay, as the history they are.
+	Tweets of theirs that other users' tweets retweet or quote (loaded as parents, with INCLUDE_PARENT_TWEETS, from
+	timelines that aren't being reloaded) are kept, with their rows: when the users' timelines still hold them they're
+	merged again under ON_CONFLICT (which with None fails the file) '''
+	if not userIds:
+		return
+	userIds = [int(userId) for userId in userIds]
+	## Tweets loaded before Tweet had a userId are only linked to their user through TweetUser
+	cursor.execute("SELECT \"tweetId\" FROM " + tweet_table.name + " WHERE \"userId\" = ANY(%s) UNION SELECT \"tweetId\" FROM " + tweetuser_table.name + " WHERE \"userId\" = ANY(%s)", (userIds, userIds))
+	tweetIds = set(row[0] for row in cursor.fetchall())
+	## A kept tweet keeps the tweets it retweets or quotes in turn
+	referencedIds = get_referenced_tweet_ids(cursor, list(tweetIds))
+	while referencedIds:
+		tweetIds = tweetIds - referencedIds
+		referencedIds = get_referenced_tweet_ids(cursor, list(tweetIds))
+
+	tweetIds = list(tweetIds)
+	for table in [tweetuser_table, tweethashtag_table, tweetmention_table, tweeturl_table, tweetplace_table, tweet_table]:
+		cursor.execute("DELETE FROM " + table.name + " WHERE \"tweetId\" = ANY(%s)", (tweetIds,))
+	## So a later file loads the ones it holds as parents again
+	for tweetId in tweetIds:
+		seen_tweet_ids.discard(str(tweetId))
+
+def unload_file(cursor, path):
+	## Removes the rows loaded from an earlier version of this file, for every user it holds
+	unload_users(cursor, get_timeline_uids(path))
+
+#####################################
+#####################################
 
+if __name__ == "__main__":
+	arg_parser = argparse.ArgumentParser()
+	arg_parser.add_argument("db_config", nargs="?", default=None)
+	arg_parser.add_argument("json_files_dir")
+	arg_parser.add_argument("--workers", type=int, default=1, help="number of worker processes, each with its own connection")
+	arg_parser.add_argument("--export-dir", default=None, help="write the rows to columnar files here, one per table, instead of the database")
+	arg_parser.add_argument("--export-format", choices=sorted(SINK_CLASSES), default="parquet")
+	arg_parser.add_argument("--metrics-dir", default=None, help="write JSON logs and a Prometheus file of the run's metrics here")
+	args = arg_parser.parse_args()
+	if args.metrics_dir:
+		metrics.configure(args.metrics_dir, "postgres_db")
+
+	if args.export_dir:
+		## One file per table, so the files are read one after another by this process
+		export_files(SINK_CLASSES[args.export_format](args.export_dir, all_tables), list_timeline_sources(args.json_files_dir), load_timelines)
+		metrics.close()
+		sys.exit(0)
+	if args.db_config is None:
+		arg_parser.error("db_config is needed unless --export-dir is given")
+
+	## Connecting to the database
+	db = parallel_loader.connect(args.db_config)
+	time.sleep(5)
+	cursor = db.cursor()
+
+	## Creating tables in the database if they don't exist
+	manifest = LoadManifest("postgres_db", prefix=TABLE_PREFIX)
+	cursor.execute(manifest.table.get_create_statement(if_not_exists=True))
+	for table in reversed(all_tables):
+		if DROP_EXISTING_TABLES:
+			cursor.execute(table.get_drop_statement(if_exists=True))
+	if DROP_EXISTING_TABLES:
+		manifest.clear(cursor)
+	for table in all_tables:
+		cursor.execute(table.get_create_statement(if_not_exists=True,
+			deferrable_foreign_keys=(FOREIGN_KEYS == DEFERRED_FOREIGN_KEYS),
+			include_foreign_keys=(FOREIGN_KEYS != VALIDATE_FOREIGN_KEYS_AFTER)))
+		## e.g. Tweet.userId, on tables created before it
+		for statement in table.get_add_column_statements():
+			cursor.execute(statement)
+		for statement in table.get_index_statements(deferred=False if DEFER_INDEXES else None):
+			cursor.execute(statement)
+	## TweetPlace tables created while placeId was a BIGINT; checked first, as the ALTER locks the table even when it changes nothing
+	cursor.execute("SELECT data_type FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = %s AND column_name = 'placeId'", (tweetplace_table.name.lower(),))
+	if cursor.fetchone()[0] != "text":
+		cursor.execute("ALTER TABLE " + tweetplace_table.name + " ALTER COLUMN \"placeId\" TYPE TEXT")
+
+	cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema='public'")
+	print(cursor.fetchall())
+
+	## <uid>.json files, the (compressed) .ndjson files the collectors can also write, or an archive's shards
+	json_paths = list_timeline_sources(args.json_files_dir)
+
+	if not manifest.get_loaded(cursor):
+		## The first run against tables loaded before the manifest existed records the users already there, once
+		cursor.execute("SELECT DISTINCT \"userId\"::TEXT FROM " + tweet_table.name + " UNION SELECT DISTINCT \"userId\"::TEXT FROM " + tweetuser_table.name + ";")
+		users_processed = set([row[0] for row in cursor.fetchall()])
+		for path in json_paths:
+			## all() holds for a source with no current timelines too, which is no sign it was loaded
+			uids = get_timeline_uids(path)
+			if uids and all(uid in users_processed for uid in uids):
+				manifest.record(cursor, path, get_file_hash(path), None)
+	db.commit()
+
+	## Only files that are new or changed since they were recorded get loaded
+	tasks = manifest.plan(cursor, json_paths)
+	prepare_foreign_keys(cursor)
+	db.commit()
 
+	parallel_loader.load_files(args.db_config, tasks, load_file, workers=args.workers, manifest=manifest, unload_file=unload_file, rollback_file=forget_file)
+	restore_foreign_keys(db, args.db_config, workers=args.workers)
 
+	if DEFER_INDEXES:
+		index_statements = [statement for table in all_tables for statement in table.get_index_statements(deferred=True, concurrently=True)]
+		parallel_loader.run_statements(args.db_config, index_statements, workers=args.workers)
 
+	metrics.close()
@@ -0,0 +1,166 @@
+'''
+A rate limiter for one Twitter endpoint and one set of credentials, driven by the x-rate-limit-* headers instead
+of fixed sleeps. The requests left in the current window are spread evenly over the time left in it (a token
+bucket refilled at remaining / seconds-to-reset, holding at most BURST requests), and once the window is spent it
+waits only until the reset the API reported.
+
+Example:
+
+limiter = RateLimiter(name="statuses/user_timeline")
+for page in rate_limited_pages(limiter, api, tweepy.Cursor(api.user_timeline, id=uid, count=200).pages()):
+	...
+print(limiter.get_metrics())
+
+## Or by hand around any request
+limiter.wait()
+response = session.get(url)
+limiter.update(response.headers)
+
+'''
+
+import metrics
+import threading
+import time
+
+## Used until the first response's headers give the real numbers (900 per 15 minutes is user_timeline's user-auth limit)
+DEFAULT_LIMIT = 900
+DEFAULT_WINDOW_SECONDS = 15*60
+BURST = 10 ## requests that can go out back to back after an idle stretch
+RESET_MARGIN = 1 ## x-rate-limit-reset is rounded down to the second, so wait this much past it
+
+def is_rate_limit_error(ex):
+	''' True for a tweepy/requests error carrying a 429 response '''
+	response = getattr(ex, "response", None)
+	return getattr(response, "status_code", None) == 429
+
+class RateLimiter():
+
+	def __init__(self, limit=DEFAULT_LIMIT, window_seconds=DEFAULT_WINDOW_SECONDS, burst=BURST, name=""):
+		self.name = name
+		self.limit = limit
+		self.window_seconds = window_seconds
+		self.burst = burst
+		self.remaining = limit
+		self.reset = None ## end of the current window (epoch seconds), assumed to start with the first request until the headers say
+		self.tokens = float(burst)
+		self.last_refill = time.time()
+		self.lock = threading.RLock()
+
+		## Metrics
+		self.requests = 0
+		self.waits = 0
+		self.seconds_waited = 0.0
+		self.rate_limited_count = 0
+
+	def refresh(self, now):
+		if self.reset is None or self.reset + RESET_MARGIN <= now:
+			## A new window: full budget again until the headers say otherwise
+			self.remaining = self.limit
+			self.reset = now + self.window_seconds
+			self.tokens = float(self.burst)
+		self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.get_rate(now))
+		self.last_refill = now
+
+	def get_rate(self, now):
+		''' Requests per second that use up what's left of the window exactly at its reset '''
+		return max(self.remaining, 0) / max(self.reset - now, 1.0)
+
+	def get_delay(self, now=None):
+		''' Seconds until the next request may go out (0 if it can go now) '''
+		now = now or time.time()
+		with self.lock:
+			self.refresh(now)
+			if self.remaining <= 0:
+				return self.reset + RESET_MARGIN - now
+			if self.tokens >= 1:
+				return 0
+			return (1 - self.tokens) / self.get_rate(now)
+
+	def take(self):
+		''' Counts a request that's going out now; call it only when get_delay() is 0 '''
+		with self.lock:
+			self.tokens = self.tokens - 1
+			self.remaining = self.remaining - 1
+			self.requests = self.requests + 1
+		metrics.count("api_requests_total", limiter=self.name)
+
+	def try_take(self):
+		''' Takes a request if one is available now, returning 0, or returns how many seconds to wait first '''
+		with self.lock:
+			delay = self.get_delay()
+			if delay <= 0:
+				self.take()
+			return delay
+
+	def record_wait(self, seconds):
+		with self.lock:
+			self.waits = self.waits + 1
+			self.seconds_waited = self.seconds_waited + seconds
+		metrics.count("rate_limit_waits_total", limiter=self.name)
+		metrics.count("rate_limit_wait_seconds_total", seconds, limiter=self.name)
+
+	def wait(self):
+		''' Blocks until a request may go out, and counts it '''
+		while True:
+			delay = self.try_take()
+			if delay <= 0:
+				return
+			self.record_wait(delay)
+			time.sleep(delay)
+
+	def update(self, headers):
+		''' Takes the window's real limit, remaining requests and reset time from a response's headers '''
+		remaining = headers.get("x-rate-limit-remaining")
+		reset = headers.get("x-rate-limit-reset")
+		if remaining is None or reset is None:
+			return
+		limit = headers.get("x-rate-limit-limit")
+		with self.lock:
+			if limit is not None:
+				self.limit = int(limit)
+			self.remaining = int(remaining)
+			self.reset = int(reset)
+
+	def rate_limited(self, headers=None):
+		''' After a 429: nothing left until the reset the headers give (or a full window from now if they don't) '''
+		reset = headers.get("x-rate-limit-reset") if headers is not None else None
+		with self.lock:
+			self.rate_limited_count = self.rate_limited_count + 1
+			self.remaining = 0
+			self.reset = int(reset) if reset is not None else time.time() + self.window_seconds
+		metrics.count("rate_limited_total", limiter=self.name)
+
+	def get_metrics(self):
+		with self.lock:
+			now = time.time()
+			return {
+				"name": self.name,
+				"requests": self.requests,
+				"rate_limited": self.rate_limited_count,
+				"waits": self.waits,
+				"seconds_waited": round(self.seconds_waited, 3),
+				"limit": self.limit,
+				"remaining": self.remaining,
+				"reset_in": round(max(self.reset - now, 0), 3) if self.reset else None,
+				"rate": round(self.get_rate(now), 4) if self.reset else None
+			}
+
+def rate_limited_pages(limiter, api, pages):
+	''' Goes through a tweepy Cursor's pages one request at a time through limiter. A page that gets a 429 is retried after the real reset '''
+	while True:
+		limiter.wait()
+		try:
+			with metrics.timer("api_request", endpoint=limiter.name):
+				page = next(pages)
+		except StopIteration:
+			return
+		except Exception as ex:
+			if not is_rate_limit_error(ex):
+				raise
+			## tweepy's page iterators only move on after a successful request, so next() asks for the same page again
+			limiter.rate_limited(ex.response.headers)
+			continue
+		last_response = getattr(api, "last_response", None)
+		if last_response is not None:
+			limiter.update(last_response.headers)
+		yield page
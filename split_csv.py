@@ -1,34 +1,80 @@
-import csv
-import math
-import sys
-
 '''
-Splits a csv file with n rows into k different files of roughly n/k rows (assumes no header row).
+Splits a csv file with n rows into k files, <input>_0.csv ... <input>_<k-1>.csv (assumes no header row; blank
+lines are dropped). Rows are streamed through, so memory stays the same however long the input is:
+
+	contiguous    the first ceil(n/k) rows go in the first file, the next ceil(n/k) in the second, and so on: one
+	              pass over the input to count its rows, then one to write them
+	round-robin   row i goes in file i mod k, in a single pass
+	hash          each row goes in the file picked by a hash of its --column value (the uid; the first column by
+	              default), in a single pass. A uid always lands in the same file for a given k, on any machine and
+	              whatever else the list holds, so the same users go to the same collector from one split to the next
 
-Usage: python split_csv.py input.csv k
+All k output files stay open for the whole split, each with a WRITE_BUFFER_BYTES write buffer.
 
+Usage: python split_csv.py input.csv k [--mode contiguous|round-robin|hash] [--column N]
 '''
 
-input_file = sys.argv[1]
-k = int(sys.argv[2])
-file_prefix = input_file.split(".")[0]
+import argparse
+import csv
+import hashlib
+import math
+import os
+
+MODES = ["contiguous", "round-robin", "hash"]
+WRITE_BUFFER_BYTES = 1 << 20 ## Per output file
+
+def read_rows(input_file):
+	with open(input_file, newline="") as f:
+		for row in csv.reader(f):
+			if row:
+				yield row
 
-reader = csv.reader(open(input_file))
-lines = list(reader)
-n = len(lines)
+def get_output_files(input_file, k):
+	file_prefix = os.path.splitext(input_file)[0]
+	return [file_prefix + "_" + str(file_num) + ".csv" for file_num in range(k)]
 
-lines_per_file = int(math.ceil(float(n)/k))
+def get_hash_file_num(value, k):
+	## md5 rather than hash(), which Python salts differently in every process
+	return int(hashlib.md5(value.strip().encode("utf-8")).hexdigest(), 16) % k
 
-for file_num in range(k):
-	new_file = file_prefix + "_" + str(file_num) + ".csv"
-	writer = csv.writer(open(new_file, "w+"))
+def split_csv(input_file, k, mode="contiguous", column=0):
+	''' Writes the input's rows into k files (see above), returning how many rows went into each '''
+	assert mode in MODES, "Unknown mode " + mode
+	assert k > 0, "k must be at least 1"
+	if mode == "contiguous":
+		n = sum(1 for row in read_rows(input_file))
+		lines_per_file = max(int(math.ceil(float(n) / k)), 1)
 
-	start = file_num * lines_per_file
+	counts = [0] * k
+	files = []
+	try:
+		for path in get_output_files(input_file, k):
+			files.append(open(path, "w", newline="", buffering=WRITE_BUFFER_BYTES))
+		writers = [csv.writer(f) for f in files]
 
-	for index in range(start, start + lines_per_file):
-		if index < len(lines):
-			writer.writerow(lines[index])
-		else:
-			break
+		for index, row in enumerate(read_rows(input_file)):
+			if mode == "contiguous":
+				file_num = min(index // lines_per_file, k - 1)
+			elif mode == "round-robin":
+				file_num = index % k
+			else:
+				assert len(row) > column, "Row {index} has no column {column}: {row}".format(index=index, column=column, row=row)
+				file_num = get_hash_file_num(row[column], k)
+			writers[file_num].writerow(row)
+			counts[file_num] = counts[file_num] + 1
+	finally:
+		for f in files:
+			f.close()
+	return counts
 
+if __name__ == "__main__":
+	arg_parser = argparse.ArgumentParser()
+	arg_parser.add_argument("input_file")
+	arg_parser.add_argument("k", type=int)
+	arg_parser.add_argument("--mode", choices=MODES, default="contiguous")
+	arg_parser.add_argument("--column", type=int, default=0, help="the column hashed in hash mode (the uid)")
+	args = arg_parser.parse_args()
 
+	counts = split_csv(args.input_file, args.k, args.mode, args.column)
+	for path, count in zip(get_output_files(args.input_file, args.k), counts):
+		print("{path}: {count} rows".format(path=path, count=count))
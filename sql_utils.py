@@ -13,19 +13,107 @@ f5 = Field("tweetId", "BIGINT(20)", is_primary_key=True, foreign_key=f1, foreign
 t2 = Table("test2", [f5])
 print(t2.get_create_statement())
 
+cursor = db.cursor()
+t.copy_rows(cursor, [(1, False, True, None), (2, True, False, 1)])
+
+f6 = Field("userScreenName", "VARCHAR(45)", path="user.screen_name")
+f7 = Field("firstUrl", "TEXT", path="entities.urls[0].expanded_url")
+f8 = Field("collectedAt", "TIMESTAMP", context_key="collected_at")
+t3 = Table("test3", [f6, f7, f8])
+row = t3.extract_row(tweet, {"collected_at": collected_at})
+row = t3.extract_row(tweet, {"collected_at": collected_at}, raw_members) # JSON columns on top-level keys reuse the raw text
+
+f9 = Field("collectedAt", "TIMESTAMP")
+t4 = Table("test4", [f1, f2, f9], version_field="collectedAt")
+print(t4.get_insert_statement(on_conflict=KEEP_LATEST)) # INSERT ... ON CONFLICT ("tweetId") DO UPDATE ... WHERE older
+t4.merge_rows(cursor, rows, KEEP_FIRST) # COPY into a temp staging table, then INSERT ... SELECT ... ON CONFLICT DO NOTHING
+t7 = Table("test7", [Field("tweetId", "BIGINT(20)", foreign_key=f1, foreign_key_table=t4), f7]) # no primary key: merged along with t4's rows
+t7.merge_rows(cursor, rows, KEEP_LATEST) # only the rows of t4 keys this transaction's t4 merges inserted or replaced, so merge t4 first
+t6 = Table("test6", [f1, f2, f9], version_field="collectedAt", on_conflict=KEEP_EARLIEST) # always merged this way, whatever the loader's policy
+print(t6.get_add_column_statements()) # ALTER TABLE ... ADD COLUMN IF NOT EXISTS, for tables created before a field was declared
+
+i1 = Index(["collectedAt"], method="brin")
+t5 = Table("test5", [f1, f2, f9], indexes=[i1], partition_by="collectedAt")
+print(t5.get_create_statement())                        # ... PRIMARY KEY ("tweetId","collectedAt")) PARTITION BY RANGE ("collectedAt");
+print(t5.get_partition_statements("2017-08", "2017-09")) # one partition per month plus a default partition
+print(t5.get_index_statements(deferred=True))
+
+print(t2.get_create_statement(deferrable_foreign_keys=True)) # ... DEFERRABLE INITIALLY DEFERRED: checked at commit, not per row
+print(t2.get_drop_foreign_key_statements())                 # before a bulk load; afterwards put them back without a per-row check:
+print(t2.get_add_foreign_key_statements(not_valid=True) + t2.get_validate_foreign_key_statements())
+
 '''
 
+import datetime
+
+import io
+from json_encoding import encode_json
+import metrics
+import re
+
+## Rows are buffered in memory and streamed to COPY in chunks of this many rows
+COPY_CHUNK_ROWS = 10000
+
+## What to do with a row whose key is already in the table: keep the row that's there,
+## or replace it when the new row's version_field (e.g. collectedAt) is later (or earlier)
+KEEP_FIRST = "keep_first"
+KEEP_LATEST = "keep_latest"
+KEEP_EARLIEST = "keep_earliest"
+
+## When foreign keys are checked during a bulk load: per row, once per transaction at commit,
+## or not at all until they're re-added NOT VALID and validated in a single pass after the load
+IMMEDIATE_FOREIGN_KEYS = "immediate"
+DEFERRED_FOREIGN_KEYS = "deferred"
+VALIDATE_FOREIGN_KEYS_AFTER = "validate_after"
+
+## Postgres TEXT/VARCHAR can't hold NUL at all and JSONB rejects \u0000, so both are stripped
+## (the lookbehind skips an escaped backslash followed by the literal text "u0000")
+JSON_NUL_ESCAPE = re.compile(r'(?<!\\)((?:\\\\)*)\\u0000')
+
+def get_copy_value(value, is_json=False):
+	''' Formats a single value for COPY ... WITH (FORMAT csv, NULL '\\N') '''
+	if value is None:
+		return "\\N"
+	if is_json:
+		if not isinstance(value, str):
+			value = encode_json(value)
+		value = JSON_NUL_ESCAPE.sub(r"\1", value)
+	elif isinstance(value, bool):
+		return "t" if value else "f"
+	else:
+		value = str(value)
+	## Every non-NULL value is quoted, so an empty string or a literal "\N" never reads back as NULL
+	return '"' + value.replace("\x00", "").replace('"', '""') + '"'
+
+def get_copy_line(row, json_flags):
+	''' Formats a row as one line of COPY ... WITH (FORMAT csv, NULL '\\N') input '''
+	return ",".join([get_copy_value(value, is_json) for value, is_json in zip(row, json_flags)]) + "\n"
+
+PATH_PART = re.compile(r"([^.\[\]]+)|\[(\d+)\]")
+
+def parse_path(path):
+	''' "entities.urls[0].expanded_url" -> ("entities", "urls", 0, "expanded_url") '''
+	return tuple(int(index) if index else key for key, index in PATH_PART.findall(path))
+
 
 class Field():
 
-	def __init__(self, name, datatype, is_primary_key=False, foreign_key=None, foreign_key_table=None):
+	def __init__(self, name, datatype, is_primary_key=False, foreign_key=None, foreign_key_table=None, path=None, context_key=None, transform=None):
 		self.name = "\"" + name + "\""
 		self.datatype = datatype
 		self.is_primary_key = is_primary_key
 		self.foreign_key = foreign_key
 		self.foreign_key_table = foreign_key_table
+		## Where Table.extract_row gets this column's value: a path into the record, or a key of the per-call context
+		self.path = path
+		self.context_key = context_key
+		self.transform = transform ## applied to non-null extracted values
 		
 		assert bool(foreign_key) == bool(foreign_key_table), "If foreign_key is assigned, foreign_key_table must also be assigned"
+		assert not (path and context_key), "A field can't have both a path and a context_key"
+
+	def is_json(self):
+		return self.datatype.upper() in ("JSON", "JSONB")
 
 	def get_insert_clause(self):
 		return "{name} {datatype}".format(
@@ -33,60 +121,405 @@ class Field():
 				datatype = self.datatype
 			)
 
-	def get_foreign_key_clause(self):
-		return "FOREIGN KEY ({field}) REFERENCES {other_table} ({other_field})".format(
+	def get_foreign_key_clause(self, constraint_name=None, deferrable=False):
+		foreign_key_clause = "FOREIGN KEY ({field}) REFERENCES {other_table} ({other_field})".format(
 				field=self.name,
 				other_table=self.foreign_key_table.name,
 				other_field=self.foreign_key.name
 			)
+		if constraint_name:
+			foreign_key_clause = "CONSTRAINT " + constraint_name + " " + foreign_key_clause
+		if deferrable:
+			## Checked once at commit instead of once per inserted row
+			foreign_key_clause = foreign_key_clause + " DEFERRABLE INITIALLY DEFERRED"
+		return foreign_key_clause
+
+class Index():
+
+	def __init__(self, field_names, method="btree", name=None, defer=True):
+		self.field_names = field_names
+		self.method = method
+		self.name = name
+		## Deferred indexes are built after a bulk load; the rest are needed while loading (e.g. by merges)
+		self.defer = defer
+
+	def get_name(self, table):
+		return self.name or table.name + "_" + "_".join(self.field_names) + "_idx"
+
+	def get_create_statement(self, table, concurrently=False, if_not_exists=True):
+		columns = []
+		for field_name in self.field_names:
+			field = table.get_field(field_name)
+			assert field, "Table " + table.name + " has no field " + field_name
+			## Plain JSON has no GIN operator class, so it's indexed as JSONB
+			if self.method.lower() == "gin" and field.datatype.upper() == "JSON":
+				columns.append("(" + field.name + "::jsonb)")
+			else:
+				columns.append(field.name)
+
+		return "CREATE INDEX{concurrently}{if_not_exists} {name} ON {table_name} USING {method} ({columns});".format(
+			concurrently=" CONCURRENTLY" if concurrently else "",
+			if_not_exists=" IF NOT EXISTS" if if_not_exists else "",
+			name=self.get_name(table),
+			table_name=table.name,
+			method=self.method.upper(),
+			columns=", ".join(columns))
+
+class RowExtractor():
+	''' Compiles the paths declared on a list of fields once, then turns nested records into row tuples in one pass '''
+
+	def __init__(self, fields):
+		## Every distinct path prefix is looked up once per record, parents before children,
+		## so user.* and retweeted_status.user.* share their user / retweeted_status lookups
+		self.steps = []
+		self.columns = []
+
+		node_ids = {(): 0}
+		for field in fields:
+			if field.context_key:
+				self.columns.append((None, field.context_key, field.transform, None))
+				continue
+
+			assert field.path, "Field " + field.name + " has neither a path nor a context_key"
+			keys = parse_path(field.path)
+			for i in range(1, len(keys) + 1):
+				if keys[:i] not in node_ids:
+					node_ids[keys[:i]] = len(self.steps) + 1
+					self.steps.append((node_ids[keys[:i - 1]], keys[i - 1]))
+			## A JSON column holding a whole top-level member can take that member's raw text as is
+			raw_key = keys[0] if field.is_json() and len(keys) == 1 else None
+			self.columns.append((node_ids[keys], None, field.transform, raw_key))
+
+	def extract(self, record, context=None, raw_members=None):
+		values = [record]
+		append = values.append
+		for parent, key in self.steps:
+			value = values[parent]
+			if value is None:
+				append(None)
+				continue
+			try:
+				append(value[key])
+			except (KeyError, IndexError, TypeError):
+				append(None)
+
+		row = []
+		for node, context_key, transform, raw_key in self.columns:
+			if raw_key is not None and raw_members is not None:
+				value = raw_members.get(raw_key)
+				row.append(None if value == "null" else value)
+				continue
+
+			value = values[node] if context_key is None else context[context_key]
+			if transform is not None and value is not None:
+				value = transform(value)
+			row.append(value)
+		return tuple(row)
 
 class Table():
 
-	def __init__(self, name, fields, prefix=""):
+	def __init__(self, name, fields, prefix="", version_field=None, indexes=None, partition_by=None, on_conflict=None):
 		if prefix:
 			name = prefix + name
 		self.name = name
 		self.fields = fields
+		self.extractor = None
+		self.staging_table = None
+		self.version_field = self.get_field(version_field) if version_field else None
+		## A policy of the table's own (e.g. KEEP_FIRST for a dimension table) that loaders use instead of theirs
+		self.on_conflict = on_conflict
+		self.indexes = indexes or []
+		## Declarative range partitioning on this field (see get_partition_statements)
+		self.partition_by = self.get_field(partition_by) if partition_by else None
+		## Set once a child table names this one as its parent, so merges record the keys they touch (see get_merge_statements)
+		self.has_children = False
+		parent_field = self.get_parent_field()
+		if parent_field and not self.get_primary_keys():
+			parent_field.foreign_key_table.has_children = True
 
 	def get_drop_statement(self, if_exists=False):
 		if_exists_clause = " IF EXISTS"
 		drop_statement = "DROP TABLE{if_exists} {table_name};".format(table_name=self.name, if_exists=if_exists_clause)
 		return drop_statement
 
-	def get_create_statement(self, if_not_exists=False):
+	def get_create_statement(self, if_not_exists=False, deferrable_foreign_keys=False, include_foreign_keys=True):
 		if_not_exists_clause = " IF NOT EXISTS" if if_not_exists else ""
 		
 		field_strs = [field.get_insert_clause() for field in self.fields]
 
-		primary_keys = [field.name for field in self.fields if field.is_primary_key]
+		primary_keys = [field.name for field in self.get_primary_keys()]
 		if primary_keys:
 			primary_key_clause = "PRIMARY KEY (" + ",".join(primary_key for primary_key in primary_keys) + ")"
 			field_strs.append(primary_key_clause)
 
-		foreign_keys = [field.get_foreign_key_clause() for field in self.fields if field.foreign_key]
-		for foreign_key in foreign_keys:
-			field_strs.append(foreign_key)
+		if include_foreign_keys:
+			for field in self.get_foreign_key_fields():
+				field_strs.append(field.get_foreign_key_clause(self.get_foreign_key_name(field), deferrable=deferrable_foreign_keys))
+
+		partition_clause = " PARTITION BY RANGE (" + self.partition_by.name + ")" if self.partition_by else ""
 
-		create_statement = "CREATE TABLE{if_not_exists} {table_name}({fields});".format(
+		create_statement = "CREATE TABLE{if_not_exists} {table_name}({fields}){partition_clause};".format(
 				if_not_exists=if_not_exists_clause,
 				table_name=self.name,
-				fields=", ".join(field_strs))
+				fields=", ".join(field_strs),
+				partition_clause=partition_clause)
 
 		return create_statement
 
-	def get_insert_statement(self):
+	def get_add_column_statements(self):
+		''' ADD COLUMN IF NOT EXISTS for every field, so a table created before a field was declared gets it (as NULLs) '''
+		return ["ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {column};".format(
+			table_name=self.name,
+			column=field.get_insert_clause()) for field in self.fields]
+
+	def get_partition_statements(self, start_month, end_month, if_not_exists=True):
+		''' One partition per month from start_month to end_month ("YYYY-MM", inclusive), plus a default partition for everything else '''
+		if_not_exists_clause = " IF NOT EXISTS" if if_not_exists else ""
+		month = datetime.datetime.strptime(start_month, "%Y-%m").date()
+		end = datetime.datetime.strptime(end_month, "%Y-%m").date()
+
+		statements = []
+		while month <= end:
+			next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+			statements.append("CREATE TABLE{if_not_exists} {table_name}_{suffix} PARTITION OF {table_name} FOR VALUES FROM ('{start}') TO ('{end}');".format(
+				if_not_exists=if_not_exists_clause,
+				table_name=self.name,
+				suffix=month.strftime("%Y_%m"),
+				start=month.isoformat(),
+				end=next_month.isoformat()))
+			month = next_month
+
+		statements.append("CREATE TABLE{if_not_exists} {table_name}_default PARTITION OF {table_name} DEFAULT;".format(
+			if_not_exists=if_not_exists_clause,
+			table_name=self.name))
+		return statements
+
+	def get_index_statements(self, deferred=None, concurrently=False):
+		''' CREATE INDEX statements for the declared indexes (only the deferred or non-deferred ones if deferred is given) '''
+		## Postgres can't build an index on a partitioned table concurrently
+		concurrently = concurrently and not self.partition_by
+		return [index.get_create_statement(self, concurrently=concurrently) for index in self.indexes if deferred is None or index.defer == deferred]
+
+	def get_primary_keys(self):
+		## Postgres requires the partition key to be part of the primary key of a partitioned table
+		primary_keys = [field for field in self.fields if field.is_primary_key]
+		if primary_keys and self.partition_by and self.partition_by not in primary_keys:
+			primary_keys.append(self.partition_by)
+		return primary_keys
+
+	def get_key_fields(self):
+		''' Rows are identified by the primary key, or for child tables without one by their foreign keys '''
+		return self.get_primary_keys() or self.get_foreign_key_fields()
+
+	def get_foreign_key_fields(self):
+		return [field for field in self.fields if field.foreign_key]
+
+	def get_parent_field(self):
+		''' The foreign key (the first one) whose row a child table's rows belong to, and are merged along with '''
+		foreign_key_fields = self.get_foreign_key_fields()
+		return foreign_key_fields[0] if foreign_key_fields else None
+
+	def get_foreign_key_name(self, field):
+		## The name Postgres picks by default (<table>_<column>_fkey), so tables created before FKs were named still match
+		return "\"" + self.name.lower() + "_" + field.name.strip("\"") + "_fkey\""
+
+	def get_add_foreign_key_statements(self, deferrable=False, not_valid=False, fields=None):
+		''' ALTER TABLE ... ADD CONSTRAINT for each foreign key (or those of fields); with not_valid=True existing rows aren't checked until VALIDATE CONSTRAINT '''
+		return ["ALTER TABLE {table_name} ADD {foreign_key_clause}{not_valid};".format(
+			table_name=self.name,
+			foreign_key_clause=field.get_foreign_key_clause(self.get_foreign_key_name(field), deferrable=deferrable),
+			not_valid=" NOT VALID" if not_valid else "") for field in fields or self.get_foreign_key_fields()]
+
+	def get_drop_foreign_key_statements(self):
+		return ["ALTER TABLE {table_name} DROP CONSTRAINT IF EXISTS {constraint_name};".format(
+			table_name=self.name,
+			constraint_name=self.get_foreign_key_name(field)) for field in self.get_foreign_key_fields()]
+
+	def get_validate_foreign_key_statements(self, fields=None):
+		''' VALIDATE CONSTRAINT only takes a SHARE UPDATE EXCLUSIVE lock, so validations can run side by side with reads and each other '''
+		return ["ALTER TABLE {table_name} VALIDATE CONSTRAINT {constraint_name};".format(
+			table_name=self.name,
+			constraint_name=self.get_foreign_key_name(field)) for field in fields or self.get_foreign_key_fields()]
+
+	def get_alter_foreign_key_statements(self, deferrable, fields=None):
+		''' Switches existing foreign keys between checked per row and checked at commit '''
+		return ["ALTER TABLE {table_name} ALTER CONSTRAINT {constraint_name} {deferrable};".format(
+			table_name=self.name,
+			constraint_name=self.get_foreign_key_name(field),
+			deferrable="DEFERRABLE INITIALLY DEFERRED" if deferrable else "NOT DEFERRABLE") for field in fields or self.get_foreign_key_fields()]
+
+	def get_conflict_clause(self, on_conflict):
+		primary_keys = [field.name for field in self.get_primary_keys()]
+		if not on_conflict or not primary_keys:
+			return ""
+		if on_conflict == KEEP_FIRST:
+			return " ON CONFLICT (" + ",".join(primary_keys) + ") DO NOTHING"
+
+		assert on_conflict in (KEEP_LATEST, KEEP_EARLIEST), "Unknown on_conflict policy: " + str(on_conflict)
+		assert on_conflict == KEEP_LATEST or self.version_field, "KEEP_EARLIEST needs a version_field"
+		updates = ["{name} = EXCLUDED.{name}".format(name=field.name) for field in self.fields if field.name not in primary_keys]
+		conflict_clause = " ON CONFLICT (" + ",".join(primary_keys) + ") DO UPDATE SET " + ", ".join(updates)
+		if self.version_field:
+			conflict_clause = conflict_clause + " WHERE {table_name}.{version} IS NULL OR {table_name}.{version} {comparison} EXCLUDED.{version}".format(
+				table_name=self.name,
+				version=self.version_field.name,
+				comparison="<" if on_conflict == KEEP_LATEST else ">")
+		return conflict_clause
+
+	def get_insert_statement(self, on_conflict=None):
 		row_template = ",".join([field.name for field in self.fields])
 
-		insert_statement = "INSERT INTO {table_name} ({row_template}) VALUES ({value_flags})".format(
+		insert_statement = "INSERT INTO {table_name} ({row_template}) VALUES ({value_flags}){conflict_clause}".format(
 			table_name=self.name,
 			row_template=row_template,
-			value_flags=",".join(["%s" for field in self.fields]))
-                
+			value_flags=",".join(["%s" for field in self.fields]),
+			conflict_clause=self.get_conflict_clause(on_conflict))
+
 		return insert_statement
 
+	def get_staging_table(self):
+		if self.staging_table is None:
+			self.staging_table = Table(self.name + "_staging", self.fields)
+		return self.staging_table
+
+	def get_merged_table_name(self):
+		return self.name + "_merged"
+
+	def get_merged_create_statement(self):
+		''' A temporary table of the keys the transaction's merges have inserted or replaced, for the child tables' merges '''
+		return "CREATE TEMP TABLE IF NOT EXISTS {merged_name} ({fields}) ON COMMIT DELETE ROWS".format(
+			merged_name=self.get_merged_table_name(),
+			fields=", ".join(field.get_insert_clause() for field in self.get_primary_keys()))
+
+	def get_merge_statements(self, on_conflict):
+		''' Statements that move the staging table's rows into this table under the on_conflict policy, then empty it '''
+		staging_name = self.get_staging_table().name
+		row_template = ",".join([field.name for field in self.fields])
+		key_fields = [field.name for field in self.get_key_fields()]
+		key_match = " AND ".join(["{table_name}.{key} = staging.{key}".format(table_name=self.name, key=key) for key in key_fields])
+
+		statements = []
+		if self.get_primary_keys():
+			## ON CONFLICT can't touch the same row twice in one statement, so keep one staged row per key first
+			order_by = ",".join(key_fields)
+			if self.version_field:
+				order_by = order_by + "," + self.version_field.name + (" DESC NULLS LAST" if on_conflict == KEEP_LATEST else " ASC NULLS LAST")
+			insert_statement = "INSERT INTO {table_name} ({row_template}) SELECT DISTINCT ON ({keys}) {row_template} FROM {staging_name} ORDER BY {order_by}{conflict_clause}".format(
+				table_name=self.name,
+				row_template=row_template,
+				keys=",".join(key_fields),
+				staging_name=staging_name,
+				order_by=order_by,
+				conflict_clause=self.get_conflict_clause(on_conflict))
+			if self.has_children:
+				## The keys actually inserted or replaced (not those the policy kept as they were) are the ones whose children get merged
+				insert_statement = "WITH merged AS ({insert_statement} RETURNING {keys}) INSERT INTO {merged_name} ({keys}) SELECT {keys} FROM merged".format(
+					insert_statement=insert_statement,
+					keys=",".join(key_fields),
+					merged_name=self.get_merged_table_name())
+			statements.append(insert_statement)
+			statements.append("TRUNCATE " + staging_name)
+			return statements
+
+		## Child rows have no key of their own, so they go in along with their parent: only for the parent rows this
+		## transaction's merges inserted or replaced. That leaves a parent kept as it was (e.g. a newer copy) with its own
+		## children, and since those merges hold the parent's row lock until commit, two loads of the same parent can't
+		## both add its children
+		parent_field = self.get_parent_field()
+		merged_parent = "staging.{key} IN (SELECT {parent_key} FROM {merged_name})".format(
+			key=parent_field.name,
+			parent_key=parent_field.foreign_key.name,
+			merged_name=parent_field.foreign_key_table.get_merged_table_name())
+		if on_conflict == KEEP_LATEST:
+			## Replace every row of a parent that shows up again...
+			statements.append("DELETE FROM {table_name} USING {staging_name} staging WHERE {key_match} AND {merged_parent}".format(
+				table_name=self.name,
+				staging_name=staging_name,
+				key_match=key_match,
+				merged_parent=merged_parent))
+			statements.append("INSERT INTO {table_name} ({row_template}) SELECT {row_template} FROM {staging_name} staging WHERE {merged_parent}".format(
+				table_name=self.name,
+				row_template=row_template,
+				staging_name=staging_name,
+				merged_parent=merged_parent))
+		else:
+			## ...or only add them for parents that don't have any yet
+			statements.append("INSERT INTO {table_name} ({row_template}) SELECT {row_template} FROM {staging_name} staging WHERE {merged_parent} AND NOT EXISTS (SELECT 1 FROM {table_name} WHERE {key_match})".format(
+				table_name=self.name,
+				row_template=row_template,
+				staging_name=staging_name,
+				merged_parent=merged_parent,
+				key_match=key_match))
+
+		statements.append("TRUNCATE " + staging_name)
+		return statements
+
+	def merge_rows(self, cursor, rows, on_conflict, chunk_size=COPY_CHUNK_ROWS):
+		''' Bulk loads rows at COPY speed into a temporary staging table, then merges them in. Returns the number of rows staged '''
+		staging_table = self.get_staging_table()
+		cursor.execute("CREATE TEMP TABLE IF NOT EXISTS {staging_name} (LIKE {table_name} INCLUDING DEFAULTS)".format(
+			staging_name=staging_table.name,
+			table_name=self.name))
+		if self.has_children:
+			cursor.execute(self.get_merged_create_statement())
+		elif not self.get_primary_keys():
+			cursor.execute(self.get_parent_field().foreign_key_table.get_merged_create_statement())
+
+		staged_count = staging_table.copy_rows(cursor, rows, chunk_size)
+		if staged_count:
+			with metrics.timer("merge", table=self.name):
+				for statement in self.get_merge_statements(on_conflict):
+					cursor.execute(statement)
+		return staged_count
+
+	def get_copy_statement(self):
+		copy_statement = "COPY {table_name} ({row_template}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(
+			table_name=self.name,
+			row_template=",".join([field.name for field in self.fields]))
+
+		return copy_statement
+
+	def copy_rows(self, cursor, rows, chunk_size=COPY_CHUNK_ROWS):
+		''' Bulk loads rows (any iterable of tuples) with COPY FROM STDIN, returns the number of rows copied '''
+		fields_required = len(self.fields)
+		json_flags = [field.is_json() for field in self.fields]
+		copy_statement = self.get_copy_statement()
+
+		buffer = io.StringIO()
+		buffered_count = 0
+		copied_count = 0
+		for row in rows:
+			assert len(row)==fields_required, "Row has incorrect number of fields: " + str(row)
+
+			buffer.write(get_copy_line(row, json_flags))
+			buffered_count = buffered_count + 1
+
+			if buffered_count >= chunk_size:
+				buffer.seek(0)
+				with metrics.timer("copy", table=self.name):
+					cursor.copy_expert(copy_statement, buffer)
+				copied_count = copied_count + buffered_count
+				buffer = io.StringIO()
+				buffered_count = 0
+
+		if buffered_count:
+			buffer.seek(0)
+			with metrics.timer("copy", table=self.name):
+				cursor.copy_expert(copy_statement, buffer)
+			copied_count = copied_count + buffered_count
+
+		return copied_count
+
+	def extract_row(self, record, context=None, raw_members=None):
+		''' Builds this table's row from a nested record using the fields' paths (compiled on first use) '''
+		if self.extractor is None:
+			self.extractor = RowExtractor(self.fields)
+		return self.extractor.extract(record, context, raw_members)
+
 	def get_field(self, name):
+		## Field names are stored quoted, so accept either form
 		for field in self.fields:
-			if field.name == name:
+			if field.name == name or field.name == "\"" + name + "\"":
 				return field
 
 
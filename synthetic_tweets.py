@@ -0,0 +1,319 @@
+'''
+Generates a deterministic synthetic corpus of user timelines, written like the collectors write them
+({"user_id", "utc_timestamp", "historic_tweets"} per <uid>.json), for benchmarking the loaders without real data.
+
+Tweets have the fields the loaders read (a full user object, entities, coordinates, place, reply fields) plus
+retweeted_status / quoted_status nesting, with tunable timeline lengths, entity counts and retweet/quote rates.
+Everything is derived from the seed and the user or tweet id alone, so the same settings always give the same
+corpus, and any one tweet can be rebuilt without generating the rest (fake_twitter_server.py relies on that).
+
+Usage: python synthetic_tweets.py output_dir [--users N] [--tweets N] [--hashtags N] [--mentions N] [--urls N] [--retweets F] [--quotes F] [--coordinates F] [--seed N] [--format FORMAT]
+
+Example:
+
+corpus = SyntheticCorpus(tweets_per_user=500, retweet_fraction=0.3)
+tweets = corpus.get_timeline(12345)          # newest first, like statuses/user_timeline
+corpus.write("json_data_synthetic", range(1000, 1100))
+
+'''
+
+import argparse
+import datetime
+import os
+import random
+from timeline_reader import TIMELINE_EXTENSIONS
+from timeline_writer import DEFAULT_FORMAT, TimelineWriter
+from timestamp_utils import get_snowflake_id, get_snowflake_timestamp
+
+TWITTER_DATE_FORMAT = "%a %b %d %H:%M:%S +0000 %Y"
+END_DATE = datetime.datetime(2017, 10, 1) ## Every timeline's newest tweet is from before this
+UTC_TIMESTAMP = "2017-10-02 12:00:00.123456" ## The collection time written into every file
+MAX_TIMELINE_TWEETS = 3200 ## The most the API pages back through, so the most a collected timeline holds
+MEAN_SECONDS_BETWEEN_TWEETS = 3600
+POPULATION = 100000 ## Mentioned, retweeted and quoted users are drawn from uids 1..POPULATION
+MAX_NESTING = 2 ## e.g. a retweet of a quote tweet
+
+## Defaults, all tunable from SyntheticCorpus / the command line
+TWEETS_PER_USER = 500 ## Mean timeline length (timeline lengths are exponentially distributed, capped at MAX_TIMELINE_TWEETS)
+HASHTAGS_PER_TWEET = 1.0 ## Mean entity counts per tweet
+MENTIONS_PER_TWEET = 0.8
+URLS_PER_TWEET = 0.4
+RETWEET_FRACTION = 0.3
+QUOTE_FRACTION = 0.1
+REPLY_FRACTION = 0.15
+COORDINATES_FRACTION = 0.02 ## Of the original tweets; they're all in the place they're tagged with
+PLACE_FRACTION = 0.05 ## Or COORDINATES_FRACTION, if that's higher
+
+WORDS = ["flood", "water", "rescue", "shelter", "rain", "storm", "road", "closed", "help", "need", "safe", "power",
+	"out", "family", "boat", "neighborhood", "update", "stay", "please", "\"high\"", "water,", "tonight", "Houston", "🌀", "señor", "&amp;"]
+HASHTAGS = ["harvey", "HurricaneHarvey", "houstonflood", "txwx", "HarveyRelief", "Houston", "prayforhouston"]
+SOURCES = [
+	'<a href="http://twitter.com/download/iphone" rel="nofollow">Twitter for iPhone</a>',
+	'<a href="http://twitter.com/download/android" rel="nofollow">Twitter for Android</a>',
+	'<a href="http://twitter.com" rel="nofollow">Twitter Web Client</a>',
+	'<a href="https://about.twitter.com/products/tweetdeck" rel="nofollow">TweetDeck</a>'
+]
+LANGS = ["en"] * 8 + ["es", "und"]
+TIME_ZONES = [(None, None), ("Central Time (US & Canada)", -18000), ("Eastern Time (US & Canada)", -14400), ("Pacific Time (US & Canada)", -25200)]
+## (id, name, full name, west, south, east, north)
+PLACES = [
+	("1c69a67ad480e1b1", "Houston", "Houston, TX", -95.788087, 29.523624, -95.014496, 30.110732),
+	("e0060cda70f5f341", "Texas", "Texas, USA", -106.645646, 25.837092, -93.508131, 36.500695),
+	("7d0ebc8ab8e8b3d4", "Galveston", "Galveston, TX", -94.975086, 29.186813, -94.725044, 29.344718),
+	("5c2b8a1d73a74a30", "Rockport", "Rockport, TX", -97.089043, 27.990353, -97.021893, 28.082451),
+	("3b77caf94bfc81fe", "Beaumont", "Beaumont, TX", -94.244467, 29.983394, -94.044046, 30.188972)
+]
+
+def get_count(rng, mean):
+	''' A small whole number with the given mean '''
+	return int(rng.expovariate(1.0 / mean) + 0.5) if mean > 0 else 0
+
+def format_date(timestamp):
+	return timestamp.strftime(TWITTER_DATE_FORMAT)
+
+class SyntheticCorpus():
+
+	def __init__(self, seed=0, tweets_per_user=TWEETS_PER_USER, hashtags_per_tweet=HASHTAGS_PER_TWEET, mentions_per_tweet=MENTIONS_PER_TWEET,
+			urls_per_tweet=URLS_PER_TWEET, retweet_fraction=RETWEET_FRACTION, quote_fraction=QUOTE_FRACTION, max_tweets=MAX_TIMELINE_TWEETS,
+			coordinates_fraction=COORDINATES_FRACTION):
+		self.seed = seed
+		self.tweets_per_user = tweets_per_user
+		self.hashtags_per_tweet = hashtags_per_tweet
+		self.mentions_per_tweet = mentions_per_tweet
+		self.urls_per_tweet = urls_per_tweet
+		self.retweet_fraction = retweet_fraction
+		self.quote_fraction = quote_fraction
+		self.max_tweets = max_tweets
+		self.coordinates_fraction = coordinates_fraction
+
+	def get_rng(self, kind, key):
+		## String seeds hash the same way on every run (unlike hash() of a str)
+		return random.Random("{seed}:{kind}:{key}".format(seed=self.seed, kind=kind, key=key))
+
+	def get_timeline_ids(self, uid):
+		''' Tweet ids for a user, newest first, at random intervals before END_DATE '''
+		rng = self.get_rng("timeline", uid)
+		count = min(get_count(rng, self.tweets_per_user), self.max_tweets)
+		timestamp = END_DATE - datetime.timedelta(seconds=rng.uniform(0, 86400))
+		ids = []
+		for i in range(count):
+			timestamp = timestamp - datetime.timedelta(seconds=rng.expovariate(1.0 / MEAN_SECONDS_BETWEEN_TWEETS))
+			## The low 22 bits (worker and sequence number) just make the ids unique
+			tweet_id = get_snowflake_id(timestamp) | rng.getrandbits(22)
+			if ids and tweet_id >= ids[-1]:
+				tweet_id = ids[-1] - 1
+			ids.append(tweet_id)
+		return ids
+
+	def get_timeline(self, uid):
+		return [self.make_tweet(uid, tweet_id) for tweet_id in self.get_timeline_ids(uid)]
+
+	def make_user(self, uid):
+		rng = self.get_rng("user", uid)
+		uid = int(uid)
+		time_zone, utc_offset = rng.choice(TIME_ZONES)
+		created_at = END_DATE - datetime.timedelta(days=rng.randint(30, 4000), seconds=rng.randint(0, 86399))
+		default_profile = rng.random() < 0.3
+		return {
+			"id": uid,
+			"id_str": str(uid),
+			"name": "User {uid} {word}".format(uid=uid, word=rng.choice(WORDS)),
+			"screen_name": "user{uid}".format(uid=uid),
+			"location": rng.choice(["Houston, TX", "Texas", "", "Gulf Coast", "Katy, TX"]),
+			"description": " ".join(rng.choice(WORDS) for i in range(rng.randint(0, 20))),
+			"url": "https://t.co/" + format(uid, "x") if rng.random() < 0.3 else None,
+			"protected": False,
+			"followers_count": get_count(rng, 800),
+			"friends_count": get_count(rng, 400),
+			"listed_count": get_count(rng, 10),
+			"created_at": format_date(created_at),
+			"favourites_count": get_count(rng, 3000),
+			"utc_offset": utc_offset,
+			"time_zone": time_zone,
+			"geo_enabled": rng.random() < 0.4,
+			"verified": rng.random() < 0.01,
+			"statuses_count": get_count(rng, 5000),
+			"lang": rng.choice(LANGS),
+			"contributors_enabled": False,
+			"is_translator": False,
+			"is_translation_enabled": False,
+			"profile_background_color": "C0DEED",
+			"profile_background_image_url": "http://abs.twimg.com/images/themes/theme1/bg.png",
+			"profile_background_tile": False,
+			"profile_image_url": "http://pbs.twimg.com/profile_images/{uid}/photo_normal.jpg".format(uid=uid),
+			"profile_banner_url": "https://pbs.twimg.com/profile_banners/{uid}/1500000000".format(uid=uid) if not default_profile else None,
+			"profile_link_color": "1DA1F2",
+			"profile_sidebar_border_color": "C0DEED",
+			"profile_sidebar_fill_color": "DDEEF6",
+			"profile_text_color": "333333",
+			"profile_use_background_image": True,
+			"default_profile": default_profile,
+			"default_profile_image": rng.random() < 0.05
+		}
+
+	def make_tweet(self, uid, tweet_id, depth=0):
+		''' The tweet with this id, tweeted by uid (nested tweets are built with depth > 0 and nest no further than MAX_NESTING) '''
+		rng = self.get_rng("tweet", tweet_id)
+		created_at = get_snowflake_timestamp(tweet_id)
+		user = self.make_user(uid)
+
+		tweet = {
+			"created_at": format_date(created_at),
+			"id": tweet_id,
+			"id_str": str(tweet_id),
+			"truncated": False,
+			"source": rng.choice(SOURCES),
+			"in_reply_to_status_id": None,
+			"in_reply_to_status_id_str": None,
+			"in_reply_to_user_id": None,
+			"in_reply_to_user_id_str": None,
+			"in_reply_to_screen_name": None,
+			"user": user,
+			"geo": None,
+			"coordinates": None,
+			"place": None,
+			"contributors": None,
+			"is_quote_status": False,
+			"retweet_count": get_count(rng, 5),
+			"favorite_count": get_count(rng, 8),
+			"favorited": False,
+			"retweeted": False,
+			"lang": rng.choice(LANGS)
+		}
+
+		if depth < MAX_NESTING and rng.random() < self.retweet_fraction:
+			## A retweet carries the original, and its text and entities are the original's
+			retweeted = self.make_tweet(rng.randint(1, POPULATION), self.get_parent_id(rng, tweet_id), depth + 1)
+			tweet["retweeted_status"] = retweeted
+			tweet["is_quote_status"] = retweeted["is_quote_status"]
+			tweet["retweet_count"] = retweeted["retweet_count"]
+			tweet["favorite_count"] = 0
+			prefix = "RT @" + retweeted["user"]["screen_name"] + ": "
+			tweet["text"] = (prefix + retweeted["text"])[:140]
+			tweet["entities"] = {
+				"hashtags": [self.shift_entity(hashtag, len(prefix)) for hashtag in retweeted["entities"]["hashtags"]],
+				"symbols": [],
+				"user_mentions": [self.make_mention(retweeted["user"], 3)] + [self.shift_entity(mention, len(prefix)) for mention in retweeted["entities"]["user_mentions"]],
+				"urls": [self.shift_entity(url, len(prefix)) for url in retweeted["entities"]["urls"]]
+			}
+			return tweet
+
+		reply_to = None
+		if rng.random() < REPLY_FRACTION:
+			reply_to = self.make_user(rng.randint(1, POPULATION))
+			tweet["in_reply_to_status_id"] = self.get_parent_id(rng, tweet_id)
+			tweet["in_reply_to_status_id_str"] = str(tweet["in_reply_to_status_id"])
+			tweet["in_reply_to_user_id"] = reply_to["id"]
+			tweet["in_reply_to_user_id_str"] = reply_to["id_str"]
+			tweet["in_reply_to_screen_name"] = reply_to["screen_name"]
+
+		tweet["text"], tweet["entities"] = self.make_text(rng, reply_to)
+
+		if depth < MAX_NESTING and rng.random() < self.quote_fraction:
+			quoted = self.make_tweet(rng.randint(1, POPULATION), self.get_parent_id(rng, tweet_id), depth + 1)
+			tweet["is_quote_status"] = True
+			tweet["quoted_status_id"] = quoted["id"]
+			tweet["quoted_status_id_str"] = quoted["id_str"]
+			tweet["quoted_status"] = quoted
+
+		place_fraction = max(PLACE_FRACTION, self.coordinates_fraction)
+		if rng.random() < place_fraction:
+			tweet["place"] = self.make_place(rng)
+			if rng.random() < self.coordinates_fraction / place_fraction:
+				west, south, east, north = tweet["place"]["bounding_box"]["coordinates"][0][0] + tweet["place"]["bounding_box"]["coordinates"][0][2]
+				longitude, latitude = round(rng.uniform(west, east), 8), round(rng.uniform(south, north), 8)
+				tweet["coordinates"] = {"type": "Point", "coordinates": [longitude, latitude]}
+				tweet["geo"] = {"type": "Point", "coordinates": [latitude, longitude]}
+
+		if tweet["entities"]["urls"]:
+			tweet["possibly_sensitive"] = False
+		return tweet
+
+	def get_parent_id(self, rng, tweet_id):
+		''' An id for a tweet from up to a week before this one '''
+		return get_snowflake_id(get_snowflake_timestamp(tweet_id) - datetime.timedelta(seconds=rng.uniform(1, 7 * 86400))) | rng.getrandbits(22)
+
+	def make_mention(self, user, start):
+		return {"screen_name": user["screen_name"], "name": user["name"], "id": user["id"], "id_str": user["id_str"],
+			"indices": [start, start + 1 + len(user["screen_name"])]}
+
+	def shift_entity(self, entity, offset):
+		entity = dict(entity)
+		entity["indices"] = [entity["indices"][0] + offset, entity["indices"][1] + offset]
+		return entity
+
+	def make_text(self, rng, reply_to=None):
+		''' Builds a tweet's text word by word, recording where each hashtag, mention and url lands '''
+		parts = []
+		entities = {"hashtags": [], "symbols": [], "user_mentions": [], "urls": []}
+		length = 0
+
+		def add(text):
+			parts.append(text)
+			return length + len(text) + 1
+
+		if reply_to is not None:
+			entities["user_mentions"].append(self.make_mention(reply_to, 0))
+			length = add("@" + reply_to["screen_name"])
+		for i in range(rng.randint(3, 14)):
+			length = add(rng.choice(WORDS))
+		for i in range(get_count(rng, self.mentions_per_tweet)):
+			mentioned = self.make_user(rng.randint(1, POPULATION))
+			entities["user_mentions"].append(self.make_mention(mentioned, length))
+			length = add("@" + mentioned["screen_name"])
+		for i in range(get_count(rng, self.hashtags_per_tweet)):
+			hashtag = rng.choice(HASHTAGS)
+			entities["hashtags"].append({"text": hashtag, "indices": [length, length + 1 + len(hashtag)]})
+			length = add("#" + hashtag)
+		for i in range(get_count(rng, self.urls_per_tweet)):
+			url = "https://t.co/" + "".join(rng.choice("abcdefghijkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789") for i in range(10))
+			domain = rng.choice(["khou.com", "houstonchronicle.com", "weather.gov", "instagram.com"])
+			entities["urls"].append({"url": url, "expanded_url": "https://www." + domain + "/" + url[-10:], "display_url": domain + "/" + url[-10:],
+				"indices": [length, length + len(url)]})
+			length = add(url)
+		return " ".join(parts), entities
+
+	def make_place(self, rng):
+		place_id, name, full_name, west, south, east, north = rng.choice(PLACES)
+		return {
+			"id": place_id,
+			"url": "https://api.twitter.com/1.1/geo/id/" + place_id + ".json",
+			"place_type": "admin" if name == "Texas" else "city",
+			"name": name,
+			"full_name": full_name,
+			"country_code": "US",
+			"country": "United States",
+			"bounding_box": {"type": "Polygon", "coordinates": [[[west, south], [east, south], [east, north], [west, north]]]},
+			"attributes": {}
+		}
+
+	def write(self, output_dir, uids, output_format=DEFAULT_FORMAT, utc_timestamp=UTC_TIMESTAMP):
+		''' Writes <uid>.<output_format> for each uid, returns the number of tweets written '''
+		if not os.path.isdir(output_dir):
+			os.makedirs(output_dir)
+		tweet_count = 0
+		for uid in uids:
+			with TimelineWriter(output_dir, uid, utc_timestamp, output_format) as writer:
+				writer.write_tweets(self.make_tweet(uid, tweet_id) for tweet_id in self.get_timeline_ids(uid))
+			tweet_count = tweet_count + writer.tweet_count
+		return tweet_count
+
+if __name__ == "__main__":
+	arg_parser = argparse.ArgumentParser()
+	arg_parser.add_argument("output_dir")
+	arg_parser.add_argument("--users", type=int, default=100)
+	arg_parser.add_argument("--first-uid", type=int, default=1000)
+	arg_parser.add_argument("--tweets", type=float, default=TWEETS_PER_USER, help="mean tweets per timeline")
+	arg_parser.add_argument("--hashtags", type=float, default=HASHTAGS_PER_TWEET, help="mean hashtags per tweet")
+	arg_parser.add_argument("--mentions", type=float, default=MENTIONS_PER_TWEET, help="mean mentions per tweet")
+	arg_parser.add_argument("--urls", type=float, default=URLS_PER_TWEET, help="mean urls per tweet")
+	arg_parser.add_argument("--retweets", type=float, default=RETWEET_FRACTION, help="fraction of tweets that are retweets")
+	arg_parser.add_argument("--quotes", type=float, default=QUOTE_FRACTION, help="fraction of tweets that quote another")
+	arg_parser.add_argument("--coordinates", type=float, default=COORDINATES_FRACTION, help="fraction of original tweets with coordinates")
+	arg_parser.add_argument("--seed", type=int, default=0)
+	arg_parser.add_argument("--format", default=DEFAULT_FORMAT, choices=TIMELINE_EXTENSIONS)
+	args = arg_parser.parse_args()
+
+	corpus = SyntheticCorpus(args.seed, args.tweets, args.hashtags, args.mentions, args.urls, args.retweets, args.quotes, coordinates_fraction=args.coordinates)
+	tweet_count = corpus.write(args.output_dir, range(args.first_uid, args.first_uid + args.users), args.format)
+	print("{tweets} tweets from {users} users written to {output_dir}".format(tweets=tweet_count, users=args.users, output_dir=args.output_dir))
@@ -0,0 +1,256 @@
+'''
+Where the loaders' rows go. A sink takes rows table by table with write_rows(table, rows), returning how many it took:
+
+	PostgresSink   COPYs the rows into the database through a cursor (merging them in under on_conflict, or the
+	               table's own policy if it has one), or INSERTs them with execute_batch
+	ParquetSink    one <table>.parquet file per table in output_dir, ROW_GROUP_ROWS rows per row group
+	ArrowSink      the same as Arrow IPC streams (<table>.arrows), ROW_GROUP_ROWS rows per record batch
+
+The columnar sinks (which need the pyarrow package) build each file's schema from the table's sql_utils Fields, with
+the DICTIONARY_FIELDS columns dictionary-encoded. Their files are written to a .tmp name and only moved into place
+by close(), so an interrupted export never leaves a truncated file behind. Rows are appended as they come: unlike
+the database there's nothing to merge a tweet seen in two timelines (or a user replaced in a later archive shard)
+into, so both copies end up in the file.
+
+Example:
+
+sink = PostgresSink(cursor, on_conflict=KEEP_LATEST)
+sink.write_rows(tweet_table, rows)
+
+with ParquetSink("parquet", [tweet_table, tweetuser_table]) as sink:    # parquet/Tweet.parquet, parquet/TweetUser.parquet
+	sink.write_rows(tweet_table, rows)
+
+print(get_arrow_schema(tweet_table))
+
+'''
+
+from json_encoding import encode_json
+import metrics
+import os
+from psycopg2 import extras as ext
+import sys
+import time
+
+try:
+	import pyarrow
+	import pyarrow.ipc
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+ROW_GROUP_ROWS = 100000 ## Rows buffered per table before they're written out as one row group / record batch
+## Low-cardinality text columns stored as dictionary indexes (timeZone is postgres_db's name for user_time_zone)
+DICTIONARY_FIELDS = ["lang", "source", "user_time_zone", "timeZone"]
+PARQUET_COMPRESSION = "zstd"
+ARROW_COMPRESSION = "zstd"
+
+def get_file_name(table):
+	return table.name.strip("\"")
+
+def get_arrow_type(datatype):
+	''' The Arrow type for a Postgres column type such as "BIGINT", "VARCHAR(45)" or "NUMERIC(16,8)" '''
+	datatype = datatype.upper().split("(")[0].strip()
+	if datatype in ("BIGINT", "BIGSERIAL"):
+		return pyarrow.int64()
+	if datatype in ("INT", "INTEGER", "SERIAL"):
+		return pyarrow.int32()
+	if datatype == "SMALLINT":
+		return pyarrow.int16()
+	if datatype == "BOOLEAN":
+		return pyarrow.bool_()
+	if datatype.startswith("TIMESTAMP"):
+		return pyarrow.timestamp("us")
+	if datatype == "DATE":
+		return pyarrow.date32()
+	## NUMERIC values arrive as floats (e.g. coordinates), so they're kept as floats rather than decimals
+	if datatype in ("NUMERIC", "DECIMAL", "DOUBLE PRECISION", "FLOAT8", "REAL", "FLOAT4"):
+		return pyarrow.float64()
+	## TEXT, VARCHAR and JSON/JSONB (as its text)
+	return pyarrow.string()
+
+def get_arrow_schema(table, dictionary_fields=DICTIONARY_FIELDS):
+	''' The Arrow schema of a sql_utils Table: one column per field, in order, under its unquoted name '''
+	assert pyarrow is not None, "The pyarrow package is needed for Arrow schemas"
+	arrow_fields = []
+	for field in table.fields:
+		name = field.name.strip("\"")
+		arrow_type = get_arrow_type(field.datatype)
+		if name in dictionary_fields and arrow_type == pyarrow.string():
+			arrow_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+		arrow_fields.append(pyarrow.field(name, arrow_type, nullable=not field.is_primary_key, metadata={"sql_type": field.datatype}))
+	return pyarrow.schema(arrow_fields)
+
+def get_arrow_array(arrow_type, values):
+	''' One column of rows as an Arrow array, coercing the loaders' values (e.g. id_str for a BIGINT) the way Postgres would '''
+	if pyarrow.types.is_dictionary(arrow_type):
+		return get_arrow_array(arrow_type.value_type, values).dictionary_encode()
+	if pyarrow.types.is_integer(arrow_type):
+		values = [None if value is None else int(value) for value in values]
+	elif pyarrow.types.is_floating(arrow_type):
+		values = [None if value is None else float(value) for value in values]
+	elif pyarrow.types.is_string(arrow_type):
+		values = [value if value is None or isinstance(value, str) else encode_json(value) for value in values]
+	return pyarrow.array(values, type=arrow_type)
+
+def get_record_batch(schema, rows):
+	columns = list(zip(*rows))
+	return pyarrow.RecordBatch.from_arrays([get_arrow_array(field.type, values) for field, values in zip(schema, columns)], schema=schema)
+
+class PostgresSink():
+
+	def __init__(self, cursor, on_conflict=None, use_copy=True):
+		self.cursor = cursor
+		self.on_conflict = on_conflict
+		self.use_copy = use_copy
+
+	def write_rows(self, table, rows):
+		on_conflict = table.on_conflict or self.on_conflict
+		if self.use_copy and on_conflict:
+			return table.merge_rows(self.cursor, rows, on_conflict)
+		if self.use_copy:
+			return table.copy_rows(self.cursor, rows)
+
+		fields_required = len(table.fields)
+		## Postgres text can't hold NUL, which COPY strips from every value (see sql_utils.get_copy_value), so do the same here
+		rows = [tuple(value.replace("\x00", "") if isinstance(value, str) else value for value in row) for row in rows]
+		for row in rows:
+			assert len(row)==fields_required, "Row has incorrect number of fields: " + str(row)
+
+		with metrics.timer("insert", table=table.name):
+			ext.execute_batch(self.cursor, table.get_insert_statement(on_conflict=on_conflict), rows)
+		return len(rows)
+
+	def close(self):
+		pass
+
+class ColumnarSink():
+	''' Buffers each table's rows and writes them row_group_rows at a time to the table's own file (see open_writer) '''
+
+	extension = None
+
+	def __init__(self, output_dir, tables, row_group_rows=ROW_GROUP_ROWS, dictionary_fields=DICTIONARY_FIELDS):
+		assert pyarrow is not None, "The pyarrow package is needed for Parquet and Arrow output"
+		if not os.path.isdir(output_dir):
+			os.makedirs(output_dir)
+		self.row_group_rows = row_group_rows
+		self.dictionary_fields = dictionary_fields
+		self.schemas = {}
+		self.buffers = {}
+		self.writers = {}
+		self.paths = {}
+		for table in tables:
+			path = os.path.join(output_dir, get_file_name(table) + self.extension)
+			self.schemas[table.name] = get_arrow_schema(table, dictionary_fields)
+			self.buffers[table.name] = []
+			self.paths[table.name] = path
+			self.writers[table.name] = self.open_writer(path + ".tmp", self.schemas[table.name])
+
+	def open_writer(self, path, schema):
+		raise NotImplementedError
+
+	def write_batch(self, writer, batch):
+		raise NotImplementedError
+
+	def write_rows(self, table, rows):
+		buffer = self.buffers[table.name]
+		row_count = 0
+		for row in rows:
+			buffer.append(row)
+			row_count = row_count + 1
+			if len(buffer) >= self.row_group_rows:
+				self.flush_table(table.name)
+		return row_count
+
+	def flush_table(self, table_name):
+		buffer = self.buffers[table_name]
+		if not buffer:
+			return
+		with metrics.timer("write", table=table_name):
+			self.write_batch(self.writers[table_name], get_record_batch(self.schemas[table_name], buffer))
+		del buffer[:]
+
+	def close(self):
+		for table_name in self.writers:
+			self.flush_table(table_name)
+		for table_name, writer in self.writers.items():
+			writer.close()
+			os.replace(self.paths[table_name] + ".tmp", self.paths[table_name])
+
+	def abort(self):
+		for table_name, writer in self.writers.items():
+			writer.close()
+			os.remove(self.paths[table_name] + ".tmp")
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.abort()
+		return False
+
+class ParquetSink(ColumnarSink):
+
+	extension = ".parquet"
+
+	def open_writer(self, path, schema):
+		## Parquet would otherwise try a dictionary on every column, including text and JSON that never fit one
+		dictionary_columns = [field.name for field in schema if pyarrow.types.is_dictionary(field.type)]
+		return pyarrow.parquet.ParquetWriter(path, schema, compression=PARQUET_COMPRESSION, use_dictionary=dictionary_columns)
+
+	def write_batch(self, writer, batch):
+		## Each flushed buffer becomes exactly one row group
+		writer.write_table(pyarrow.Table.from_batches([batch]), row_group_size=batch.num_rows)
+
+class ArrowSink(ColumnarSink):
+
+	extension = ".arrows"
+
+	def open_writer(self, path, schema):
+		## The stream format (unlike the file format) lets each batch carry its own dictionaries
+		options = pyarrow.ipc.IpcWriteOptions(compression=ARROW_COMPRESSION)
+		return pyarrow.ipc.new_stream(path, schema, options=options)
+
+	def write_batch(self, writer, batch):
+		writer.write_batch(batch)
+
+SINK_CLASSES = {"parquet": ParquetSink, "arrow": ArrowSink}
+
+def export_files(sink, paths, load_timelines):
+	''' Loads every file into a columnar sink with load_timelines(sink, path) -> {table name: rows}, one after another, then closes it '''
+	start = time.time()
+	total_rows = 0
+	try:
+		for i, path in enumerate(paths):
+			file_start = time.time()
+			with metrics.timer("load_file"):
+				rows_loaded = load_timelines(sink, path)
+			metrics.count("files_total", result="loaded")
+			metrics.count("bytes_read_total", os.path.getsize(path))
+			for table_name, rows in rows_loaded.items():
+				metrics.count("rows_total", rows, table=table_name)
+			rows = sum(rows_loaded.values())
+			total_rows = total_rows + rows
+			elapsed = time.time() - start
+			metrics.log_event("file", path=path, rows=rows_loaded, seconds=round(time.time() - file_start, 3))
+			metrics.flush()
+			print("{name}: {rows} rows ({done}/{total} files, {total_rows} rows, {rate:.0f} rows/s)".format(
+				name=os.path.basename(path),
+				rows=rows,
+				done=i + 1,
+				total=len(paths),
+				total_rows=total_rows,
+				rate=total_rows / elapsed if elapsed else 0))
+			sys.stdout.flush()
+	except:
+		sink.abort()
+		raise
+
+	with metrics.timer("commit"):
+		sink.close()
+	print("{total_rows} rows from {files} files in {elapsed:.1f}s".format(total_rows=total_rows, files=len(paths), elapsed=time.time() - start))
+	for table_name, path in sorted(sink.paths.items()):
+		print("{path}: {size_mb:.1f} MB".format(path=path, size_mb=os.path.getsize(path) / float(1 << 20)))
+	return total_rows
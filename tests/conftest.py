@@ -0,0 +1,41 @@
+import os
+import sys
+
+## The modules live at the top of the repo, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+@pytest.fixture
+def fake_twitter(tmp_path):
+	''' start(limit, window, handler) runs fake_twitter_server.py's API (or a handler subclassing its FakeTwitterHandler) on
+	an ephemeral port and returns the server, with the api_url to point clients at; pool(count) makes a TokenPool of
+	that many credential files '''
+	from fake_twitter_server import FakeTwitterHandler, RateLimits
+	from http.server import ThreadingHTTPServer
+	import threading
+	from twitter_client import Token, TokenPool
+
+	servers = []
+
+	def start(limit=900, window=900, handler=FakeTwitterHandler):
+		server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+		server.rate_limits = RateLimits(limit, window)
+		server.api_url = "http://127.0.0.1:{port}/1.1".format(port=server.server_address[1])
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		servers.append(server)
+		return server
+
+	def pool(count=1):
+		tokens = []
+		for index in range(count):
+			config_file = tmp_path / "twitter_config_{index}.txt".format(index=index)
+			config_file.write_text("key\nsecret\ntoken{index}\ntoken_secret{index}\n".format(index=index))
+			tokens.append(Token.from_config(str(config_file)))
+		return TokenPool(tokens)
+
+	start.pool = pool
+	yield start
+	for server in servers:
+		server.shutdown()
+		server.server_close()
@@ -0,0 +1,81 @@
+import fake_twitter_server
+import get_active_accounts
+import socket
+from twitter_client import USERS_LOOKUP, USERS_SHOW
+
+UIDS = [str(uid) for uid in range(1000, 1250)] ## every status, 25 times over (see fake_twitter_server.get_user_status)
+
+def get_requests(client, endpoint):
+	return sum(limiter["requests"] for limiter in client.pool.get_metrics() if limiter["name"].endswith(" " + endpoint))
+
+class FailingLookupHandler(fake_twitter_server.FakeTwitterHandler):
+	''' Answers users/lookup with a 503 for batches holding FAILING_UID '''
+
+	def do_GET(self):
+		if "users/lookup" in self.path and FAILING_UID in self.path:
+			return self.send_json(503, {"errors": [{"code": 130, "message": "Over capacity"}]}, {})
+		return fake_twitter_server.FakeTwitterHandler.do_GET(self)
+
+FAILING_UID = "1150"
+
+def make_client(fake_twitter, handler=fake_twitter_server.FakeTwitterHandler):
+	## One-second windows, so the limiters spread the requests over one second rather than fifteen minutes
+	server = fake_twitter(window=1, handler=handler)
+	return get_active_accounts.TwitterClient(fake_twitter.pool(2), api_url=server.api_url)
+
+def test_batched_statuses_match_per_user(fake_twitter):
+	per_user_client = make_client(fake_twitter)
+	batched_client = make_client(fake_twitter)
+
+	per_user = get_active_accounts.get_user_statuses(per_user_client, UIDS)
+	batched = get_active_accounts.get_user_statuses_batched(batched_client, UIDS)
+
+	assert batched == per_user
+	assert batched == dict((uid, fake_twitter_server.get_user_status(uid)) for uid in UIDS)
+	assert get_requests(per_user_client, USERS_SHOW) == len(UIDS)
+	assert get_requests(per_user_client, USERS_LOOKUP) == 0
+	## One users/lookup per 100 ids, and users/show only for the suspended and missing ones it leaves out
+	assert get_requests(batched_client, USERS_LOOKUP) == 3
+	assert get_requests(batched_client, USERS_SHOW) == len([uid for uid in UIDS if uid[-1] in "01"])
+
+def test_batch_with_no_users_found(fake_twitter):
+	## users/lookup answers a batch of only suspended and missing ids with a 404
+	client = make_client(fake_twitter)
+	uids = [uid for uid in UIDS if uid[-1] in "01"][:30]
+
+	statuses = get_active_accounts.get_user_statuses_batched(client, uids)
+
+	assert statuses == dict((uid, "suspended" if uid[-1] == "0" else "not found") for uid in uids)
+	assert get_requests(client, USERS_LOOKUP) == 1
+	assert get_requests(client, USERS_SHOW) == len(uids)
+
+def test_missing_ids_left_unresolved(fake_twitter, monkeypatch):
+	monkeypatch.setattr(get_active_accounts, "RESOLVE_MISSING", False)
+	client = make_client(fake_twitter)
+
+	statuses = get_active_accounts.get_user_statuses_batched(client, UIDS[:100])
+
+	assert statuses == dict((uid, "suspended or not found" if uid[-1] in "01" else fake_twitter_server.get_user_status(uid)) for uid in UIDS[:100])
+	assert get_requests(client, USERS_SHOW) == 0
+
+def test_failed_lookup_batch_is_checked_user_by_user(fake_twitter):
+	client = make_client(fake_twitter, FailingLookupHandler)
+	chunks = []
+
+	statuses = get_active_accounts.get_user_statuses_batched(client, UIDS, chunks.append)
+
+	assert statuses == dict((uid, fake_twitter_server.get_user_status(uid)) for uid in UIDS)
+	## The second batch (1100-1199) went to users/show, all 100 of them
+	assert get_requests(client, USERS_LOOKUP) == 3
+	assert get_requests(client, USERS_SHOW) == 100 + len([uid for uid in UIDS[:100] + UIDS[200:] if uid[-1] in "01"])
+	assert [sorted(chunk) for chunk in chunks] == [UIDS[:100], UIDS[100:200], UIDS[200:]]
+
+def test_unreachable_api_leaves_statuses_unknown(fake_twitter):
+	## Nothing listens on a port that was free a moment ago
+	with socket.socket() as s:
+		s.bind(("127.0.0.1", 0))
+		port = s.getsockname()[1]
+	client = get_active_accounts.TwitterClient(fake_twitter.pool(1), api_url="http://127.0.0.1:{port}/1.1".format(port=port))
+
+	assert get_active_accounts.get_user_statuses_batched(client, UIDS[:3]) == dict((uid, None) for uid in UIDS[:3])
+	assert get_active_accounts.get_user_statuses(client, UIDS[:3]) == dict((uid, None) for uid in UIDS[:3])
@@ -0,0 +1,23 @@
+import pytest
+from get_historic_tweets_from_date import count_tweets_since
+
+def make_page(ids):
+	return [{"id": tweet_id} for tweet_id in ids]
+
+@pytest.mark.parametrize("ids, min_id, expected", [
+	([], 10, 0),
+	([50, 40, 30, 20, 10], 1, 5),
+	([50, 40, 30, 20, 10], 10, 5), ## min_id itself counts
+	([50, 40, 30, 20, 10], 11, 4),
+	([50, 40, 30, 20, 10], 30, 3),
+	([50, 40, 30, 20, 10], 50, 1),
+	([50, 40, 30, 20, 10], 51, 0),
+	([7], 7, 1),
+])
+def test_count_tweets_since(ids, min_id, expected):
+	assert count_tweets_since(make_page(ids), min_id) == expected
+
+def test_count_tweets_since_matches_a_linear_scan():
+	page = make_page(range(400, 200, -1))
+	for min_id in range(190, 410, 7):
+		assert count_tweets_since(page, min_id) == len([tweet for tweet in page if tweet["id"] >= min_id])
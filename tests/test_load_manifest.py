@@ -0,0 +1,36 @@
+import os
+from load_manifest import LoadManifest
+
+class RecordedCursor():
+	''' Answers get_loaded's SELECT with the given (file name, size, mtime, content hash) rows '''
+
+	def __init__(self, rows):
+		self.rows = rows
+
+	def execute(self, statement, params=None):
+		assert statement.startswith("SELECT file_name")
+
+	def fetchall(self):
+		return self.rows
+
+def write_file(path, contents):
+	with open(path, "w") as f:
+		f.write(contents)
+	return str(path)
+
+def test_plan_loads_new_and_changed_files_only(tmp_path):
+	new = write_file(tmp_path / "1.json", "new")
+	unchanged = write_file(tmp_path / "2.json", "unchanged")
+	resized = write_file(tmp_path / "3.json", "resized")
+	touched = write_file(tmp_path / "4.json", "touched")
+	stats = dict((os.path.basename(path), os.stat(path)) for path in [unchanged, resized, touched])
+	cursor = RecordedCursor([
+		("2.json", stats["2.json"].st_size, stats["2.json"].st_mtime, "hash2"),
+		("3.json", stats["3.json"].st_size + 1, stats["3.json"].st_mtime, "hash3"),
+		("4.json", stats["4.json"].st_size, stats["4.json"].st_mtime - 60, "hash4"),
+		("5.json", 10, 0.0, "hash5"), ## loaded once, since deleted
+	])
+
+	tasks = LoadManifest("upload_flat_tweet_table").plan(cursor, [new, unchanged, resized, touched])
+	## A changed file carries its old hash, so the loader can skip it if only its mtime moved
+	assert tasks == [(new, None), (resized, "hash3"), (touched, "hash4")]
@@ -0,0 +1,149 @@
+import copy
+import parallel_loader
+import postgres_db
+import psycopg2
+import pytest
+from timeline_archive import ArchiveWriter, list_timeline_sources
+
+UTC_TIMESTAMP = "2017-09-01 12:00:00.123456"
+
+class RecordingSink():
+	''' Keeps every row written, per table name '''
+
+	def __init__(self):
+		self.rows = {}
+
+	def write_rows(self, table, rows):
+		self.rows.setdefault(table.name, []).extend(rows)
+		return len(rows)
+
+class FailingCommitDb():
+	''' A connection whose commit fails, as the deferred foreign key checks can '''
+
+	def __init__(self):
+		self.rolled_back = False
+
+	def cursor(self):
+		return FakeCursor()
+
+	def commit(self):
+		raise psycopg2.IntegrityError("insert or update on table violates foreign key constraint")
+
+	def rollback(self):
+		self.rolled_back = True
+
+class FakeCursor():
+
+	def close(self):
+		pass
+
+def make_user(uid):
+	return {"id": uid, "id_str": str(uid), "screen_name": "u" + str(uid), "name": "User " + str(uid), "time_zone": None,
+		"verified": False, "geo_enabled": True, "followers_count": 10, "friends_count": 5, "protected": False, "lang": "en",
+		"utc_offset": None, "statuses_count": 100, "description": "", "favourites_count": 1, "url": None,
+		"created_at": "Mon Jan 02 10:00:00 +0000 2012", "location": "Houston", "listed_count": 0}
+
+def make_tweet(id, uid, hashtag, created_at="Fri Aug 25 16:00:00 +0000 2017"):
+	return {"id": id, "id_str": str(id), "text": "#" + hashtag, "truncated": False, "is_quote_status": False,
+		"in_reply_to_status_id": None, "favorite_count": 1, "source": "web", "coordinates": None, "in_reply_to_screen_name": None,
+		"retweet_count": 0, "in_reply_to_user_id": None, "lang": "en", "created_at": created_at, "user": make_user(uid),
+		"entities": {"hashtags": [{"text": hashtag}], "user_mentions": [], "urls": []}, "place": None}
+
+def write_timelines(archive_dir, timelines):
+	''' An archive shard holding the (uid, tweets) timelines, in order '''
+	with ArchiveWriter(str(archive_dir)) as archive:
+		for uid, tweets in timelines:
+			archive.add_timeline(str(uid), UTC_TIMESTAMP, tweets)
+	return list_timeline_sources(str(archive_dir))[0]
+
+@pytest.fixture
+def parent_tweets(monkeypatch):
+	monkeypatch.setattr(postgres_db, "INCLUDE_PARENT_TWEETS", True)
+	monkeypatch.setattr(postgres_db, "seen_tweet_ids", postgres_db.RecentIds(postgres_db.MAX_SEEN_TWEET_IDS))
+	monkeypatch.setattr(postgres_db, "seen_place_ids", postgres_db.RecentIds(postgres_db.MAX_SEEN_PLACE_IDS))
+
+def get_tweet_ids(sink, table):
+	return sorted(row[0] for row in sink.rows.get(table.name, []))
+
+def test_self_quote_is_loaded_once(tmp_path, parent_tweets):
+	## The newest tweet quotes one further down the same timeline, so the quoted tweet is loaded as a parent first
+	quoted = make_tweet(100, 1, "quoted", "Fri Aug 25 15:00:00 +0000 2017")
+	quote = make_tweet(101, 1, "quote")
+	quote["is_quote_status"] = True
+	quote["quoted_status"] = copy.deepcopy(quoted)
+	path = write_timelines(tmp_path / "archive", [(1, [quote, quoted])])
+
+	sink = RecordingSink()
+	postgres_db.load_timelines(sink, path)
+
+	assert get_tweet_ids(sink, postgres_db.tweet_table) == ["100", "101"]
+	assert get_tweet_ids(sink, postgres_db.tweethashtag_table) == ["100", "101"]
+
+def test_parent_in_a_later_timeline_is_loaded_once(tmp_path, parent_tweets):
+	## User 2 retweets user 1's tweet, and user 1's own timeline comes later in the same file
+	original = make_tweet(200, 1, "original")
+	retweet = make_tweet(201, 2, "original")
+	retweet["retweeted_status"] = copy.deepcopy(original)
+	path = write_timelines(tmp_path / "archive", [(2, [retweet]), (1, [original])])
+
+	sink = RecordingSink()
+	postgres_db.load_timelines(sink, path)
+
+	assert get_tweet_ids(sink, postgres_db.tweet_table) == ["200", "201"]
+	assert get_tweet_ids(sink, postgres_db.tweethashtag_table) == ["200", "201"]
+
+def test_failed_commit_forgets_the_files_tweets(tmp_path, parent_tweets, monkeypatch):
+	original = make_tweet(300, 1, "original")
+	retweet = make_tweet(301, 2, "original")
+	retweet["retweeted_status"] = copy.deepcopy(original)
+	retweet["place"] = {"id": "abc", "name": "Houston", "full_name": "Houston, TX", "place_type": "city", "country": "United States",
+		"country_code": "US", "url": None, "bounding_box": None}
+	path = write_timelines(tmp_path / "archive", [(2, [retweet])])
+
+	sinks = []
+	def get_sink(cursor, on_conflict=None, use_copy=True):
+		sinks.append(RecordingSink())
+		return sinks[-1]
+	monkeypatch.setattr(postgres_db, "PostgresSink", get_sink)
+	db = FailingCommitDb()
+	monkeypatch.setattr(parallel_loader, "worker_db", db)
+	monkeypatch.setattr(parallel_loader, "worker_load_file", postgres_db.load_file)
+	monkeypatch.setattr(parallel_loader, "worker_rollback_file", postgres_db.forget_file)
+
+	path, rows_loaded, seconds, commit_seconds, error, worker_metrics = parallel_loader.load_one((path, None))
+
+	assert db.rolled_back and "foreign key" in error
+	assert "300" not in postgres_db.seen_tweet_ids and "301" not in postgres_db.seen_tweet_ids
+	assert "abc" not in postgres_db.seen_place_ids
+	## So the next try loads them all again
+	postgres_db.load_file(None, path)
+	assert get_tweet_ids(sinks[-1], postgres_db.tweet_table) == ["300", "301"]
+	assert len(sinks[-1].rows[postgres_db.place_table.name]) == 1
+
+def test_tweets_carried_over_by_a_refresh_keep_their_collection_time(tmp_path):
+	## A refreshed file's older tweets carry the utc_timestamp they were first collected at
+	new = make_tweet(401, 1, "new")
+	carried = make_tweet(400, 1, "carried", "Fri Aug 25 15:00:00 +0000 2017")
+	carried["utc_timestamp"] = "2017-08-26 08:00:00"
+	path = write_timelines(tmp_path / "archive", [(1, [new, carried])])
+
+	sink = RecordingSink()
+	postgres_db.load_timelines(sink, path)
+
+	collected = dict((row[0], row[-1]) for row in sink.rows[postgres_db.tweet_table.name])
+	assert str(collected["401"]) == UTC_TIMESTAMP
+	assert str(collected["400"]) == "2017-08-26 08:00:00"
+
+def test_user_version_is_valid_from_its_earliest_sighting(tmp_path):
+	## A refreshed file: the new tweet first, then a carried-over one collected earlier, with the same profile
+	new = make_tweet(501, 1, "new")
+	carried = make_tweet(500, 1, "carried", "Fri Aug 25 15:00:00 +0000 2017")
+	carried["utc_timestamp"] = "2017-08-26 08:00:00"
+	path = write_timelines(tmp_path / "archive", [(1, [new, carried])])
+
+	sink = RecordingSink()
+	postgres_db.load_timelines(sink, path)
+
+	user_rows = sink.rows[postgres_db.user_table.name]
+	assert len(user_rows) == 1
+	assert str(user_rows[0][2]) == "2017-08-26 08:00:00"
@@ -0,0 +1,17 @@
+from rate_limiter import RateLimiter
+
+def test_update_takes_the_window_from_the_headers():
+	limiter = RateLimiter(limit=900, window_seconds=900)
+	limiter.update({"x-rate-limit-limit": "1500", "x-rate-limit-remaining": "12", "x-rate-limit-reset": "1504000000"})
+	assert (limiter.limit, limiter.remaining, limiter.reset) == (1500, 12, 1504000000)
+
+def test_update_keeps_the_limit_when_only_remaining_and_reset_are_given():
+	limiter = RateLimiter(limit=900, window_seconds=900)
+	limiter.update({"x-rate-limit-remaining": "0", "x-rate-limit-reset": "1504000900"})
+	assert (limiter.limit, limiter.remaining, limiter.reset) == (900, 0, 1504000900)
+
+def test_update_ignores_responses_without_rate_limit_headers():
+	limiter = RateLimiter(limit=900, window_seconds=900)
+	limiter.update({"x-rate-limit-limit": "1500"})
+	limiter.update({})
+	assert (limiter.limit, limiter.remaining, limiter.reset) == (900, 900, None)
@@ -0,0 +1,38 @@
+import csv
+from split_csv import get_hash_file_num, get_output_files, split_csv
+
+def write_csv(path, rows):
+	with open(path, "w", newline="") as f:
+		csv.writer(f).writerows(rows)
+
+def read_csv(path):
+	with open(path, newline="") as f:
+		return list(csv.reader(f))
+
+def test_hash_file_num_is_the_same_in_every_process():
+	## md5 of the uid, so these never change with Python's hash seed (or the version)
+	assert [get_hash_file_num("12345", k) for k in (2, 3, 10)] == [1, 1, 5]
+	assert [get_hash_file_num("905034561", k) for k in (2, 3, 10)] == [1, 2, 5]
+	assert get_hash_file_num(" 1150\n", 10) == get_hash_file_num("1150", 10) == 8
+
+def test_hash_mode_puts_a_uid_in_the_same_file_whatever_else_the_list_holds(tmp_path):
+	first, second = str(tmp_path / "first.csv"), str(tmp_path / "second.csv")
+	write_csv(first, [[str(uid), "a"] for uid in range(100)])
+	write_csv(second, [[str(uid), "b"] for uid in range(50, 300, 3)] + [["", "blank uid"]])
+	split_csv(first, 4, "hash")
+	split_csv(second, 4, "hash")
+
+	files = {}
+	for path in [first, second]:
+		for file_num, output in enumerate(get_output_files(path, 4)):
+			for row in read_csv(output):
+				assert files.setdefault(row[0], file_num) == file_num
+				assert file_num == get_hash_file_num(row[0], 4)
+
+def test_counts_match_the_rows_written(tmp_path):
+	path = str(tmp_path / "uids.csv")
+	write_csv(path, [[str(uid)] for uid in range(10)])
+	for mode, expected in [("contiguous", [4, 4, 2]), ("round-robin", [4, 3, 3])]:
+		assert split_csv(path, 3, mode) == expected
+		assert [len(read_csv(output)) for output in get_output_files(path, 3)] == expected
+	assert sum(split_csv(path, 3, "hash")) == 10
@@ -0,0 +1,28 @@
+import csv
+import io
+from sql_utils import get_copy_line, get_copy_value
+
+def test_copy_value_quotes_everything_but_null():
+	assert get_copy_value(None) == "\\N"
+	assert get_copy_value("") == '""'
+	assert get_copy_value("\\N") == '"\\N"' ## the text, not a NULL
+	assert get_copy_value(12) == '"12"'
+	assert get_copy_value(True) == "t"
+	assert get_copy_value(False) == "f"
+
+def test_copy_value_escapes_quotes_and_drops_nul():
+	assert get_copy_value('say "hi"') == '"say ""hi"""'
+	assert get_copy_value("a\x00b") == '"ab"'
+	assert get_copy_value("line one\nline two, \\ and more") == '"line one\nline two, \\ and more"'
+
+def test_copy_value_strips_escaped_nul_from_json_only():
+	assert get_copy_value({"text": "a\u0000b"}, is_json=True) == get_copy_value({"text": "ab"}, is_json=True)
+	## An escaped backslash followed by "u0000" is text, not a NUL
+	assert get_copy_value('{"text": "\\\\u0000"}', is_json=True) == '"{""text"": ""\\\\u0000""}"'
+	assert get_copy_value("\\u0000") == '"\\u0000"'
+
+def test_copy_line_reads_back_as_csv():
+	row = ['say "hi"', None, "", "a,b\nc", 3, {"k": "v"}]
+	line = get_copy_line(row, [False, False, False, False, False, True])
+	assert line.endswith("\n")
+	assert next(csv.reader(io.StringIO(line))) == ['say "hi"', "\\N", "", "a,b\nc", "3", '{"k":"v"}']
@@ -0,0 +1,51 @@
+import pytest
+import timeline_archive
+from timeline_archive import ArchiveWriter, TimelineArchive
+
+COMPRESSIONS = ["gz"] + (["zst"] if timeline_archive.zstandard is not None else [])
+
+def make_timeline(uid, count):
+	## Text that doesn't compress to nothing, so members span many read chunks
+	return [{"id": tweet_id, "id_str": str(tweet_id), "text": "tweet {uid}/{id} ".format(uid=uid, id=tweet_id) * 20} for tweet_id in range(count, 0, -1)]
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_timelines_round_trip(tmp_path, compression):
+	timelines = dict((str(uid), make_timeline(uid, count)) for uid, count in [(1, 3), (2, 0), (3, 2000)])
+	with ArchiveWriter(str(tmp_path), compression) as archive:
+		for uid, tweets in timelines.items():
+			archive.add_timeline(uid, "2017-09-01 12:00:00", tweets)
+
+	archive = TimelineArchive(str(tmp_path))
+	assert dict((timeline.user_id, list(timeline.tweets())) for timeline in archive.timelines()) == timelines
+	## Random access, reading one timeline while another is half read from the same shard file
+	first, second = archive.get("3").tweets(), archive.get("1").tweets()
+	assert next(first) == timelines["3"][0]
+	assert list(second) == timelines["1"]
+	assert list(first) == timelines["3"][1:]
+	assert archive.get("4") is None
+	archive.close()
+
+def test_truncated_member_is_an_error(tmp_path):
+	with ArchiveWriter(str(tmp_path), "gz") as archive:
+		archive.add_timeline("1", "2017-09-01 12:00:00", make_timeline(1, 100))
+	archive = TimelineArchive(str(tmp_path))
+	shard_name, offset, length, tweet_count, utc_timestamp = archive.entries["1"]
+	archive.entries["1"] = (shard_name, offset, length // 2, tweet_count, utc_timestamp)
+	with pytest.raises(EOFError):
+		list(archive.get("1").tweets())
+	archive.close()
+
+def test_index_is_parsed_once_per_directory(tmp_path, monkeypatch):
+	with ArchiveWriter(str(tmp_path), "gz", shard_bytes=1) as archive:
+		for uid in ["1", "2", "3"]:
+			archive.add_timeline(uid, "2017-09-01 12:00:00", make_timeline(uid, 2))
+	calls = []
+	read_index = timeline_archive.read_index
+	monkeypatch.setattr(timeline_archive, "read_index", lambda *args: calls.append(args) or read_index(*args))
+
+	paths = timeline_archive.list_timeline_sources(str(tmp_path))
+	assert len(paths) == 3
+	for path in paths:
+		timeline_archive.get_replaced_uids(path)
+		assert [timeline.user_id for timeline in timeline_archive.read_timelines(path)] == timeline_archive.get_timeline_uids(path)
+	assert len(calls) == 1
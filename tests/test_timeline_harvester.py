@@ -0,0 +1,89 @@
+import fake_twitter_server
+import os
+import requests
+import socket
+import time
+from timeline_reader import TimelineFile
+import timeline_harvester
+from twitter_client import PAGE_SIZE, TwitterClient, TwitterError, USER_TIMELINE
+
+## Active users of the fake server (see get_user_status) with more than a page or two of tweets
+ACTIVE_UIDS = [uid for uid in (str(uid) for uid in range(1003, 1100)) if fake_twitter_server.get_user_status(uid) == "active"
+	and len(fake_twitter_server.get_timeline_ids(uid)) > 3 * PAGE_SIZE]
+
+def read_tweet_ids(output_dir, uid):
+	return [tweet["id"] for tweet in TimelineFile(os.path.join(str(output_dir), uid + ".json")).tweets()]
+
+def get_limiter_metrics(client):
+	return dict((metrics["name"], metrics) for metrics in client.pool.get_metrics())
+
+def test_harvest_moves_on_to_the_next_token(tmp_path, fake_twitter, monkeypatch):
+	## Two requests per token per (long) window, one page per user: six users spend three tokens without ever waiting
+	monkeypatch.setattr(timeline_harvester, "CAP", PAGE_SIZE)
+	server = fake_twitter(limit=2)
+	client = TwitterClient(fake_twitter.pool(3), api_url=server.api_url)
+	uids = ACTIVE_UIDS[:6]
+
+	start = time.time()
+	timeline_harvester.harvest(client, uids, str(tmp_path), 1)
+
+	assert time.time() - start < 10
+	for uid in uids:
+		assert read_tweet_ids(tmp_path, uid) == fake_twitter_server.get_timeline_ids(uid)[:PAGE_SIZE]
+	limiters = get_limiter_metrics(client).values()
+	assert sorted(limiter["requests"] for limiter in limiters) == [2, 2, 2]
+	assert all(limiter["rate_limited"] == 0 and limiter["waits"] == 0 for limiter in limiters)
+
+def test_harvest_waits_out_a_429(tmp_path, fake_twitter, monkeypatch):
+	## Another process has already spent the token's current window (which has a second or two left), so the first
+	## request gets a 429
+	monkeypatch.setattr(timeline_harvester, "CAP", PAGE_SIZE)
+	server = fake_twitter(limit=1, window=1)
+	client = TwitterClient(fake_twitter.pool(1), api_url=server.api_url)
+	server.rate_limits.windows[("token0", USER_TIMELINE)] = [0, int(time.time()) + 2]
+	uids = ACTIVE_UIDS[:2]
+
+	timeline_harvester.harvest(client, uids, str(tmp_path), 1)
+
+	for uid in uids:
+		assert read_tweet_ids(tmp_path, uid) == fake_twitter_server.get_timeline_ids(uid)[:PAGE_SIZE]
+	limiter = get_limiter_metrics(client)[client.pool.tokens[0].name + " " + USER_TIMELINE]
+	assert limiter["rate_limited"] == 1
+	assert limiter["waits"] >= 2 ## once after the 429, once for the window the first user spent
+	assert limiter["requests"] == 3
+
+def test_harvest_user_stops_at_the_cap(tmp_path, fake_twitter, monkeypatch):
+	monkeypatch.setattr(timeline_harvester, "CAP", 2 * PAGE_SIZE + 50)
+	server = fake_twitter()
+	client = TwitterClient(fake_twitter.pool(1), api_url=server.api_url)
+	uid = ACTIVE_UIDS[0]
+
+	assert timeline_harvester.harvest_user(client, uid, str(tmp_path)) == (uid, 2 * PAGE_SIZE + 50, None)
+	assert read_tweet_ids(tmp_path, uid) == fake_twitter_server.get_timeline_ids(uid)[:2 * PAGE_SIZE + 50]
+	assert get_limiter_metrics(client)[client.pool.tokens[0].name + " " + USER_TIMELINE]["requests"] == 3
+
+def test_harvest_user_records_api_errors(tmp_path, fake_twitter):
+	server = fake_twitter()
+	client = TwitterClient(fake_twitter.pool(1), api_url=server.api_url)
+	output_dir = tmp_path / "timelines"
+	output_dir.mkdir()
+
+	uid, tweet_count, error = timeline_harvester.harvest_user(client, "1002", str(output_dir)) ## protected
+	assert tweet_count is None and isinstance(error, TwitterError) and error.status_code == 401
+	assert os.listdir(str(output_dir)) == []
+
+def test_harvest_survives_connection_errors(tmp_path, fake_twitter):
+	## Nothing listens on a port that was free a moment ago
+	with socket.socket() as s:
+		s.bind(("127.0.0.1", 0))
+		port = s.getsockname()[1]
+	client = TwitterClient(fake_twitter.pool(1), api_url="http://127.0.0.1:{port}/1.1".format(port=port))
+	output_dir = tmp_path / "timelines"
+	output_dir.mkdir()
+
+	uid, tweet_count, error = timeline_harvester.harvest_user(client, ACTIVE_UIDS[0], str(output_dir))
+	assert tweet_count is None and isinstance(error, requests.ConnectionError)
+	assert os.listdir(str(output_dir)) == []
+	## ...and the rest of the users are still tried
+	timeline_harvester.harvest(client, ACTIVE_UIDS[:2], str(output_dir), 2)
+	assert os.listdir(str(output_dir)) == []
@@ -0,0 +1,28 @@
+import datetime
+from user_dimension import get_profile_hash, UserVersions
+
+def make_user(name="User 1", followers_count=10):
+	return {"id_str": "1", "screen_name": "u1", "name": name, "followers_count": followers_count, "created_at": "Mon Jan 02 10:00:00 +0000 2012"}
+
+def test_counts_are_not_part_of_a_version():
+	assert get_profile_hash(make_user(followers_count=10)) == get_profile_hash(make_user(followers_count=20))
+	assert get_profile_hash(make_user(name="User 1")) != get_profile_hash(make_user(name="Renamed"))
+
+def test_earliest_sighting_wins_in_a_batch():
+	user_versions = UserVersions()
+	user_versions.add(make_user(followers_count=20), datetime.datetime(2017, 9, 1))
+	user_versions.add(make_user(followers_count=10), datetime.datetime(2017, 8, 26))
+	user_versions.add(make_user(followers_count=30), datetime.datetime(2017, 9, 5))
+
+	assert len(user_versions.rows) == 1
+	assert user_versions.rows[0][2] == datetime.datetime(2017, 8, 26)
+	assert user_versions.rows[0][15] == 10
+
+def test_earlier_sighting_after_a_flush_is_written_again():
+	user_versions = UserVersions()
+	user_versions.add(make_user(), datetime.datetime(2017, 9, 1))
+	del user_versions.rows[:]
+	user_versions.add(make_user(name="Renamed"), datetime.datetime(2017, 9, 2))
+	user_versions.add(make_user(), datetime.datetime(2017, 8, 26))
+
+	assert [(row[2], row[4]) for row in user_versions.rows] == [(datetime.datetime(2017, 9, 2), "Renamed"), (datetime.datetime(2017, 8, 26), "User 1")]
@@ -0,0 +1,407 @@
+'''
+Keeps many users' timelines in a few large compressed shard files instead of one <uid>.json per user, which
+gets slow to list and open once a directory holds hundreds of thousands of them (and is 5-10x bigger than it
+needs to be).
+
+An archive is a directory of shard-NNNNN.ndjson.gz (or .zst) files plus index.tsv. Each timeline is one
+independently compressed gzip member / zstd frame holding the same lines as a .ndjson timeline file (a
+{"user_id", "utc_timestamp"} header, then one tweet per line), so a shard is also a valid multi-member file
+that zcat reads end to end. index.tsv has a uid, shard, offset, length, tweet count, utc_timestamp line per
+timeline; it's appended only after the member is written, so a crash never indexes a torn member, and a uid
+written again (e.g. after a refresh) points at its latest copy.
+
+Usage: python timeline_archive.py json_files_dir archive_dir [--compression gz|zst] [--shard-mb N]
+	(converts a directory of timeline files into an archive; run again, it adds new files and re-archives ones
+	whose size or mtime changed since, recorded in the archive's sources.tsv)
+
+Example:
+
+with ArchiveWriter("archive") as archive:
+	with archive.timeline_writer(uid, utc_timestamp) as writer:   # same interface as TimelineWriter
+		writer.write_tweets(page)
+
+archive = TimelineArchive("archive")
+timeline = archive.get("12345")              # random access, same interface as TimelineFile
+for timeline in archive.timelines():         # sequential scan, shard by shard
+	print(timeline.user_id, timeline.utc_timestamp)
+
+## The uploaders take an archive directory in place of a json_files_dir: each shard is one load task
+for path in list_timeline_sources("archive"):
+	for timeline in read_timelines(path):
+		...
+
+'''
+
+import argparse
+import functools
+from json_encoding import encode_json
+import io
+import os
+import threading
+from timeline_reader import list_timeline_files, READ_CHUNK_SIZE, TimelineFile, walk_ndjson
+import time
+import zlib
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+INDEX_FILE_NAME = "index.tsv"
+SOURCES_FILE_NAME = "sources.tsv" ## The converter's uid, size, mtime line for each timeline file it archived
+SHARD_PREFIX = "shard-"
+SHARD_BYTES = 256 << 20 ## Start a new shard once the current one is this big
+DEFAULT_COMPRESSION = "zst" if zstandard is not None else "gz"
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 9
+GZIP_WBITS = 31 ## zlib window bits for a gzip (rather than raw zlib) container
+
+def get_compressor(compression):
+	if compression == "zst":
+		assert zstandard is not None, "The zstandard package is needed for zst archives"
+		return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+	assert compression == "gz", "Unknown compression: " + compression
+	return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+
+class ByteRange(io.RawIOBase):
+	''' length bytes of a file from offset, read on demand. It seeks before every read, so the file can be shared '''
+
+	def __init__(self, f, offset, length):
+		self.f = f
+		self.position = offset
+		self.end = offset + length
+
+	def readable(self):
+		return True
+
+	def readinto(self, buffer):
+		size = min(len(buffer), self.end - self.position)
+		if size <= 0:
+			return 0
+		self.f.seek(self.position)
+		data = self.f.read(size)
+		buffer[:len(data)] = data
+		self.position = self.position + len(data)
+		return len(data)
+
+class GzipMemberReader(io.RawIOBase):
+	''' Decompresses one gzip member from a raw stream as it's read, at most one read's worth at a time '''
+
+	def __init__(self, raw):
+		self.raw = raw
+		self.decompressor = zlib.decompressobj(GZIP_WBITS)
+
+	def readable(self):
+		return True
+
+	def readinto(self, buffer):
+		while not self.decompressor.eof:
+			data = self.decompressor.unconsumed_tail or self.raw.read(READ_CHUNK_SIZE)
+			if not data:
+				raise EOFError("Compressed timeline ended before the end of its gzip member")
+			output = self.decompressor.decompress(data, len(buffer))
+			if output:
+				buffer[:len(output)] = output
+				return len(output)
+		return 0
+
+def open_member(compression, f, offset, length):
+	''' The text of one archived timeline, decompressed as it's read, so memory doesn't grow with the timeline '''
+	member = ByteRange(f, offset, length)
+	if compression == "zst":
+		assert zstandard is not None, "The zstandard package is needed for zst archives"
+		## Streamed frames don't record their size up front, so they're read as a stream rather than decompressed in one go
+		return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(member), encoding="utf-8")
+	return io.TextIOWrapper(io.BufferedReader(GzipMemberReader(member), READ_CHUNK_SIZE), encoding="utf-8")
+
+def get_shard_compression(shard_name):
+	return shard_name.rsplit(".", 1)[-1]
+
+
+class ArchiveTimelineWriter():
+	''' Compresses one timeline into memory as its pages come in, then appends it to the archive in one go on close '''
+
+	def __init__(self, archive, uid, utc_timestamp):
+		self.archive = archive
+		self.uid = str(uid)
+		self.utc_timestamp = utc_timestamp
+		self.tweet_count = 0
+		self.compressor = get_compressor(archive.compression)
+		self.data = io.BytesIO()
+		self.write_line(encode_json({"user_id": uid, "utc_timestamp": utc_timestamp}))
+
+	def write_line(self, line):
+		self.data.write(self.compressor.compress((line + "\n").encode("utf-8")))
+
+	def write_tweets(self, tweets):
+		for tweet in tweets:
+			self.write_line(encode_json(tweet))
+			self.tweet_count = self.tweet_count + 1
+
+	def close(self):
+		self.data.write(self.compressor.flush())
+		self.archive.append(self.uid, self.data.getvalue(), self.tweet_count, self.utc_timestamp)
+
+	def abort(self):
+		self.data = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.abort()
+
+class ArchiveWriter():
+	''' Appends timelines to an archive; safe to share between threads, but only one process should write an archive at a time '''
+
+	def __init__(self, archive_dir, compression=DEFAULT_COMPRESSION, shard_bytes=SHARD_BYTES):
+		if not os.path.isdir(archive_dir):
+			os.makedirs(archive_dir)
+		self.archive_dir = archive_dir
+		self.compression = compression
+		self.shard_bytes = shard_bytes
+		self.lock = threading.Lock()
+
+		## Always start a fresh shard rather than appending to one an earlier run may have left torn
+		shard_numbers = [int(f[len(SHARD_PREFIX):].split(".")[0]) for f in os.listdir(archive_dir) if f.startswith(SHARD_PREFIX)]
+		self.shard_number = max(shard_numbers) if shard_numbers else -1
+		self.shard = None
+		self.index = open(os.path.join(archive_dir, INDEX_FILE_NAME), "a+")
+		drop_torn_line(self.index)
+
+	def next_shard(self):
+		if self.shard is not None:
+			self.shard.close()
+		self.shard_number = self.shard_number + 1
+		self.shard_name = "{prefix}{number:05d}.ndjson.{compression}".format(prefix=SHARD_PREFIX, number=self.shard_number, compression=self.compression)
+		self.shard = open(os.path.join(self.archive_dir, self.shard_name), "ab")
+
+	def timeline_writer(self, uid, utc_timestamp):
+		return ArchiveTimelineWriter(self, uid, utc_timestamp)
+
+	def add_timeline(self, uid, utc_timestamp, tweets):
+		with self.timeline_writer(uid, utc_timestamp) as writer:
+			writer.write_tweets(tweets)
+		return writer.tweet_count
+
+	def append(self, uid, data, tweet_count, utc_timestamp):
+		with self.lock:
+			if self.shard is None or self.shard.tell() >= self.shard_bytes:
+				self.next_shard()
+			offset = self.shard.tell()
+			self.shard.write(data)
+			self.shard.flush()
+			## Only indexed once its bytes are in the shard
+			self.index.write("\t".join([uid, self.shard_name, str(offset), str(len(data)), str(tweet_count), str(utc_timestamp)]) + "\n")
+			self.index.flush()
+
+	def get_uids(self):
+		return set(read_index(self.archive_dir))
+
+	def close(self):
+		if self.shard is not None:
+			self.shard.close()
+		self.index.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+def drop_torn_line(index):
+	''' Truncates an index file (open for appending) back to its last complete line, so new entries start on a line of their own '''
+	index.seek(0)
+	contents = index.read()
+	if contents and not contents.endswith("\n"):
+		index.truncate(contents.rfind("\n") + 1)
+	index.seek(0, os.SEEK_END)
+
+def read_index(archive_dir, replaced=None):
+	''' {uid: (shard name, offset, length, tweet count, utc_timestamp)}, with the latest entry for a uid winning.
+	uids whose latest entry replaced one in another shard are added to replaced, if given '''
+	entries = {}
+	index_path = os.path.join(archive_dir, INDEX_FILE_NAME)
+	if not os.path.exists(index_path):
+		return entries
+	with open(index_path) as index:
+		for line in index:
+			if not line.endswith("\n"):
+				break ## cut off by a crash: its member may be incomplete too
+			uid, shard_name, offset, length, tweet_count, utc_timestamp = line.rstrip("\n").split("\t")
+			if replaced is not None and uid in entries and entries[uid][0] != shard_name:
+				replaced.add(uid)
+			entries[uid] = (shard_name, int(offset), int(length), int(tweet_count), utc_timestamp)
+	return entries
+
+class ArchivedTimeline():
+	''' One archived timeline, with the same user_id / utc_timestamp / tweets() interface as TimelineFile. Its tweets are
+	read from the (open) shard file when they're asked for '''
+
+	def __init__(self, uid, utc_timestamp, compression, shard_file, offset, length):
+		self.header = {"user_id": uid, "utc_timestamp": utc_timestamp}
+		self.compression = compression
+		self.shard_file = shard_file
+		self.offset = offset
+		self.length = length
+
+	@property
+	def user_id(self):
+		return self.header["user_id"]
+
+	@property
+	def utc_timestamp(self):
+		return self.header["utc_timestamp"]
+
+	def tweets(self, raw=False):
+		lines = open_member(self.compression, self.shard_file, self.offset, self.length)
+		return walk_ndjson(lines, self.header, True, raw)
+
+class TimelineArchive():
+
+	def __init__(self, archive_dir):
+		self.archive_dir = archive_dir
+		self.replaced = set()
+		self.entries = read_index(archive_dir, self.replaced)
+		self.shards = {}
+
+	def __contains__(self, uid):
+		return str(uid) in self.entries
+
+	def __len__(self):
+		return len(self.entries)
+
+	def get_shard_names(self):
+		return sorted(set(entry[0] for entry in self.entries.values()))
+
+	def get_uids(self, shard_name=None):
+		return [uid for uid, entry in self.entries.items() if shard_name is None or entry[0] == shard_name]
+
+	def get_replaced_uids(self, shard_name):
+		''' uids in this shard with an older copy in an earlier one, which an uploader has to unload first '''
+		return [uid for uid in self.get_uids(shard_name) if uid in self.replaced]
+
+	def read(self, uid, shard_file=None):
+		shard_name, offset, length, tweet_count, utc_timestamp = self.entries[str(uid)]
+		if shard_file is None:
+			if shard_name not in self.shards:
+				self.shards[shard_name] = open(os.path.join(self.archive_dir, shard_name), "rb")
+			shard_file = self.shards[shard_name]
+		return ArchivedTimeline(str(uid), utc_timestamp, get_shard_compression(shard_name), shard_file, offset, length)
+
+	def get(self, uid):
+		''' Random access to one user's timeline (None if it isn't archived) '''
+		return self.read(uid) if uid in self else None
+
+	def timelines(self, shard_name=None):
+		''' Every timeline (or every one in one shard) in file order, reading each shard front to back. A timeline's
+		tweets have to be read before the next timeline is asked for: each shard's file is closed once it's done '''
+		for name in ([shard_name] if shard_name else self.get_shard_names()):
+			uids = sorted(self.get_uids(name), key=lambda uid: self.entries[uid][1])
+			with open(os.path.join(self.archive_dir, name), "rb") as shard_file:
+				for uid in uids:
+					yield self.read(uid, shard_file)
+
+	def close(self):
+		for shard_file in self.shards.values():
+			shard_file.close()
+		self.shards = {}
+
+
+## The uploaders' view: a "source" is either a timeline file or an archive shard
+
+def is_archive(directory):
+	return os.path.exists(os.path.join(directory, INDEX_FILE_NAME))
+
+def is_archive_shard(path):
+	return os.path.basename(path).startswith(SHARD_PREFIX) and is_archive(os.path.dirname(path))
+
+@functools.lru_cache(maxsize=None)
+def get_archive(directory):
+	''' One TimelineArchive per directory, so index.tsv is parsed once per run rather than once per shard and call
+	(forked workers inherit the parsed index). Its shard files are opened by each caller, never shared through here '''
+	return TimelineArchive(directory)
+
+def list_timeline_sources(directory):
+	''' The shards of an archive directory, or the timeline files in any other directory '''
+	if is_archive(directory):
+		return [os.path.join(directory, shard_name) for shard_name in get_archive(directory).get_shard_names()]
+	return list_timeline_files(directory)
+
+def read_timelines(path):
+	''' Every timeline in a source: the one in a timeline file, or the current ones in an archive shard '''
+	if is_archive_shard(path):
+		return get_archive(os.path.dirname(path)).timelines(os.path.basename(path))
+	return [TimelineFile(path)]
+
+def get_timeline_uids(path):
+	''' The uids whose timelines a source holds (timeline files are named by user_id) '''
+	if is_archive_shard(path):
+		return get_archive(os.path.dirname(path)).get_uids(os.path.basename(path))
+	return [os.path.basename(path).split(".")[0]]
+
+def get_replaced_uids(path):
+	''' The uids a source holds a newer copy of than an earlier (already loaded) source did '''
+	if is_archive_shard(path):
+		return get_archive(os.path.dirname(path)).get_replaced_uids(os.path.basename(path))
+	return [] ## a rewritten timeline file is the same source, which the manifest reloads (and unloads) itself
+
+def read_sources(archive_dir):
+	''' {uid: (size, mtime)} of the timeline file each uid was last converted from, latest line winning '''
+	sources = {}
+	sources_path = os.path.join(archive_dir, SOURCES_FILE_NAME)
+	if not os.path.exists(sources_path):
+		return sources
+	with open(sources_path) as f:
+		for line in f:
+			if not line.endswith("\n"):
+				break
+			uid, size, mtime = line.rstrip("\n").split("\t")
+			sources[uid] = (int(size), float(mtime))
+	return sources
+
+def get_directory_size(directory):
+	if not os.path.isdir(directory):
+		return 0
+	return sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+
+
+if __name__ == "__main__":
+	arg_parser = argparse.ArgumentParser()
+	arg_parser.add_argument("json_files_dir")
+	arg_parser.add_argument("archive_dir")
+	arg_parser.add_argument("--compression", default=DEFAULT_COMPRESSION, choices=["gz", "zst"])
+	arg_parser.add_argument("--shard-mb", type=int, default=SHARD_BYTES >> 20)
+	args = arg_parser.parse_args()
+
+	start = time.time()
+	paths = list_timeline_files(args.json_files_dir)
+	archive_bytes = get_directory_size(args.archive_dir)
+	with ArchiveWriter(args.archive_dir, args.compression, args.shard_mb << 20) as archive:
+		archived_uids = archive.get_uids()
+		sources = read_sources(args.archive_dir)
+		with open(os.path.join(args.archive_dir, SOURCES_FILE_NAME), "a+") as sources_file:
+			drop_torn_line(sources_file)
+			for count, path in enumerate(paths, 1):
+				uid = os.path.basename(path).split(".")[0]
+				stat = os.stat(path)
+				## A file refreshed since it was converted is archived again, its new entry replacing the old one
+				if uid not in archived_uids or sources.get(uid) != (stat.st_size, stat.st_mtime):
+					timeline = TimelineFile(path)
+					archive.add_timeline(uid, timeline.utc_timestamp, timeline.tweets())
+					sources_file.write("\t".join([uid, str(stat.st_size), repr(stat.st_mtime)]) + "\n")
+					sources_file.flush()
+				if count % 1000 == 0:
+					print("{count}/{total} files in {elapsed:.0f}s".format(count=count, total=len(paths), elapsed=time.time() - start))
+
+	input_bytes = sum(os.path.getsize(path) for path in paths)
+	archive_bytes = get_directory_size(args.archive_dir) - archive_bytes
+	print("{files} files, {input_mb:.1f} MB -> {archive_mb:.1f} MB in {elapsed:.0f}s".format(
+		files=len(paths),
+		input_mb=input_bytes / float(1 << 20),
+		archive_mb=archive_bytes / float(1 << 20),
+		elapsed=time.time() - start))
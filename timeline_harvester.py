@@ -0,0 +1,119 @@
+'''
+Collects the CAP most recent tweets for each user in a list, like get_historic_tweets.py, but several users at a
+time and across any number of credential files. Requests go to whichever token still has budget in its current
+rate-limit window (read from the response headers), so nothing sleeps until every token is spent.
+
+Each user's file is written page by page as the tweets arrive (see timeline_writer.py), as <uid>.json by default
+or e.g. <uid>.ndjson.gz with --format ndjson.gz. With --archive the timelines go into a sharded archive in the
+output directory instead (see timeline_archive.py; --format is then gz or zst). Users whose file is already in the
+output directory (or archive) are skipped.
+
+Usage: python timeline_harvester.py input_list_of_ids.csv output_json_dir/ twitter_config_1.txt [twitter_config_2.txt ...] [--threads N] [--format FORMAT] [--archive] [--api-url URL] [--metrics-dir DIR]
+'''
+
+import argparse
+import csv
+import datetime
+from multiprocessing.pool import ThreadPool
+import os
+import metrics
+import requests
+import sys
+from timeline_archive import ArchiveWriter, DEFAULT_COMPRESSION
+from timeline_reader import TIMELINE_EXTENSIONS
+from timeline_writer import DEFAULT_FORMAT, TimelineWriter
+import time
+from twitter_client import API_URL, Token, TokenPool, TwitterClient, TwitterError
+
+CAP = 3200 ## How many tweets to get per user (set to None for however many the API will page back through)
+THREADS_PER_TOKEN = 2 ## Default --threads is this times the number of credential files
+
+def harvest_user(client, uid, output_dir, output_format=DEFAULT_FORMAT, archive=None):
+	''' Fetches one user's timeline into <uid>.<output_format> (or the archive). Returns (uid, tweets collected or None, error or None) '''
+	utc_now = str(datetime.datetime.utcnow()) ## when we collected the tweets, stored as a string in the JSON
+	try:
+		if archive is not None:
+			writer = archive.timeline_writer(uid, utc_now)
+		else:
+			writer = TimelineWriter(output_dir, uid, utc_now, output_format)
+		with writer:
+			for page in client.user_timeline_pages(uid, cap=CAP):
+				writer.write_tweets(page)
+	except TwitterError as ex:
+		## 401 (protected) and 404 (deleted/suspended) users are expected; anything else is worth a look
+		return (uid, None, ex)
+	except requests.RequestException as ex:
+		## A dropped connection or a timeout fails this user (their partial file is removed), not the whole harvest
+		return (uid, None, ex)
+	return (uid, writer.tweet_count, None)
+
+def harvest(client, uids, output_dir, threads, output_format=DEFAULT_FORMAT, archive=None):
+	start = time.time()
+	pool = ThreadPool(threads)
+	collected = 0
+	try:
+		results = pool.imap_unordered(lambda uid: harvest_user(client, uid, output_dir, output_format, archive), uids)
+		for done_count, (uid, tweet_count, error) in enumerate(results, 1):
+			metrics.count("users_total", result="error" if error else "collected")
+			metrics.count("tweets_collected_total", tweet_count or 0)
+			metrics.log_event("user", uid=uid, tweets=tweet_count, error=str(error) if error else None)
+			metrics.flush()
+			if error:
+				print("{uid}: {error}".format(uid=uid, error=error))
+			else:
+				collected = collected + tweet_count
+				print("{uid}: {tweet_count} tweets collected ({done}/{total} users, {rate:.1f} users/min)".format(
+					uid=uid,
+					tweet_count=tweet_count,
+					done=done_count,
+					total=len(uids),
+					rate=done_count * 60 / (time.time() - start)))
+			sys.stdout.flush() # so print statements get printed to logs more quickly
+	finally:
+		pool.close()
+		pool.join()
+
+	print("{collected} tweets from {users} users in {elapsed:.0f}s".format(collected=collected, users=len(uids), elapsed=time.time() - start))
+	for limiter_metrics in client.pool.get_metrics():
+		print(limiter_metrics)
+
+if __name__ == "__main__":
+	arg_parser = argparse.ArgumentParser()
+	arg_parser.add_argument("input_list")
+	arg_parser.add_argument("output_dir")
+	arg_parser.add_argument("config_files", nargs="+", help="one Twitter credentials file per token")
+	arg_parser.add_argument("--threads", type=int, default=None, help="users fetched at once (default {per} per token)".format(per=THREADS_PER_TOKEN))
+	arg_parser.add_argument("--format", default=None, choices=TIMELINE_EXTENSIONS + ("gz", "zst"), help="output file format, or archive compression")
+	arg_parser.add_argument("--archive", action="store_true", help="write a sharded archive instead of one file per user")
+	arg_parser.add_argument("--api-url", default=API_URL)
+	arg_parser.add_argument("--metrics-dir", default=None, help="write JSON logs and a Prometheus file of the run's metrics here")
+	args = arg_parser.parse_args()
+	if args.metrics_dir:
+		metrics.configure(args.metrics_dir, "timeline_harvester")
+
+	pool = TokenPool([Token.from_config(config_file) for config_file in args.config_files])
+	client = TwitterClient(pool, api_url=args.api_url)
+
+	## Load list of uids to collect
+	all_uids = []
+	with open(args.input_list) as f:
+		reader = csv.reader(f)
+		for row in reader:
+			all_uids.append(row[0])
+
+	archive = ArchiveWriter(args.output_dir, args.format or DEFAULT_COMPRESSION) if args.archive else None
+
+	## Get a list of uids we've already collected by seeing which JSON files we have (so we don't collect on the same users twice)
+	if archive is not None:
+		completed_uids = archive.get_uids()
+	else:
+		completed_uids = set([fname.split('.')[0] for fname in os.listdir(args.output_dir)])
+	uids_remaining = [uid for uid in all_uids if uid not in completed_uids]
+	print(len(uids_remaining))
+
+	try:
+		harvest(client, uids_remaining, args.output_dir, args.threads or THREADS_PER_TOKEN * len(pool.tokens), args.format or DEFAULT_FORMAT, archive)
+	finally:
+		if archive is not None:
+			archive.close()
+		metrics.close()
@@ -0,0 +1,272 @@
+'''
+Reads the <uid>.json timeline files written by the collectors ({"user_id", "utc_timestamp", "historic_tweets"})
+one tweet at a time, so memory stays bounded by the largest single tweet instead of the whole file.
+
+Also reads the newline-delimited <uid>.ndjson files TimelineWriter writes (a {"user_id", "utc_timestamp"} header
+line, then one tweet per line), and either format compressed as .gz or .zst.
+
+A tweet was collected at its file's utc_timestamp, unless it carries one of its own: a file rewritten with newer
+tweets on top (see get_historic_tweets_from_date.py --refresh) keeps the older tweets' collection time on each of
+them. get_collected_at gives the one that applies.
+
+Example:
+
+timeline = TimelineFile("json_data_2/12345.json")
+print(timeline.user_id, timeline.utc_timestamp)
+for tweet in timeline.tweets():
+	print(tweet["id_str"], get_collected_at(timeline, tweet))
+
+## raw=True also gives each top-level member's original JSON text, e.g. raw_members["user"]
+for tweet, raw_members in timeline.tweets(raw=True):
+	print(raw_members["entities"])
+
+for path in list_timeline_files("json_data_2"):
+	print(TimelineFile(path).user_id)
+
+'''
+
+import gzip
+import io
+import json
+import os
+import re
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+READ_CHUNK_SIZE = 1 << 16
+TWEETS_KEY = "historic_tweets"
+HEADER_KEYS = ("user_id", "utc_timestamp")
+TWEET_TIMESTAMP_KEY = "utc_timestamp" ## On a tweet kept from an earlier collection of its file (Twitter's tweets have no such key)
+## <uid>.<extension> for every format TimelineFile reads
+TIMELINE_EXTENSIONS = ("json", "json.gz", "json.zst", "ndjson", "ndjson.gz", "ndjson.zst")
+WHITESPACE = " \t\n\r"
+WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+
+def open_compressed(path, mode="r"):
+	''' Opens a text file for reading ("r") or writing ("w"), gzip- or zstd-compressed by its extension '''
+	if path.endswith(".gz"):
+		return gzip.open(path, mode + "t", encoding="utf-8")
+	if path.endswith(".zst"):
+		assert zstandard is not None, "The zstandard package is needed for .zst files"
+		if mode == "r":
+			return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb")), encoding="utf-8")
+		return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, "wb")), encoding="utf-8")
+	return open(path, mode, encoding="utf-8")
+
+def get_timeline_extension(file_name):
+	''' "12345.ndjson.gz" -> "ndjson.gz", or None if it isn't a timeline file (hidden files are in-progress writes) '''
+	if file_name.startswith("."):
+		return None
+	parts = file_name.split(".", 1)
+	return parts[1] if len(parts) == 2 and parts[1] in TIMELINE_EXTENSIONS else None
+
+def list_timeline_files(directory):
+	return [os.path.join(directory, f) for f in os.listdir(directory) if get_timeline_extension(f)]
+
+def get_collected_at(timeline, tweet):
+	''' The utc_timestamp the tweet was collected at (see above) '''
+	return tweet.get(TWEET_TIMESTAMP_KEY) or timeline.utc_timestamp
+
+def skip_whitespace(s, idx):
+	return WHITESPACE_RE.match(s, idx).end()
+
+def scan_object(scan_once, s, idx):
+	''' Decodes the object at s[idx] member by member, returning ((object, {key: raw member text}), end) '''
+	if s[idx:idx + 1] != "{":
+		raise ValueError("Expected '{' at " + str(idx))
+	obj = {}
+	raw_members = {}
+
+	idx = skip_whitespace(s, idx + 1)
+	if s[idx:idx + 1] == "}":
+		return (obj, raw_members), idx + 1
+
+	try:
+		while True:
+			if s[idx:idx + 1] != '"':
+				raise ValueError("Expected property name at " + str(idx))
+			key, idx = scan_once(s, idx)
+
+			idx = skip_whitespace(s, idx)
+			if s[idx:idx + 1] != ":":
+				raise ValueError("Expected ':' at " + str(idx))
+
+			start = skip_whitespace(s, idx + 1)
+			value, idx = scan_once(s, start)
+			obj[key] = value
+			raw_members[key] = s[start:idx]
+
+			idx = skip_whitespace(s, idx)
+			char = s[idx:idx + 1]
+			if char == "}":
+				return (obj, raw_members), idx + 1
+			if char != ",":
+				raise ValueError("Expected ',' or '}' at " + str(idx))
+			idx = skip_whitespace(s, idx + 1)
+	except StopIteration as ex:
+		## scan_once signals "no value starts here" (e.g. the buffer ends mid-object) with StopIteration
+		raise ValueError("Expecting value at " + str(ex.value))
+
+def walk_ndjson(lines, header, yield_tweets=True, raw=False):
+	''' Reads the header line into header, then yields one tweet per line '''
+	lines = iter(lines)
+	header.update(json.loads(next(lines, "") or "{}"))
+	if not yield_tweets:
+		return
+	decoder = json.JSONDecoder()
+	for line in lines:
+		if not line.strip():
+			continue
+		if raw:
+			yield scan_object(decoder.scan_once, line, skip_whitespace(line, 0))[0]
+		else:
+			yield json.loads(line)
+
+
+class JsonStream():
+	''' Incremental reader over a file holding a single JSON document '''
+
+	def __init__(self, f, chunk_size=READ_CHUNK_SIZE):
+		self.f = f
+		self.chunk_size = chunk_size
+		self.buffer = ""
+		self.pos = 0
+		self.eof = False
+		self.decoder = json.JSONDecoder()
+
+	def read_more(self, min_size=0):
+		if self.eof:
+			return False
+
+		## Drop everything we've already consumed before appending the next chunk
+		self.buffer = self.buffer[self.pos:]
+		self.pos = 0
+
+		data = self.f.read(max(self.chunk_size, min_size))
+		if not data:
+			self.eof = True
+			return False
+
+		self.buffer = self.buffer + data
+		return True
+
+	def peek(self):
+		''' Skips whitespace and returns the next character ("" at the end of the file) '''
+		while True:
+			while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+				self.pos = self.pos + 1
+			if self.pos < len(self.buffer):
+				return self.buffer[self.pos]
+			if not self.read_more():
+				return ""
+
+	def expect(self, chars):
+		char = self.peek()
+		if not char or char not in chars:
+			raise ValueError("Expected one of '{chars}' but found '{char}' in {name}".format(
+				chars=chars,
+				char=char,
+				name=getattr(self.f, "name", "stream")))
+		self.pos = self.pos + 1
+		return char
+
+	def value(self):
+		''' Decodes the next complete JSON value '''
+		return self.decode(self.decoder.raw_decode)
+
+	def raw_object(self):
+		''' Decodes the next JSON object, returning (object, {key: raw member text}) '''
+		return self.decode(lambda s, idx: scan_object(self.decoder.scan_once, s, idx))
+
+	def decode(self, decode_at):
+		self.peek()
+		while True:
+			try:
+				value, end = decode_at(self.buffer, self.pos)
+				## A number cut off at the end of the buffer still decodes, so only trust a value that has something after it
+				if end < len(self.buffer) or self.eof:
+					self.pos = end
+					return value
+			except ValueError:
+				if self.eof:
+					raise
+			## Grow the buffer geometrically so a value larger than one chunk isn't re-decoded over and over
+			self.read_more(len(self.buffer) - self.pos)
+
+
+class TimelineFile():
+
+	def __init__(self, path, chunk_size=READ_CHUNK_SIZE):
+		self.path = path
+		self.chunk_size = chunk_size
+		self.header = {}
+
+	def is_ndjson(self):
+		return (get_timeline_extension(os.path.basename(self.path)) or "").startswith("ndjson")
+
+	def walk(self, yield_tweets=True, raw=False):
+		if self.is_ndjson():
+			return self.walk_lines(yield_tweets, raw)
+		return self.walk_object(yield_tweets, raw)
+
+	def walk_lines(self, yield_tweets=True, raw=False):
+		with open_compressed(self.path) as f:
+			for tweet in walk_ndjson(f, self.header, yield_tweets, raw):
+				yield tweet
+
+	def walk_object(self, yield_tweets=True, raw=False):
+		''' Walks the top-level object, recording header keys and yielding each tweet from the tweets array '''
+		with open_compressed(self.path) as f:
+			stream = JsonStream(f, self.chunk_size)
+			stream.expect("{")
+			if stream.peek() == "}":
+				return
+
+			while True:
+				key = stream.value()
+				stream.expect(":")
+
+				if key == TWEETS_KEY:
+					stream.expect("[")
+					if stream.peek() == "]":
+						stream.expect("]")
+					else:
+						while True:
+							tweet = stream.raw_object() if raw else stream.value()
+							if yield_tweets:
+								yield tweet
+							if stream.expect(",]") == "]":
+								break
+				else:
+					self.header[key] = stream.value()
+					if not yield_tweets and self.has_header():
+						return
+
+				if stream.expect(",}") == "}":
+					break
+
+	def has_header(self):
+		return all(key in self.header for key in HEADER_KEYS)
+
+	def get_header(self):
+		## The collectors write the header first, so this usually stops after the first chunk.
+		## Files dumped from an unordered dict can have it after the tweets, in which case we read through them once.
+		if not self.has_header():
+			for tweet in self.walk(yield_tweets=False):
+				pass
+		return self.header
+
+	@property
+	def user_id(self):
+		return self.get_header().get("user_id")
+
+	@property
+	def utc_timestamp(self):
+		return self.get_header().get("utc_timestamp")
+
+	def tweets(self, raw=False):
+		''' Yields each tweet, or (tweet, {key: raw member text}) pairs with raw=True '''
+		return self.walk(yield_tweets=True, raw=raw)
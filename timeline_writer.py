@@ -0,0 +1,71 @@
+'''
+Writes a user's timeline file page by page as the tweets come in, instead of holding the whole timeline in a
+list for one json.dump at the end. The file is written under a hidden temporary name and only renamed to
+<uid>.<format> once it's complete, so a crash never leaves a truncated file that looks finished.
+
+Formats (see timeline_reader.TIMELINE_EXTENSIONS):
+	json     the collectors' usual {"user_id", "utc_timestamp", "historic_tweets": [...]}
+	ndjson   a {"user_id", "utc_timestamp"} header line, then one tweet per line
+and either with .gz or .zst (needs the zstandard package) for compression, e.g. "ndjson.gz".
+
+Example:
+
+with TimelineWriter("json_data_2", uid, str(datetime.datetime.utcnow()), "ndjson.gz") as writer:
+	for page in pages:
+		writer.write_tweets(page)
+## json_data_2/<uid>.ndjson.gz now exists; if the block raised, nothing was left behind
+
+'''
+
+from json_encoding import encode_json
+import os
+from timeline_reader import open_compressed, TIMELINE_EXTENSIONS, TWEETS_KEY
+
+DEFAULT_FORMAT = "json"
+
+class TimelineWriter():
+
+	def __init__(self, output_dir, uid, utc_timestamp, output_format=DEFAULT_FORMAT):
+		assert output_format in TIMELINE_EXTENSIONS, "Unknown timeline format: " + output_format
+		self.path = os.path.join(output_dir, str(uid) + "." + output_format)
+		## Hidden, so directory listings (and the collectors' "already done" check) skip it, and ending in the
+		## format's extension, since that's what open_compressed goes by
+		self.tmp_path = os.path.join(output_dir, "." + str(uid) + ".tmp." + output_format)
+		self.ndjson = output_format.startswith("ndjson")
+		self.tweet_count = 0
+
+		self.f = open_compressed(self.tmp_path, "w")
+		if self.ndjson:
+			self.f.write(encode_json({"user_id": uid, "utc_timestamp": utc_timestamp}) + "\n")
+		else:
+			## The header goes first so readers can get it without reading through the tweets
+			self.f.write(encode_json({"user_id": uid, "utc_timestamp": utc_timestamp})[:-1] + ',"' + TWEETS_KEY + '":[')
+
+	def write_tweets(self, tweets):
+		for tweet in tweets:
+			if self.ndjson:
+				self.f.write(encode_json(tweet) + "\n")
+			else:
+				self.f.write(("," if self.tweet_count else "") + encode_json(tweet))
+			self.tweet_count = self.tweet_count + 1
+
+	def close(self):
+		''' Finishes the file and moves it into place '''
+		if not self.ndjson:
+			self.f.write("]}")
+		self.f.flush()
+		self.f.close()
+		os.replace(self.tmp_path, self.path)
+
+	def abort(self):
+		self.f.close()
+		os.remove(self.tmp_path)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.abort()
@@ -0,0 +1,74 @@
+'''
+Parses the timestamp strings found in collected tweets into naive UTC datetime objects, which psycopg2 passes
+straight through to TIMESTAMP columns.
+
+Twitter's created_at ("Fri Aug 25 12:00:00 +0000 2017") and the collectors' utc_timestamp
+(str(datetime.datetime.utcnow()), i.e. "2017-09-01 12:00:00.123456") are parsed without dateutil; anything
+else falls back to dateutil's parser.
+
+Example:
+
+convert_timestring_to_timestamp("Fri Aug 25 12:00:00 +0000 2017") # datetime.datetime(2017, 8, 25, 12, 0)
+cached_convert_timestring_to_timestamp(timeline.utc_timestamp)    # same, memoized for values that repeat
+get_snowflake_id(datetime.datetime(2017, 8, 18))                  # the smallest tweet id from that time on
+
+'''
+
+import datetime
+from dateutil import parser
+import functools
+
+## How many distinct strings cached_convert_timestring_to_timestamp remembers
+TIMESTAMP_CACHE_SIZE = 4096
+
+TWITTER_EPOCH_MS = 1288834974657 ## Snowflake ids count milliseconds from here, in their bits above SNOWFLAKE_TIME_SHIFT
+SNOWFLAKE_TIME_SHIFT = 22
+
+TWITTER_MONTHS = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6, "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}
+
+def to_naive_utc(timestamp):
+	if timestamp.tzinfo is not None:
+		timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+	return timestamp
+
+def parse_twitter_timestamp(datetimestr):
+	''' Parses Twitter's "%a %b %d %H:%M:%S +0000 %Y" layout by position, returns None if it doesn't match '''
+	if len(datetimestr) != 30 or datetimestr[19:26] != " +0000 ":
+		return None
+	try:
+		return datetime.datetime(
+			int(datetimestr[26:30]),
+			TWITTER_MONTHS[datetimestr[4:7]],
+			int(datetimestr[8:10]),
+			int(datetimestr[11:13]),
+			int(datetimestr[14:16]),
+			int(datetimestr[17:19]))
+	except (KeyError, ValueError):
+		return None
+
+def convert_timestring_to_timestamp(datetimestr):
+	if not datetimestr:
+		return None
+
+	timestamp = parse_twitter_timestamp(datetimestr)
+	if timestamp is not None:
+		return timestamp
+
+	try:
+		return to_naive_utc(datetime.datetime.fromisoformat(datetimestr))
+	except ValueError:
+		pass
+
+	return to_naive_utc(parser.parse(datetimestr))
+
+def get_snowflake_id(timestamp):
+	''' The smallest tweet id created at or after a naive UTC datetime, so created_at >= timestamp is id >= this '''
+	epoch_ms = (timestamp - datetime.datetime(1970, 1, 1)) // datetime.timedelta(milliseconds=1)
+	return max(epoch_ms - TWITTER_EPOCH_MS, 0) << SNOWFLAKE_TIME_SHIFT
+
+def get_snowflake_timestamp(tweet_id):
+	''' When a tweet was created, to the millisecond, from its id alone '''
+	return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=(tweet_id >> SNOWFLAKE_TIME_SHIFT) + TWITTER_EPOCH_MS)
+
+## For values that repeat across many tweets (a file's utc_timestamp, a user's created_at)
+cached_convert_timestring_to_timestamp = functools.lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)(convert_timestring_to_timestamp)
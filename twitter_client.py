@@ -0,0 +1,158 @@
+'''
+A small REST client for the Twitter 1.1 endpoints the collectors use, spreading requests over several sets of
+credentials. Each token keeps its own RateLimiter per endpoint, fed by the x-rate-limit-* response headers, so a
+request goes to whichever token can send one soonest and only waits when every token is spent, and only until the
+earliest real reset.
+
+Example:
+
+pool = TokenPool([Token.from_config("config/twitter_config_1.txt"), Token.from_config("config/twitter_config_2.txt")])
+client = TwitterClient(pool)
+tweets = client.user_timeline("12345", cap=3200)
+users = client.lookup_users(["12345", "67890"])   # up to 100 ids per request; missing ids are suspended or deleted
+print(pool.get_metrics())
+
+## Against a local fake server (see fake_twitter_server.py)
+client = TwitterClient(pool, api_url="http://127.0.0.1:8000/1.1")
+
+'''
+
+import metrics
+from rate_limiter import RateLimiter
+import requests
+import threading
+import time
+from tweepy.auth import OAuthHandler
+
+API_URL = "https://api.twitter.com/1.1"
+USER_TIMELINE = "statuses/user_timeline"
+USERS_LOOKUP = "users/lookup"
+USERS_SHOW = "users/show"
+LOOKUP_BATCH_SIZE = 100 ## the most ids users/lookup takes per request
+NO_MATCHING_USERS = 17 ## the error code users/lookup gives when none of the ids exist
+REQUEST_TIMEOUT = 60 ## seconds
+PAGE_SIZE = 200 ## the most tweets user_timeline returns per request
+
+class TwitterError(Exception):
+
+	def __init__(self, status_code, api_code=None, message=""):
+		Exception.__init__(self, "{status_code} (code {api_code}): {message}".format(status_code=status_code, api_code=api_code, message=message))
+		self.status_code = status_code
+		self.api_code = api_code
+
+class Token():
+
+	def __init__(self, name, auth):
+		self.name = name
+		self.auth = auth
+		self.limiters = {} ## endpoint -> RateLimiter
+
+	@classmethod
+	def from_config(cls, config_file):
+		## The file should have the consumer key, consumer secret, access token, and access token secret in that order, separated by newlines.
+		consumer_key, consumer_secret, access_token, access_token_secret = open(config_file).read().split()[:4]
+		auth = OAuthHandler(consumer_key, consumer_secret)
+		auth.set_access_token(access_token, access_token_secret)
+		return cls(config_file, auth.apply_auth())
+
+	def get_limiter(self, endpoint):
+		if endpoint not in self.limiters:
+			self.limiters[endpoint] = RateLimiter(name=self.name + " " + endpoint)
+		return self.limiters[endpoint]
+
+class TokenPool():
+
+	def __init__(self, tokens):
+		assert tokens, "A TokenPool needs at least one token"
+		self.tokens = tokens
+		self.lock = threading.Lock()
+
+	def acquire(self, endpoint):
+		''' Blocks until some token can send a request to endpoint, then counts it against that token and returns it '''
+		while True:
+			with self.lock:
+				now = time.time()
+				delay, token = min(((token.get_limiter(endpoint).get_delay(now), token) for token in self.tokens), key=lambda pair: pair[0])
+				if delay <= 0:
+					token.get_limiter(endpoint).take()
+					return token
+				token.get_limiter(endpoint).record_wait(delay)
+			time.sleep(delay)
+
+	def get_metrics(self):
+		return [limiter.get_metrics() for token in self.tokens for limiter in token.limiters.values()]
+
+class TwitterClient():
+
+	def __init__(self, pool, api_url=API_URL):
+		self.pool = pool
+		self.api_url = api_url
+		## requests sessions aren't guaranteed to be thread safe, so each thread gets its own
+		self.local = threading.local()
+
+	def get_session(self):
+		if not hasattr(self.local, "session"):
+			self.local.session = requests.Session()
+		return self.local.session
+
+	def get(self, endpoint, params):
+		url = self.api_url + "/" + endpoint + ".json"
+		while True:
+			token = self.pool.acquire(endpoint)
+			with metrics.timer("api_request", endpoint=endpoint):
+				response = self.get_session().get(url, params=params, auth=token.auth, timeout=REQUEST_TIMEOUT)
+			metrics.count("api_responses_total", endpoint=endpoint, status=response.status_code)
+			metrics.count("api_bytes_read_total", int(response.headers.get("content-length") or 0), endpoint=endpoint)
+			if response.status_code == 429:
+				## This token's window is spent (e.g. shared with another process); retry on another token or after the reset
+				token.get_limiter(endpoint).rate_limited(response.headers)
+				continue
+
+			token.get_limiter(endpoint).update(response.headers)
+			if response.status_code != 200:
+				api_code, message = None, response.text
+				try:
+					error = response.json()["errors"][0]
+					api_code, message = error.get("code"), error.get("message")
+				except (ValueError, KeyError, IndexError, TypeError):
+					pass
+				raise TwitterError(response.status_code, api_code, message)
+			return response.json()
+
+	def user_timeline_pages(self, uid, cap=None, max_id=None, since_id=None):
+		''' Yields the user's tweets a page at a time, newest first, paging back from max_id (inclusive) and stopping at since_id (exclusive), cap, or the end of the timeline '''
+		tweet_count = 0
+		params = {"user_id": uid, "count": PAGE_SIZE}
+		if since_id:
+			params["since_id"] = since_id
+		while True:
+			if max_id:
+				params["max_id"] = max_id
+			page = self.get(USER_TIMELINE, params)
+			if not page:
+				return
+			if cap and tweet_count + len(page) >= cap:
+				yield page[:cap - tweet_count]
+				return
+			yield page
+			tweet_count = tweet_count + len(page)
+			max_id = min(tweet["id"] for tweet in page) - 1
+
+	def user_timeline(self, uid, cap=None, max_id=None, since_id=None):
+		tweets = []
+		for page in self.user_timeline_pages(uid, cap, max_id, since_id):
+			tweets.extend(page)
+		return tweets
+
+	def lookup_users(self, uids):
+		''' User objects for the ids (at most LOOKUP_BATCH_SIZE) that exist and aren't suspended, in no particular order '''
+		assert len(uids) <= LOOKUP_BATCH_SIZE, "users/lookup takes at most {size} ids".format(size=LOOKUP_BATCH_SIZE)
+		try:
+			return self.get(USERS_LOOKUP, {"user_id": ",".join(str(uid) for uid in uids), "include_entities": "false"})
+		except TwitterError as ex:
+			if ex.status_code == 404 and ex.api_code == NO_MATCHING_USERS:
+				return []
+			raise
+
+	def show_user(self, uid):
+		return self.get(USERS_SHOW, {"user_id": uid, "include_entities": "false"})
@@ -1,245 +1,230 @@
 '''
-Usage python upload_flat_tweet_table.py db_config.txt json_files_dir
+Usage python upload_flat_tweet_table.py db_config.txt json_files_dir [--workers N] [--metrics-dir DIR]
+      python upload_flat_tweet_table.py json_files_dir --export-dir DIR [--export-format parquet|arrow] [--metrics-dir DIR]
+
+json_files_dir can also be an archive directory (see timeline_archive.py), in which case each shard is loaded as one file.
+
+With --export-dir the rows go into a Timelines.parquet (or .arrows) file there instead of the database (see table_sinks.py).
+
+With FLAT_USER_COLUMNS = False, Timelines keeps only user_id of the tweet's user, and each version of a user's profile is
+one TimelineUsers row instead (see user_dimension.py).
 '''
 
+import argparse
 import datetime
-from dateutil import parser
-import json
-import os
+import itertools
+from json_encoding import encode_json
+from load_manifest import LoadManifest
+import metrics
+import parallel_loader
 import psycopg2
-from psycopg2 import extras as ext
-from sql_utils import Field, Table
+from sql_utils import Field, Index, KEEP_FIRST, KEEP_LATEST, Table
 import sys
+from table_sinks import export_files, PostgresSink, SINK_CLASSES
+from timeline_archive import get_replaced_uids, get_timeline_uids, list_timeline_sources, read_timelines
+from timeline_reader import get_collected_at
 import time
+from timestamp_utils import cached_convert_timestring_to_timestamp, convert_timestring_to_timestamp
+from user_dimension import get_user_table, UserVersions
 
 TABLE_NAME = "Timelines"
-DROP_EXISTING_TABLES = True
+DROP_EXISTING_TABLES = False ## Files already loaded are skipped through the load manifest, so there's no need to start over
+USE_COPY = True ## Bulk load with COPY FROM STDIN (set to False to fall back to execute_batch INSERTs)
+ON_CONFLICT = KEEP_LATEST ## For tweets already loaded from another file: KEEP_LATEST (by collection time), KEEP_FIRST, or None to fail the file
+DEFER_INDEXES = True ## Build secondary indexes after the load (concurrently, side by side) instead of maintaining them during it
+PARTITION_MONTHS = None ## e.g. ("2017-01", "2018-12") to range-partition Timelines by created_ts, one partition per month
+RAW_JSON_PASSTHROUGH = True ## Load JSON columns with the tweet's original text instead of decoding and re-encoding it
+## Copy the user JSON and user_* columns onto every row; with False they go into USER_TABLE_NAME once per profile version
+FLAT_USER_COLUMNS = True
+USER_TABLE_NAME = "TimelineUsers"
 
-db_config = sys.argv[1]
-input_json_dir = sys.argv[2]
+def clean(text):
+	return text.replace("\x00", "") if text else None
 
 # Create table objects
+## Each field declares where its value comes from in a tweet, so rows are built by tweet_table.extract_row
 tweet_table_fields = [
-	Field("tweetId", "BIGINT", is_primary_key=True),
-	Field("user_timeline_collected_at", "VARCHAR(64)"),
-	Field("user_timeline_collected_ts", "TIMESTAMP"),
-	Field("created_at", "VARCHAR(64)"),
-	Field("created_ts", "TIMESTAMP"),
-	Field("lang", "VARCHAR(20)"),
-	Field("text", "VARCHAR(500)"),
-	Field("contributors", "JSON"),
-	Field("entities", "JSON"),
-	Field("expanded_url", "VARCHAR(256)"),
-	Field("filter_level", "VARCHAR(80)"),
-	Field("coordinates", "JSON"),
-	Field("place", "JSON"),
-	Field("possibly_sensitive", "BOOLEAN"),
-	Field("user", "JSON"),
-	Field("user_id", "BIGINT"),
-	Field("user_screen_name", "VARCHAR(140)"),
-	Field("user_follower_count", "BIGINT"),
-	Field("user_friends_count", "BIGINT"),
-	Field("user_statuses_count", "BIGINT"),
-	Field("user_favorites_count", "BIGINT"),
-	Field("user_geo_enabled", "BOOLEAN"),
-	Field("user_time_zone", "VARCHAR(100)"),
-	Field("user_description", "VARCHAR(512)"),
-	Field("user_location", "VARCHAR(512)"),
-	Field("user_created_at", "VARCHAR(64)"),
-	Field("user_created_ts", "TIMESTAMP"),
-	Field("user_lang", "VARCHAR(8)"),
-	Field("user_listed_count", "BIGINT"),
-	Field("user_name", "VARCHAR(140)"),
-	Field("user_url", "VARCHAR(512)"),
-	Field("user_utc_offset", "BIGINT"),
-	Field("user_verified", "BOOLEAN"),
-	Field("user_profile_use_background_image", "BOOLEAN"),
-	Field("user_default_profile_image", "BOOLEAN"),
-        Field("user_profile_sidebar_fill_color", "VARCHAR(26)"),
-	Field("user_profile_text_color", "VARCHAR(16)"),
-	Field("user_profile_sidebar_border_color", "VARCHAR(16)"),
-	Field("user_profile_background_color", "VARCHAR(16)"),
-	Field("user_profile_link_color", "VARCHAR(16)"),
-	Field("user_profile_image_url", "VARCHAR(256)"),
-	Field("user_profile_banner_url", "VARCHAR(256)"),
-	Field("user_profile_background_image_url", "VARCHAR(256)"),
-	Field("user_profile_background_tile", "BOOLEAN"),
-	Field("user_contributors_enabled", "BOOLEAN"),
-	Field("user_default_profile", "BOOLEAN"),
-	Field("user_id_translator", "BOOLEAN"),
-	Field("retweet_count", "BIGINT"),
-	Field("favorite_count", "BIGINT"),
-	Field("retweeted_status", "JSON"),
-	Field("retweeted_status_id", "BIGINT"),
-	Field("retweeted_status_user_screen_name", "VARCHAR(80)"),
-	Field("retweeted_status_retweet_count", "BIGINT"),
-	Field("retweeted_status_user_id", "BIGINT"),
-	Field("retweeted_status_user_time_zone", "VARCHAR(100)"),
-	Field("retweeted_status_user_friends_count", "BIGINT"),
-	Field("retweeted_status_user_statuses_count", "BIGINT"),
-	Field("retweeted_status_user_followers_count", "BIGINT"),
-	Field("source", "VARCHAR(500)"),
-	Field("in_reply_to_screen_name", "VARCHAR(500)"),
-	Field("in_reply_to_status_id", "BIGINT"),
-	Field("in_reply_to_user_id", "BIGINT"),
-	Field("quoted_status_id", "BIGINT"),
-	Field("quoted_status", "JSON"),
-	Field("truncated", "BOOLEAN")
+	Field("tweetId", "BIGINT", is_primary_key=True, path="id"),
+	Field("user_timeline_collected_at", "VARCHAR(64)", context_key="collected_at"),
+	Field("user_timeline_collected_ts", "TIMESTAMP", context_key="collected_ts"),
+	Field("created_at", "VARCHAR(64)", path="created_at"),
+	Field("created_ts", "TIMESTAMP", path="created_at", transform=convert_timestring_to_timestamp),
+	Field("lang", "VARCHAR(20)", path="lang"),
+	Field("text", "VARCHAR(500)", path="text", transform=clean),
+	Field("contributors", "JSON", path="contributors", transform=encode_json),
+	Field("entities", "JSON", path="entities", transform=encode_json),
+	Field("expanded_url", "VARCHAR(256)", path="entities.urls[0].expanded_url"),
+	Field("filter_level", "VARCHAR(80)", path="filter_level"),
+	Field("coordinates", "JSON", path="coordinates", transform=encode_json),
+	Field("place", "JSON", path="place", transform=encode_json),
+	Field("possibly_sensitive", "BOOLEAN", path="possibly_sensitive"),
+	Field("user", "JSON", path="user", transform=encode_json),
+	Field("user_id", "BIGINT", path="user.id"),
+	Field("user_screen_name", "VARCHAR(140)", path="user.screen_name"),
+	Field("user_follower_count", "BIGINT", path="user.followers_count"),
+	Field("user_friends_count", "BIGINT", path="user.friends_count"),
+	Field("user_statuses_count", "BIGINT", path="user.statuses_count"),
+	Field("user_favorites_count", "BIGINT", path="user.favourites_count"),
+	Field("user_geo_enabled", "BOOLEAN", path="user.geo_enabled"),
+	Field("user_time_zone", "VARCHAR(100)", path="user.time_zone"),
+	Field("user_description", "VARCHAR(512)", path="user.description"),
+	Field("user_location", "VARCHAR(512)", path="user.location"),
+	Field("user_created_at", "VARCHAR(64)", path="user.created_at"),
+	Field("user_created_ts", "TIMESTAMP", path="user.created_at", transform=cached_convert_timestring_to_timestamp),
+	Field("user_lang", "VARCHAR(8)", path="user.lang"),
+	Field("user_listed_count", "BIGINT", path="user.listed_count"),
+	Field("user_name", "VARCHAR(140)", path="user.name"),
+	Field("user_url", "VARCHAR(512)", path="user.url"),
+	Field("user_utc_offset", "BIGINT", path="user.utc_offset"),
+	Field("user_verified", "BOOLEAN", path="user.verified"),
+	Field("user_profile_use_background_image", "BOOLEAN", path="user.profile_use_background_image"),
+	Field("user_default_profile_image", "BOOLEAN", path="user.default_profile_image"),
+	Field("user_profile_sidebar_fill_color", "VARCHAR(26)", path="user.profile_sidebar_fill_color"),
+	Field("user_profile_text_color", "VARCHAR(16)", path="user.profile_text_color"),
+	Field("user_profile_sidebar_border_color", "VARCHAR(16)", path="user.profile_sidebar_border_color"),
+	Field("user_profile_background_color", "VARCHAR(16)", path="user.profile_background_color"),
+	Field("user_profile_link_color", "VARCHAR(16)", path="user.profile_link_color"),
+	Field("user_profile_image_url", "VARCHAR(256)", path="user.profile_image_url"),
+	Field("user_profile_banner_url", "VARCHAR(256)", path="user.profile_banner_url"),
+	Field("user_profile_background_image_url", "VARCHAR(256)", path="user.profile_background_image_url"),
+	Field("user_profile_background_tile", "BOOLEAN", path="user.profile_background_tile"),
+	Field("user_contributors_enabled", "BOOLEAN", path="user.contributors_enabled"),
+	Field("user_default_profile", "BOOLEAN", path="user.default_profile"),
+	Field("user_id_translator", "BOOLEAN", path="user.is_translator"),
+	Field("retweet_count", "BIGINT", path="retweet_count"),
+	Field("favorite_count", "BIGINT", path="favorite_count"),
+	Field("retweeted_status", "JSON", path="retweeted_status", transform=encode_json),
+	Field("retweeted_status_id", "BIGINT", path="retweeted_status.id"),
+	Field("retweeted_status_user_screen_name", "VARCHAR(80)", path="retweeted_status.user.screen_name"),
+	Field("retweeted_status_retweet_count", "BIGINT", path="retweeted_status.retweet_count"),
+	Field("retweeted_status_user_id", "BIGINT", path="retweeted_status.user.id"),
+	Field("retweeted_status_user_time_zone", "VARCHAR(100)", path="retweeted_status.user.time_zone"),
+	Field("retweeted_status_user_friends_count", "BIGINT", path="retweeted_status.user.friends_count"),
+	Field("retweeted_status_user_statuses_count", "BIGINT", path="retweeted_status.user.statuses_count"),
+	Field("retweeted_status_user_followers_count", "BIGINT", path="retweeted_status.user.followers_count"),
+	Field("source", "VARCHAR(500)", path="source"),
+	Field("in_reply_to_screen_name", "VARCHAR(500)", path="in_reply_to_screen_name"),
+	Field("in_reply_to_status_id", "BIGINT", path="in_reply_to_status_id"),
+	Field("in_reply_to_user_id", "BIGINT", path="in_reply_to_user_id"),
+	Field("quoted_status_id", "BIGINT", path="quoted_status_id"),
+	Field("quoted_status", "JSON", path="quoted_status", transform=encode_json),
+	Field("truncated", "BOOLEAN", path="truncated")
 ]
-tweet_table = Table(TABLE_NAME, tweet_table_fields)
-
-def batch_insert(cursor, table, rows):
-	fields_required = len(table.fields)
-	for row in rows:
-		assert len(row)==fields_required, "Row has incorrect number of fields: " + str(row)
-
-	ext.execute_batch(cursor, table.get_insert_statement(), rows)
+if not FLAT_USER_COLUMNS:
+	tweet_table_fields = [field for field in tweet_table_fields if not (field.path or "").startswith("user") or field.path == "user.id"]
+tweet_table = Table(TABLE_NAME, tweet_table_fields, version_field="user_timeline_collected_ts", indexes=[
+	Index(["created_ts"], method="brin"),
+	Index(["user_id"]),
+	Index(["entities"], method="gin")
+], partition_by="created_ts" if PARTITION_MONTHS else None)
+user_table = get_user_table(USER_TABLE_NAME)
 
 #####################################
 #####################################
 
-def clean(text):
-	return text.replace("\x00", "") if text else None
+def get_timeline_rows(timeline, user_versions=None):
+	''' Yields the timeline's rows, adding each tweet's user to user_versions if given '''
+	collected_at = timeline.utc_timestamp
+	collected_ts = cached_convert_timestring_to_timestamp(collected_at)
+
+	context = {"collected_at": collected_at, "collected_ts": collected_ts}
+
+	if RAW_JSON_PASSTHROUGH:
+		tweets = metrics.timed_iter(timeline.tweets(raw=True), "decode")
+	else:
+		tweets = ((tweet, None) for tweet in metrics.timed_iter(timeline.tweets(), "decode"))
+	for tweet, raw_members in tweets:
+		tweet_collected_at = get_collected_at(timeline, tweet)
+		tweet_context = context
+		if tweet_collected_at != collected_at:
+			## Kept from an earlier collection when the file was refreshed
+			tweet_context = {"collected_at": tweet_collected_at, "collected_ts": cached_convert_timestring_to_timestamp(tweet_collected_at)}
+		if user_versions is not None:
+			user_versions.add(tweet["user"], tweet_context["collected_ts"])
+		yield tweet_table.extract_row(tweet, tweet_context, raw_members)
+
+def load_timelines(sink, path):
+	user_versions = None if FLAT_USER_COLUMNS else UserVersions()
+
+	## Tuples are built lazily as the file is read, so only one COPY chunk (or row group) is held in memory at a time,
+	## even across the many timelines in an archive shard
+	tweet_tuples = itertools.chain.from_iterable(get_timeline_rows(timeline, user_versions) for timeline in read_timelines(path))
+	rows_loaded = {tweet_table.name: sink.write_rows(tweet_table, tweet_tuples)}
+	if user_versions is not None:
+		rows_loaded[user_table.name] = sink.write_rows(user_table, user_versions.rows)
+	return rows_loaded
+
+def load_file(cursor, path):
+	## An archive shard can hold a newer copy of a user loaded from an earlier shard
+	unload_users(cursor, get_replaced_uids(path))
+	return load_timelines(PostgresSink(cursor, on_conflict=ON_CONFLICT, use_copy=USE_COPY), path)
+
+def unload_users(cursor, user_ids):
+	if user_ids:
+		cursor.execute("DELETE FROM " + tweet_table.name + " WHERE \"user_id\" = ANY(%s)", ([int(user_id) for user_id in user_ids],))
+
+def unload_file(cursor, path):
+	## Removes the rows loaded from an earlier version of this file, for every user it holds
+	unload_users(cursor, get_timeline_uids(path))
 
-def convert_timestring_to_timestamp(datetimestr):
-        if datetimestr:
-                datetime = parser.parse(datetimestr)
-	        return datetime.strftime('%Y-%m-%d %H:%M:%S')
-
-def get_nested_value(_dict, path, default=None):
-	""" gets value from a nested value """
-	# step through each path and try to process it
-	parts = path.split(".")
-	num_parts = len(parts)
-	cur_dict = _dict
-	# step through each part of the path
-	try:
-		for i in range(0, num_parts - 1):
-			part = parts[i]
-			if part[0] >= ord('0') and part[0] <= ord('9'):
-				try:
-					part = int(part)
-				except ValueError:
-					pass
-			cur_dict = cur_dict[part]
-		return cur_dict[parts[num_parts - 1]]
-	except (KeyError, TypeError):
-		pass
-	return default
-
-def get_nested_value_json(_dict, path, default=None):
-		value = get_nested_value(_dict, path, default)
-		if value is not None:
-				return json.dumps(value)
-		return value
-
-## Connecting to the database
-config = {}
-for line in open(db_config).readlines():
-	key, value = line.strip().split("=")
-	config[key] = value
-db = psycopg2.connect(**config)
-cursor = db.cursor()
-
-## Creating tables in the database if they don't exist
-if DROP_EXISTING_TABLES:
-	cursor.execute(tweet_table.get_drop_statement(if_exists=True))
-
-print(tweet_table.get_create_statement(if_not_exists=True))
-cursor.execute(tweet_table.get_create_statement(if_not_exists=True))
-
-inserted_count = 0
-json_files = [f for f in os.listdir(input_json_dir) if (len(f) > 5 and f[-5:]==".json")]
-for f in json_files:
-	tweet_tuples = []
-
-	json_data = json.load(open(os.path.join(input_json_dir, f)))
-	tweets = json_data["historic_tweets"]
-
-	collected_at = json_data["utc_timestamp"]
-	collected_ts = convert_timestring_to_timestamp(collected_at)
-
-	for tweet in tweets:
-		tweet_tuple = (
-		get_nested_value(tweet, "id"),
-		collected_at,
-		collected_ts,
-		get_nested_value(tweet, "created_at"),
-		convert_timestring_to_timestamp(get_nested_value(tweet, "created_at")),
-		get_nested_value(tweet, "lang"),
-		clean(get_nested_value(tweet, "text")),
-		get_nested_value_json(tweet, "contributors"),
-		get_nested_value_json(tweet, "entities"),
-		get_nested_value(tweet, "entities.urls[0].expanded_url"),
-		get_nested_value(tweet, "filter_level"),
-		get_nested_value_json(tweet, "coordinates"),
-		get_nested_value_json(tweet, "place"),
-		get_nested_value(tweet, "possibly_sensitive"),
-		get_nested_value_json(tweet, "user"),
-		get_nested_value(tweet, "user.id"),
-		get_nested_value(tweet, "user.screen_name"),
-		get_nested_value(tweet, "user.followers_count"),
-		get_nested_value(tweet, "user.friends_count"),
-		get_nested_value(tweet, "user.statuses_count"),
-		get_nested_value(tweet, "user.favourites_count"),
-		get_nested_value(tweet, "user.geo_enabled"),
-		get_nested_value(tweet, "user.time_zone"),
-		get_nested_value(tweet, "user.description"),
-		get_nested_value(tweet, "user.location"),
-		get_nested_value(tweet, "user.created_at"),
-		convert_timestring_to_timestamp(get_nested_value(tweet, "user.created_ts")),
-		get_nested_value(tweet, "user.lang"),
-		get_nested_value(tweet, "user.listed_count"),
-		get_nested_value(tweet, "user.name"),
-		get_nested_value(tweet, "user.url"),
-		get_nested_value(tweet, "user.utc_offset"),
-		get_nested_value(tweet, "user.verified"),
-		get_nested_value(tweet, "user.profile_use_background_image"),
-		get_nested_value(tweet, "user.default_profile_image"),
-		get_nested_value(tweet, "user.profile_sidebar_fill_color"),
-		get_nested_value(tweet, "user.profile_text_color"),
-		get_nested_value(tweet, "user.profile_sidebar_border_color"),
-		get_nested_value(tweet, "user.profile_background_color"),
-		get_nested_value(tweet, "user.profile_link_color"),
-		get_nested_value(tweet, "user.profile_image_url"),
-		get_nested_value(tweet, "user.profile_banner_url"),
-		get_nested_value(tweet, "user.profile_background_image_url"),
-		get_nested_value(tweet, "user.profile_background_tile"),
-		get_nested_value(tweet, "user.contributors_enabled"),
-		get_nested_value(tweet, "user.default_profile"),
-		get_nested_value(tweet, "user.is_translator"),
-		get_nested_value(tweet, "retweet_count"),
-		get_nested_value(tweet, "favorite_count"),
-		get_nested_value_json(tweet, "retweeted_status"),
-		get_nested_value(tweet, "retweeted_status.id"),
-		get_nested_value(tweet, "retweeted_status.user.screen_name"),
-		get_nested_value(tweet, "retweeted_status.retweet_count"),
-		get_nested_value(tweet, "retweeted_status.user.id"),
-		get_nested_value(tweet, "retweeted_status.user.time_zone"),
-		get_nested_value(tweet, "retweeted_status.user.friends_count"),
-		get_nested_value(tweet, "retweeted_status.user.statuses_count"),
-		get_nested_value(tweet, "retweeted_status.user.followers_count"),
-		get_nested_value(tweet, "source"),
-		get_nested_value(tweet, "in_reply_to_screen_name"),
-		get_nested_value(tweet, "in_reply_to_status_id"),
-		get_nested_value(tweet, "in_reply_to_user_id"),
-		get_nested_value(tweet, "quoted_status_id"),
-		get_nested_value_json(tweet, "quoted_status"),
-		get_nested_value(tweet, "truncated"))
-
-                tweet_tuples.append(tweet_tuple)
-                inserted_count = inserted_count + 1
-
-	batch_insert(cursor, tweet_table, tweet_tuples)
+#####################################
+#####################################
 
+if __name__ == "__main__":
+	arg_parser = argparse.ArgumentParser()
+	arg_parser.add_argument("db_config", nargs="?", default=None)
+	arg_parser.add_argument("json_files_dir")
+	arg_parser.add_argument("--workers", type=int, default=1, help="number of worker processes, each with its own connection")
+	arg_parser.add_argument("--export-dir", default=None, help="write the rows to a columnar file here instead of the database")
+	arg_parser.add_argument("--export-format", choices=sorted(SINK_CLASSES), default="parquet")
+	arg_parser.add_argument("--metrics-dir", default=None, help="write JSON logs and a Prometheus file of the run's metrics here")
+	args = arg_parser.parse_args()
+	if args.metrics_dir:
+		metrics.configure(args.metrics_dir, "upload_flat_tweet_table")
+
+	if args.export_dir:
+		## One file per table, so the files are read one after another by this process
+		tables = [tweet_table] if FLAT_USER_COLUMNS else [tweet_table, user_table]
+		export_files(SINK_CLASSES[args.export_format](args.export_dir, tables), list_timeline_sources(args.json_files_dir), load_timelines)
+		metrics.close()
+		sys.exit(0)
+	if args.db_config is None:
+		arg_parser.error("db_config is needed unless --export-dir is given")
+
+	## Connecting to the database
+	db = parallel_loader.connect(args.db_config)
+	cursor = db.cursor()
+
+	## Creating tables in the database if they don't exist
+	manifest = LoadManifest("upload_flat_tweet_table")
+	cursor.execute(manifest.table.get_create_statement(if_not_exists=True))
+	if DROP_EXISTING_TABLES:
+		cursor.execute(tweet_table.get_drop_statement(if_exists=True))
+		cursor.execute(user_table.get_drop_statement(if_exists=True))
+		manifest.clear(cursor)
+
+	print(tweet_table.get_create_statement(if_not_exists=True))
+	cursor.execute(tweet_table.get_create_statement(if_not_exists=True))
+	if not FLAT_USER_COLUMNS:
+		cursor.execute(user_table.get_create_statement(if_not_exists=True))
+	if PARTITION_MONTHS:
+		for statement in tweet_table.get_partition_statements(*PARTITION_MONTHS):
+			cursor.execute(statement)
+	for statement in tweet_table.get_index_statements(deferred=False if DEFER_INDEXES else None):
+		cursor.execute(statement)
 	db.commit()
-	inserted_count = inserted_count + len(tweet_tuples)
-	print(str(inserted_count) + " total inserted")
-	sys.stdout.flush() # so print statements get printed to logs more quickly
-
-print("Done!")
 
+	## <uid>.json files, the (compressed) .ndjson files the collectors can also write, or an archive's shards
+	json_paths = list_timeline_sources(args.json_files_dir)
 
+	## Only files that are new or changed since they were recorded get loaded
+	tasks = manifest.plan(cursor, json_paths)
+	db.commit()
 
+	parallel_loader.load_files(args.db_config, tasks, load_file, workers=args.workers, manifest=manifest, unload_file=unload_file)
 
+	if DEFER_INDEXES:
+		parallel_loader.run_statements(args.db_config, tweet_table.get_index_statements(deferred=True, concurrently=True), workers=args.workers)
 
+	metrics.close()
+	print("Done!")
@@ -3,17 +3,19 @@ Usage python upload_followers.py db_config.txt json_files_dir
 '''
 
 import datetime
-from dateutil import parser
 import json
 import os
 import psycopg2
 from psycopg2 import extras as ext
-from sql_utils import Field, Table
+from sql_utils import Field, Index, Table
 import sys
 import time
+from timestamp_utils import convert_timestring_to_timestamp
 
 TABLE_NAME = "Followers"
 DROP_EXISTING_TABLES = False
+DEFER_INDEXES = True ## Build secondary indexes after the load instead of maintaining them during it
+USE_COPY = True ## Bulk load with COPY FROM STDIN (set to False to fall back to execute_batch INSERTs)
 
 db_config = sys.argv[1]
 input_json_dir = sys.argv[2]
@@ -23,7 +25,10 @@ follower_fields = [
 	Field("user_id", "BIGINT"),
 	Field("follower_id", "BIGINT"),
 ]
-followers_table = Table(TABLE_NAME, follower_fields)
+followers_table = Table(TABLE_NAME, follower_fields, indexes=[
+	Index(["user_id"]),
+	Index(["follower_id"])
+])
 
 metadata_fields = [
 	Field("user_id", "BIGINT"),
@@ -34,6 +39,10 @@ metadata_fields = [
 metadata_table = Table(TABLE_NAME + "_metadata", metadata_fields)
 
 def batch_insert(cursor, table, rows):
+	if USE_COPY:
+		table.copy_rows(cursor, rows)
+		return
+
 	fields_required = len(table.fields)
 	for row in rows:
 		assert len(row)==fields_required, "Row has incorrect number of fields: " + str(row)
@@ -43,10 +52,6 @@ def batch_insert(cursor, table, rows):
 #####################################
 #####################################
 
-def convert_timestring_to_timestamp(datetimestr):
-	datetime = parser.parse(datetimestr)
-	return datetime.strftime('%Y-%m-%d %H:%M:%S')
-
 def get_nested_value(_dict, path, default=None):
 	""" gets value from a nested value """
 	# step through each path and try to process it
@@ -89,6 +94,8 @@ if DROP_EXISTING_TABLES:
 	cursor.execute(metadata_table.get_drop_statement(if_exists=TRUE))
 cursor.execute(followers_table.get_create_statement(if_not_exists=True))
 cursor.execute(metadata_table.get_create_statement(if_not_exists=True))
+for statement in followers_table.get_index_statements(deferred=False if DEFER_INDEXES else None):
+	cursor.execute(statement)
 
 inserted_count = 0
 json_files = [f for f in os.listdir(input_json_dir) if (len(f) > 5 and f[-5:]==".json")]
@@ -99,7 +106,7 @@ for f in json_files:
 	user_id = json_data["user_id"]
 
 	followers = json_data["followers"]
-        follower_tuples = [(user_id, follower_id) for follower_id in followers]
+	follower_tuples = [(user_id, follower_id) for follower_id in followers]
 
 	collected_at = json_data["utc_timestamp"]
 	collected_ts = convert_timestring_to_timestamp(collected_at)
@@ -114,9 +121,8 @@ for f in json_files:
 	print(str(inserted_count) + " total inserted")
 	sys.stdout.flush() # so print statements get printed to logs more quickly
 
-
-
-
-
-
-
+if DEFER_INDEXES:
+	for statement in followers_table.get_index_statements(deferred=True):
+		print(statement)
+		cursor.execute(statement)
+	db.commit()
@@ -0,0 +1,116 @@
+'''
+A user dimension table: one row per version of a user's profile, instead of a copy of the profile on every tweet.
+A version is identified by the user id and a hash of the profile's VERSION_KEYS, so the row for a profile only
+changes when the user edits it (a new name, description, location, ...), not every time their counts move.
+validFrom is the earliest collection time the version was seen at, and the counts are the ones seen then.
+
+UserVersions de-duplicates in memory: within a batch (e.g. a timeline, where every tweet carries the same user)
+each version becomes a single row, the one with the earliest validFrom (a refreshed timeline has its older tweets,
+collected earlier, after its new ones). Across batches the table's fixed KEEP_EARLIEST policy merges repeats away,
+keeping the earliest sighting whatever order the files are loaded in (or however many workers load them).
+
+Example:
+
+user_table = get_user_table(prefix="Geo_")                  # Geo_User
+cursor.execute(user_table.get_create_statement(if_not_exists=True))
+
+user_versions = UserVersions()
+for tweet in tweets:
+	user_versions.add(tweet["user"], collectedAt)
+sink.write_rows(user_table, user_versions.rows)
+
+'''
+
+import hashlib
+import json
+from sql_utils import Field, KEEP_EARLIEST, Table
+from timestamp_utils import cached_convert_timestring_to_timestamp
+
+USER_TABLE_NAME = "User"
+## The profile attributes that make up a version; the counts are left out, since they change all the time
+VERSION_KEYS = ["screen_name", "name", "description", "location", "url", "time_zone", "utc_offset", "lang", "verified", "protected", "geo_enabled", "created_at"]
+
+user_fields = [
+	Field("userId", "BIGINT", is_primary_key=True),
+	Field("profileHash", "VARCHAR(32)", is_primary_key=True),
+	Field("validFrom", "TIMESTAMP"),
+	Field("screenName", "VARCHAR(45)"),
+	Field("name", "VARCHAR(128)"),
+	Field("description", "TEXT"),
+	Field("location", "VARCHAR(256)"),
+	Field("url", "TEXT"),
+	Field("timeZone", "VARCHAR(45)"),
+	Field("utcOffset", "BIGINT"),
+	Field("lang", "VARCHAR(10)"),
+	Field("verified", "BOOLEAN"),
+	Field("protected", "BOOLEAN"),
+	Field("geoEnabled", "BOOLEAN"),
+	Field("createdAt", "TIMESTAMP"),
+	Field("followersCount", "BIGINT"),
+	Field("friendsCount", "BIGINT"),
+	Field("statusesCount", "BIGINT"),
+	Field("favoritesCount", "BIGINT")
+]
+
+def get_user_table(name=USER_TABLE_NAME, prefix=""):
+	## A version seen again (in another batch or file) keeps the row with the earliest validFrom
+	return Table(name, user_fields, prefix=prefix, version_field="validFrom", on_conflict=KEEP_EARLIEST)
+
+def clean(text):
+	return text.replace("\x00", "") if text else None
+
+def get_profile_hash(user):
+	## A fixed serialization rather than encode_json, whose output may differ between hosts (orjson or not),
+	## so a profile gets the same hash wherever it's loaded
+	values = json.dumps([user.get(key) for key in VERSION_KEYS], ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+	return hashlib.md5(values.encode("utf-8", "surrogatepass")).hexdigest()
+
+def get_user_tuple(user, profile_hash, validFrom):
+	return (
+		user["id_str"],
+		profile_hash,
+		validFrom,
+		clean(user.get("screen_name")),
+		clean(user.get("name")),
+		clean(user.get("description")),
+		clean(user.get("location")),
+		user.get("url"),
+		user.get("time_zone"),
+		user.get("utc_offset"),
+		user.get("lang"),
+		user.get("verified"),
+		user.get("protected"),
+		user.get("geo_enabled"),
+		cached_convert_timestring_to_timestamp(user["created_at"]) if user.get("created_at") else None,
+		user.get("followers_count"),
+		user.get("friends_count"),
+		user.get("statuses_count"),
+		user.get("favourites_count"))
+
+def is_earlier(validFrom, other):
+	## The same order as KEEP_EARLIEST's merge, where a row without a validFrom is always replaced
+	return validFrom is not None and (other is None or validFrom < other)
+
+class UserVersions():
+	''' Collects a row for each profile version into rows (which the loaders flush and empty), with the earliest validFrom seen '''
+
+	def __init__(self):
+		self.seen = {} ## (id_str, profile hash) -> (earliest validFrom, index of its row in rows)
+		self.rows = []
+
+	def add(self, user, validFrom):
+		profile_hash = get_profile_hash(user)
+		key = (user["id_str"], profile_hash)
+		seen = self.seen.get(key)
+		if seen is not None and not is_earlier(validFrom, seen[0]):
+			return
+
+		row = get_user_tuple(user, profile_hash, validFrom)
+		index = seen[1] if seen is not None else None
+		if index is not None and index < len(self.rows) and self.rows[index][:2] == key:
+			self.rows[index] = row
+		else:
+			## Not seen yet, or its row has been flushed since: the table's merge keeps the earlier of the two
+			index = len(self.rows)
+			self.rows.append(row)
+		self.seen[key] = (validFrom, index)